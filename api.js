@@ -6,7 +6,7 @@ console.log('🚀 API模块开始加载...');
 // 检查API是否可用
 async function checkAPI() {
     try {
-        const response = await fetch('http://192.168.80.131:5000/');
+        const response = await fetch(`${API_BASE}/health`);
         console.log('✅ 后端服务可用:', response.status);
         return true;
     } catch (error) {
@@ -23,12 +23,12 @@ async function apiRequest(endpoint, options = {}) {
         
         const config = {
             method: options.method || 'GET',
-            headers: {
-                'Content-Type': 'application/json',
-            }
+            headers: {}
         };
 
+        // 只有带请求体时才声明 JSON 类型：跨域 GET 不带该头即为简单请求，无需 CORS 预检
         if (options.body) {
+            config.headers['Content-Type'] = 'application/json';
             config.body = JSON.stringify(options.body);
         }
 
@@ -57,6 +57,11 @@ const hostsAPI = {
         return await apiRequest('/hosts');
     },
 
+    // 监控大屏数据：主机列表、告警阈值、概览统计和告警标记
+    async getDashboard() {
+        return await apiRequest('/dashboard');
+    },
+
     // 添加主机
     async addHost(hostData) {
         return await apiRequest('/hosts', {
@@ -84,7 +89,14 @@ const hostsAPI = {
 const metricsAPI = {
     // 获取所有监控数据
     async getMetrics() {
-        return await apiRequest('/metrics');
+        return await apiRequest('/metrics?format=json');
+    },
+
+    // 最近 seconds 秒的采样（后端内存环形缓冲，不查库），hostIp 可选
+    async getRecent(seconds = 300, hostIp = '') {
+        const params = new URLSearchParams({ seconds });
+        if (hostIp) params.set('host_ip', hostIp);
+        return await apiRequest(`/recent?${params}`);
     },
 
     // 健康检查
@@ -1,23 +1,74 @@
-from flask import Flask, request, jsonify, make_response
+from flask import Flask, request, jsonify, Response, stream_with_context, g
 from flask_cors import CORS
 import sqlite3
 import os
 import csv
+import zlib
+import base64
+import hashlib
+import secrets
 from io import StringIO
-from threading import Timer
+from threading import Lock, Thread, Event, Condition
+from collections import deque
+import json
+from concurrent.futures import ThreadPoolExecutor, wait
 import logging
 import paramiko
 import re
 from datetime import datetime, timedelta
 import time
+import math
+import random
+import queue
+from array import array
+import atexit
+import itertools
+import shutil
+import sys
+import signal
+import socket
+import multiprocessing
+import warnings
+import numpy as np
+from bisect import bisect_left
+try:
+    import brotli   # 可选：未安装时历史数据只做 gzip 压缩
+except ImportError:
+    brotli = None
 
 # ===================== 基础配置 =====================
 app = Flask(__name__)
 CORS(app)
 
-# 数据库路径（容器内路径，对应宿主机 ./backend/data/monitor.db）
-DB_PATH = '/app/data/monitor.db'
-os.makedirs(os.path.dirname(DB_PATH), exist_ok=True)  # 确保目录存在
+# 数据库路径（默认为容器内路径，对应宿主机 ./backend/data/monitor.db；目录在 init_db 时创建）
+DB_PATH = os.environ.get('DB_PATH', '/app/data/monitor.db')
+
+# 采集并发配置（可通过环境变量调整）
+COLLECT_MAX_WORKERS = int(os.environ.get('COLLECT_MAX_WORKERS', 64))      # 最大并发采集主机数
+COLLECT_HOST_TIMEOUT = float(os.environ.get('COLLECT_HOST_TIMEOUT', 8))    # 单台主机采集时限（秒）
+COLLECT_CYCLE_TIMEOUT = float(os.environ.get('COLLECT_CYCLE_TIMEOUT', 20)) # 单个采集周期时限（秒）
+
+# 调度：主机在周期前 COLLECT_SPREAD 比例的时间内按固定相位错开发起采集，另加随机抖动（秒）
+COLLECT_SPREAD = float(os.environ.get('COLLECT_SPREAD', 0.5))
+COLLECT_JITTER = float(os.environ.get('COLLECT_JITTER', 0.2))
+
+# SSH 会话池配置
+SSH_POOL_IDLE_TIMEOUT = float(os.environ.get('SSH_POOL_IDLE_TIMEOUT', 300))  # 空闲会话关闭时间（秒）
+SSH_POOL_BACKOFF_BASE = float(os.environ.get('SSH_POOL_BACKOFF_BASE', 5))    # 熔断后重试退避初始值（秒）
+SSH_POOL_BACKOFF_MAX = float(os.environ.get('SSH_POOL_BACKOFF_MAX', 300))    # 熔断后重试退避上限（秒）
+
+# 主机熔断：连续失败多少次后熔断、熔断期间重试前的 TCP 端口探测时限（秒）
+BREAKER_THRESHOLD = int(os.environ.get('BREAKER_THRESHOLD', 3))
+BREAKER_PROBE_TIMEOUT = float(os.environ.get('BREAKER_PROBE_TIMEOUT', 1))
+
+# 磁盘采集挂载点（逗号分隔，disk 指标取其中使用率最高者）
+PROBE_MOUNTS = [m.strip() for m in os.environ.get('PROBE_MOUNTS', '/').split(',') if m.strip()]
+
+# SSE 实时推送：保留的最近事件数（用于 Last-Event-ID 续传）、心跳间隔（秒）、
+# 每个进程的最大连接数（每个连接占用一个工作线程，需小于 gunicorn --threads，为普通接口留出线程）
+SSE_BACKLOG = int(os.environ.get('SSE_BACKLOG', 200))
+SSE_HEARTBEAT = float(os.environ.get('SSE_HEARTBEAT', 15))
+SSE_MAX_CLIENTS = int(os.environ.get('SSE_MAX_CLIENTS', 8))
 
 # 日志配置
 logging.basicConfig(
@@ -26,12 +77,241 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# 逐条采样日志（每台主机每周期一条 INFO，主机多时本身就是开销）；设为 0 关闭
+LOG_SAMPLES = os.environ.get('LOG_SAMPLES', '1').lower() not in ('0', 'false', 'no', 'off')
+
+# 耗时直方图分桶上界（秒）
+METRICS_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+# ===================== 运行指标（计数器 + 直方图，Prometheus 文本格式） =====================
+class MetricsRegistry:
+    """进程内指标：计数器与固定分桶直方图，一把锁 + 字典累加，热路径开销为一次二分查找
+
+    其他组件已有的统计（写队列、会话池、调度器）通过 register_collector 在导出时读取，不重复计数。
+    独立运行的采集进程把 export() 的结果随心跳写入数据库，Web 进程导出时通过 remote 参数合并（附加 worker 标签）。
+    """
+    def __init__(self, buckets=METRICS_BUCKETS):
+        self.buckets = tuple(buckets)
+        self._lock = Lock()
+        self._help = {}         # 指标名 -> (类型, 说明)
+        self._counters = {}     # (指标名, 标签元组) -> 值
+        self._histograms = {}   # (指标名, 标签元组) -> [各桶计数..., 总和, 总数]
+        self._collectors = []
+
+    def describe(self, name, kind, help_text):
+        self._help[name] = (kind, help_text)
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, seconds, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        index = bisect_left(self.buckets, seconds)
+        with self._lock:
+            hist = self._histograms.get(key)
+            if hist is None:
+                hist = self._histograms[key] = [0] * (len(self.buckets) + 3)
+            hist[index] += 1    # index == len(buckets) 即 +Inf 桶
+            hist[-2] += seconds
+            hist[-1] += 1
+
+    def register_collector(self, collector):
+        """collector() 返回 [(指标名, 类型, 说明, 值, 标签字典), ...]，导出时调用"""
+        self._collectors.append(collector)
+
+    @staticmethod
+    def _format_labels(labels, extra=None):
+        items = list(labels) + (list(extra.items()) if extra else [])
+        if not items:
+            return ''
+        escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in items)
+        return '{' + ','.join(f'{k}="{v}"' for (k, _), v in zip(items, escaped)) + '}'
+
+    def export(self):
+        """计数器和直方图原值（可 JSON 序列化），供其他进程合并导出"""
+        with self._lock:
+            return {'counters': [[name, labels, value] for (name, labels), value in self._counters.items()],
+                    'histograms': [[name, labels, list(hist)] for (name, labels), hist in self._histograms.items()]}
+
+    def _series(self, remote):
+        """本进程的计数器 / 直方图，合并 remote 中 [(附加标签, export() 结果)] 的数据"""
+        with self._lock:
+            counters = dict(self._counters)
+            histograms = {key: list(value) for key, value in self._histograms.items()}
+        for extra, state in remote:
+            extra = list(extra.items())
+            for name, labels, value in state.get('counters', []):
+                counters[(name, tuple(sorted([tuple(item) for item in labels] + extra)))] = value
+            for name, labels, hist in state.get('histograms', []):
+                if len(hist) == len(self.buckets) + 3:
+                    histograms[(name, tuple(sorted([tuple(item) for item in labels] + extra)))] = hist
+        return counters, histograms
+
+    def render(self, remote=()):
+        """导出为 Prometheus 文本格式（0.0.4）"""
+        counters, histograms = self._series(remote)
+        families = {}   # 指标名 -> 样本行
+        for (name, labels), value in counters.items():
+            families.setdefault(name, []).append(f'{name}{self._format_labels(labels)} {value}')
+        for (name, labels), hist in histograms.items():
+            lines = families.setdefault(name, [])
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), hist):
+                cumulative += count
+                lines.append(f'{name}_bucket{self._format_labels(labels, {"le": bound})} {cumulative}')
+            lines.append(f'{name}_sum{self._format_labels(labels)} {round(hist[-2], 6)}')
+            lines.append(f'{name}_count{self._format_labels(labels)} {hist[-1]}')
+        help_map = dict(self._help)
+        for collector in self._collectors:
+            try:
+                for name, kind, help_text, value, labels in collector():
+                    help_map.setdefault(name, (kind, help_text))
+                    families.setdefault(name, []).append(
+                        f'{name}{self._format_labels(sorted(labels.items()))} {value}')
+            except Exception as e:
+                logger.error(f"❌ 指标收集失败：{str(e)}")
+        output = []
+        for name in sorted(families):
+            if name in help_map:
+                kind, help_text = help_map[name]
+                output.append(f'# HELP {name} {help_text}')
+                output.append(f'# TYPE {name} {kind}')
+            output.extend(families[name])
+        return '\n'.join(output) + '\n'
+
+    def snapshot(self, remote=()):
+        """JSON 形式：计数器原值，直方图给出次数、平均值和按分桶估算的 p50/p95/p99（毫秒）"""
+        counters, histograms = self._series(remote)
+        result = {'counters': {}, 'histograms': {}}
+        for (name, labels), value in counters.items():
+            result['counters'][name + self._format_labels(labels)] = value
+        for (name, labels), hist in histograms.items():
+            total = hist[-1]
+            summary = {'count': total, 'avg_ms': round(hist[-2] / total * 1000, 2) if total else 0.0}
+            for q in (50, 95, 99):
+                rank, cumulative = total * q / 100, 0
+                bound = None
+                for b, count in zip(self.buckets + (math.inf,), hist):
+                    cumulative += count
+                    if cumulative >= rank:
+                        bound = b
+                        break
+                summary[f'p{q}_ms'] = None if bound in (None, math.inf) or not total else bound * 1000
+            result['histograms'][name + self._format_labels(labels)] = summary
+        return result
+
+metrics = MetricsRegistry()
+metrics.describe('monitor_ssh_connect_seconds', 'histogram', 'SSH connect + auth duration')
+metrics.describe('monitor_probe_seconds', 'histogram', 'Remote probe command duration (exec + read)')
+metrics.describe('monitor_host_collect_seconds', 'histogram', 'Per-host collection duration (acquire + probe)')
+metrics.describe('monitor_collect_cycle_seconds', 'histogram', 'Full collection cycle duration')
+metrics.describe('monitor_host_samples_total', 'counter', 'Collected samples by status')
+metrics.describe('monitor_db_write_seconds', 'histogram', 'History batch insert + commit duration')
+metrics.describe('monitor_db_rows_written_total', 'counter', 'History rows committed')
+metrics.describe('monitor_db_write_errors_total', 'counter', 'Failed history batch writes')
+metrics.describe('monitor_alert_transitions_total', 'counter', 'Alert state transitions written')
+metrics.describe('monitor_host_status_transitions_total', 'counter', 'Host online/offline transitions written')
+metrics.describe('monitor_http_request_seconds', 'histogram', 'HTTP handler duration by endpoint')
+metrics.describe('monitor_http_requests_total', 'counter', 'HTTP requests by endpoint and status')
+
 # ===================== 数据库初始化（新增 history 和 settings 表） =====================
+# 历史数据表结构：cpu/mem/disk 为百分比数值（离线/超时为 NULL），record_time 为 epoch 秒
+HISTORY_SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS history (
+        ip TEXT NOT NULL,
+        record_time INTEGER NOT NULL,
+        username TEXT NOT NULL,
+        cpu REAL,
+        mem REAL,
+        disk REAL,
+        status TEXT NOT NULL DEFAULT 'online',
+        PRIMARY KEY (ip, record_time)
+    ) WITHOUT ROWID
+'''
+
+# 预聚合表：粒度名 -> (表名, 桶长度秒)，每桶保存 cpu/mem/disk 的 min/max/avg/p95 及在线/离线采样数
+ROLLUP_LEVELS = {
+    '1m': ('history_1m', 60),
+    '15m': ('history_15m', 900),
+    '1h': ('history_1h', 3600),
+}
+ROLLUP_METRICS = ('cpu', 'mem', 'disk')
+ROLLUP_SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS {table} (
+        ip TEXT NOT NULL,
+        record_time INTEGER NOT NULL,
+        username TEXT NOT NULL,
+        cpu REAL, cpu_min REAL, cpu_max REAL, cpu_p95 REAL,
+        mem REAL, mem_min REAL, mem_max REAL, mem_p95 REAL,
+        disk REAL, disk_min REAL, disk_max REAL, disk_p95 REAL,
+        online_count INTEGER NOT NULL,
+        offline_count INTEGER NOT NULL,
+        PRIMARY KEY (ip, record_time)
+    ) WITHOUT ROWID
+'''
+
+# /api/history 自动粒度：单台主机最多返回的点数
+HISTORY_MAX_POINTS = int(os.environ.get('HISTORY_MAX_POINTS', 1000))
+
+# 旧版历史数据迁移：每批行数、批间休眠（秒）
+HISTORY_MIGRATION_BATCH = int(os.environ.get('HISTORY_MIGRATION_BATCH', 5000))
+HISTORY_MIGRATION_PAUSE = float(os.environ.get('HISTORY_MIGRATION_PAUSE', 0.05))
+
+# 写入队列：单批最大行数、队列最大待写行数（超出丢弃并计数）
+HISTORY_BATCH_MAX = int(os.environ.get('HISTORY_BATCH_MAX', 5000))
+HISTORY_QUEUE_MAX = int(os.environ.get('HISTORY_QUEUE_MAX', 200000))
+
+# 过期数据清理：执行周期（秒）、每批删除行数、批间休眠（秒）
+RETENTION_INTERVAL = float(os.environ.get('RETENTION_INTERVAL', 300))
+RETENTION_CHUNK_ROWS = int(os.environ.get('RETENTION_CHUNK_ROWS', 2000))
+RETENTION_CHUNK_PAUSE = float(os.environ.get('RETENTION_CHUNK_PAUSE', 0.05))
+
+# 冷数据归档：history 中早于 ARCHIVE_HOT_DAYS 天的原始采样按天移出 SQLite，写入列式文件（0 表示不归档）；
+# 开启归档时 1m 预聚合同样只在库中保留热数据窗口（长时间范围使用 15m / 1h），库的大小与 data_retention 无关；
+# 归档目录默认为数据库同目录下的 archive/；冷数据按时间窗口（秒）分段读取，控制单次内存占用
+ARCHIVE_HOT_DAYS = int(os.environ.get('ARCHIVE_HOT_DAYS', 3))
+ROLLUP_HOT_LEVELS = ('1m',)
+ARCHIVE_DIR = os.environ.get('ARCHIVE_DIR')
+ARCHIVE_SCAN_WINDOW = int(os.environ.get('ARCHIVE_SCAN_WINDOW', 3600))
+
+# 告警：超过阈值持续多久才触发（秒）、回落到阈值以下多少个百分点才恢复（滞回）
+ALERT_SUSTAIN = float(os.environ.get('ALERT_SUSTAIN', 30))
+ALERT_HYSTERESIS = float(os.environ.get('ALERT_HYSTERESIS', 5))
+
+# 推送采集：单次请求体上限（字节，解压后）、可接受的采样时间范围（早于当前多少秒 / 超前多少秒）
+INGEST_MAX_BYTES = int(os.environ.get('INGEST_MAX_BYTES', 8 * 1024 * 1024))
+INGEST_MAX_AGE = float(os.environ.get('INGEST_MAX_AGE', 3600))
+INGEST_MAX_SKEW = float(os.environ.get('INGEST_MAX_SKEW', 300))
+
+# 采集分片：运行方式（embedded：Web 进程内采集 / off：Web 进程不采集，由独立采集进程负责）、
+# 一致性哈希虚拟节点数、租约时长下限（秒，实际取 max(刷新频率, 下限)）、`python app.py collector` 默认进程数
+COLLECTOR_MODE = os.environ.get('COLLECTOR_MODE', 'embedded')
+COLLECTOR_VNODES = int(os.environ.get('COLLECTOR_VNODES', 64))
+COLLECTOR_LEASE_MIN = float(os.environ.get('COLLECTOR_LEASE_MIN', 5))
+COLLECTOR_PROCESSES = int(os.environ.get('COLLECTOR_PROCESSES', os.cpu_count() or 1))
+
+# 进程间通知目录（Unix 数据报套接字，默认为数据库同目录下的 notify/）、Web 进程轮询数据库的兜底间隔（秒）
+NOTIFY_DIR = os.environ.get('NOTIFY_DIR')
+FOLLOW_POLL = float(os.environ.get('FOLLOW_POLL', 2))
+
+# 最近采样环形缓冲：每台主机保留的采样点数（默认 720 点，5 秒刷新约 1 小时），/api/recent 单次最多返回秒数
+RECENT_CAPACITY = int(os.environ.get('RECENT_CAPACITY', 720))
+RECENT_MAX_SECONDS = int(os.environ.get('RECENT_MAX_SECONDS', 3600))
+
+# SQLite 连接参数：等锁时间（毫秒）、页缓存大小（KiB）
+SQLITE_BUSY_TIMEOUT_MS = int(os.environ.get('SQLITE_BUSY_TIMEOUT_MS', 5000))
+SQLITE_CACHE_KIB = int(os.environ.get('SQLITE_CACHE_KIB', 20000))
+
 def init_db():
     """初始化数据库表（包含原有 hosts 表 + 新增 history/settings 表）"""
     try:
+        os.makedirs(os.path.dirname(DB_PATH) or '.', exist_ok=True)  # 确保目录存在
         with sqlite3.connect(DB_PATH) as conn:
             cursor = conn.cursor()
+            # WAL 模式：读写互不阻塞（设置持久化在数据库文件中）
+            cursor.execute('PRAGMA journal_mode=WAL')
             # 原有 hosts 表（保持不变）
             cursor.execute('''
                 CREATE TABLE IF NOT EXISTS hosts (
@@ -46,18 +326,108 @@ def init_db():
                     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
                 )
             ''')
-            # 新增：历史数据表（存储监控数据历史）
+            # 采集方式：poll（SSH 轮询）/ push（主机或中继通过 /api/ingest 上报，token_hash 为令牌摘要）
+            host_columns = [row[1] for row in cursor.execute('PRAGMA table_info(hosts)')]
+            if 'mode' not in host_columns:
+                cursor.execute("ALTER TABLE hosts ADD COLUMN mode TEXT NOT NULL DEFAULT 'poll'")
+            if 'token_hash' not in host_columns:
+                cursor.execute('ALTER TABLE hosts ADD COLUMN token_hash TEXT')
+            # 历史数据表：数值型指标 + epoch 秒时间戳，按 (ip, record_time) 聚簇存储
+            # 旧版（TEXT 百分比 + 文本时间）表先改名为 history_legacy，由后台任务分批迁移
+            columns = [row[1] for row in cursor.execute('PRAGMA table_info(history)')]
+            if 'id' in columns:
+                cursor.execute('ALTER TABLE history RENAME TO history_legacy')
+                if 'status' not in columns:
+                    cursor.execute('ALTER TABLE history_legacy ADD COLUMN status TEXT')
+                logger.info("🔄 检测到旧版 history 表，已改名为 history_legacy，等待后台迁移")
+            cursor.execute(HISTORY_SCHEMA)
+            cursor.execute('CREATE INDEX IF NOT EXISTS idx_history_time ON history (record_time)')
+            # 预聚合表（1分钟 / 15分钟 / 1小时）
+            for table, _ in ROLLUP_LEVELS.values():
+                cursor.execute(ROLLUP_SCHEMA.format(table=table))
+                cursor.execute(f'CREATE INDEX IF NOT EXISTS idx_{table}_time ON {table} (record_time)')
+            # 每台主机最新一次采样（写线程随批次更新），供其他进程跟进快照；written_at 为写入时刻
+            cursor.execute('''
+            CREATE TABLE IF NOT EXISTS host_latest (
+                ip TEXT PRIMARY KEY,
+                record_time INTEGER NOT NULL,
+                cpu REAL,
+                mem REAL,
+                disk REAL,
+                status TEXT NOT NULL,
+                written_at REAL NOT NULL,
+                reason TEXT
+            ) WITHOUT ROWID
+            ''')
+            if 'reason' not in [row[1] for row in cursor.execute('PRAGMA table_info(host_latest)')]:
+                cursor.execute('ALTER TABLE host_latest ADD COLUMN reason TEXT')
+            cursor.execute('CREATE INDEX IF NOT EXISTS idx_host_latest_written ON host_latest (written_at)')
+            # 主机在线状态变化：离线期间不写 history，只在上线 / 离线（或离线原因改变）时记录一条
+            cursor.execute('''
+            CREATE TABLE IF NOT EXISTS host_status (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                ip TEXT NOT NULL,
+                state TEXT NOT NULL,
+                reason TEXT,
+                record_time INTEGER NOT NULL
+            )
+            ''')
+            cursor.execute('CREATE INDEX IF NOT EXISTS idx_host_status_time ON host_status (record_time)')
+            cursor.execute('CREATE INDEX IF NOT EXISTS idx_host_status_ip_time ON host_status (ip, record_time)')
+            # 采集分片：采集进程心跳表 + 主机租约表（租约到期或被释放后其他进程才能接手）
+            cursor.execute('''
+            CREATE TABLE IF NOT EXISTS collector_workers (
+                worker_id TEXT PRIMARY KEY,
+                hostname TEXT,
+                pid INTEGER,
+                started_at REAL NOT NULL,
+                heartbeat_at REAL NOT NULL,
+                last_cycle_at REAL
+            )
+            ''')
+            worker_columns = [row[1] for row in cursor.execute('PRAGMA table_info(collector_workers)')]
+            if 'last_cycle_at' not in worker_columns:
+                cursor.execute('ALTER TABLE collector_workers ADD COLUMN last_cycle_at REAL')
+            # 采集进程随心跳上报的运行统计（JSON），Web 进程的 /api/metrics 等接口读取
+            if 'stats' not in worker_columns:
+                cursor.execute('ALTER TABLE collector_workers ADD COLUMN stats TEXT')
+            cursor.execute('''
+            CREATE TABLE IF NOT EXISTS host_leases (
+                ip TEXT PRIMARY KEY,
+                worker_id TEXT NOT NULL,
+                expires_at REAL NOT NULL
+            ) WITHOUT ROWID
+            ''')
+            cursor.execute('CREATE INDEX IF NOT EXISTS idx_host_leases_worker ON host_leases (worker_id)')
+            # 推送采样队列：Web 进程写入，持有主机租约的采集进程取出后写 history（同一主机的状态只由一个进程维护）
             cursor.execute('''
-            CREATE TABLE IF NOT EXISTS history (
+            CREATE TABLE IF NOT EXISTS ingest_queue (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
                 ip TEXT NOT NULL,
-                username TEXT NOT NULL,
-                cpu TEXT NOT NULL,
-                mem TEXT NOT NULL,
-                disk TEXT DEFAULT '0.0%',
-                record_time DATETIME NOT NULL
+                record_time INTEGER NOT NULL,
+                username TEXT,
+                cpu REAL,
+                mem REAL,
+                disk REAL,
+                status TEXT NOT NULL
             )
             ''')
+            cursor.execute('CREATE INDEX IF NOT EXISTS idx_ingest_queue_ip ON ingest_queue (ip, id)')
+            # 告警表：只记录状态变化（firing 触发 / resolved 恢复），started_at 为首次越限时刻
+            cursor.execute('''
+            CREATE TABLE IF NOT EXISTS alerts (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                ip TEXT NOT NULL,
+                metric TEXT NOT NULL,
+                state TEXT NOT NULL,
+                value REAL,
+                threshold REAL NOT NULL,
+                started_at INTEGER NOT NULL,
+                record_time INTEGER NOT NULL
+            )
+            ''')
+            cursor.execute('CREATE INDEX IF NOT EXISTS idx_alerts_time ON alerts (record_time)')
+            cursor.execute('CREATE INDEX IF NOT EXISTS idx_alerts_ip_time ON alerts (ip, record_time)')
             # 新增：系统设置表（存储刷新频率、告警阈值等）
             cursor.execute('''
             CREATE TABLE IF NOT EXISTS settings (
@@ -75,209 +445,2798 @@ def init_db():
             if not cursor.fetchone():
                 cursor.execute('INSERT INTO settings DEFAULT VALUES')
             conn.commit()
-        logger.info(f"✅ 数据库初始化成功，表：hosts + history + settings（路径：{DB_PATH}）")
+        logger.info(f"✅ 数据库初始化成功，表：hosts + history + alerts + settings（路径：{DB_PATH}）")
     except Exception as e:
         logger.error(f"❌ 数据库初始化失败：{str(e)}")
 
-# 辅助函数：获取数据库连接（统一路径）
+# 辅助函数：获取数据库连接（统一路径 + 统一连接参数）
 def get_db_connection():
-    conn = sqlite3.connect(DB_PATH)
+    conn = sqlite3.connect(DB_PATH, timeout=SQLITE_BUSY_TIMEOUT_MS / 1000)
     conn.row_factory = sqlite3.Row
+    # WAL 下 NORMAL 只在检查点时 fsync，断电最多丢失最近提交，不会损坏数据库
+    conn.execute('PRAGMA synchronous=NORMAL')
+    conn.execute(f'PRAGMA cache_size=-{SQLITE_CACHE_KIB}')
+    conn.execute('PRAGMA temp_store=MEMORY')
     return conn
 
-# ===================== 监控数据采集工具（保持原有逻辑） =====================
-class MonitorCollector:
-    """SSH连接采集服务器监控数据"""
+# ===================== 系统设置缓存（内存，写穿透） =====================
+# 对外暴露的设置项及默认值
+SETTINGS_DEFAULTS = {
+    'refresh_interval': 5,
+    'cpu_threshold': 80,
+    'mem_threshold': 80,
+    'theme': 'dark',
+    'data_retention': 7,
+}
+
+# 数值设置的取值范围（含两端）；theme 只接受以下取值
+SETTINGS_BOUNDS = {
+    'refresh_interval': (1, 3600),
+    'cpu_threshold': (0, 100),
+    'mem_threshold': (0, 100),
+    'data_retention': (1, 3650),
+}
+SETTINGS_THEMES = ('dark', 'light')
+
+class SettingsError(ValueError):
+    """设置取值无效（整体拒绝，不写库）"""
+
+def validate_settings(values):
+    """校验并规整设置：未提供的项取默认值，数值项转为整数并检查范围，无效（含 null）时抛出 SettingsError"""
+    settings = {}
+    for key, default in SETTINGS_DEFAULTS.items():
+        value = values.get(key, default)
+        if key == 'theme':
+            if value not in SETTINGS_THEMES:
+                raise SettingsError(f'theme 取值应为 {"/".join(SETTINGS_THEMES)}')
+        else:
+            low, high = SETTINGS_BOUNDS[key]
+            try:
+                if isinstance(value, bool) or float(value) != int(float(value)):
+                    raise ValueError
+                value = int(float(value))
+            except (TypeError, ValueError, OverflowError):
+                raise SettingsError(f'{key} 应为整数')
+            if not low <= value <= high:
+                raise SettingsError(f'{key} 取值范围为 {low}~{high}')
+        settings[key] = value
+    return settings
+
+class SettingsCache:
+    """settings 表的进程内缓存：首次使用时加载一次，保存时先写库再整体替换，读取不访问数据库
+
+    (设置, 版本号, etag) 作为一个元组整体替换，读取方拿到的始终是一致的一份；
+    etag 由内容摘要生成，服务重启后内容不变则 etag 不变。
+    """
+    def __init__(self):
+        self._lock = Lock()
+        self._current = None   # (settings, version, etag)
+
+    def _replace(self, settings):
+        # 调用方持有 _lock
+        digest = hashlib.sha1(json.dumps(settings, sort_keys=True).encode()).hexdigest()[:16]
+        version = self._current[1] + 1 if self._current else 1
+        self._current = (settings, version, f'"{digest}"')
+
     @staticmethod
-    def get_cpu_usage(ssh):
-        """采集CPU使用率（Linux）"""
+    def _load():
+        conn = get_db_connection()
         try:
-            # 兼容不同Linux版本的top命令输出
-            stdin, stdout, stderr = ssh.exec_command("top -bn1 | grep -E '^%Cpu|^CPU' | awk '{print 100 - $8}'")
-            cpu_usage = stdout.read().decode().strip()
-            if cpu_usage and cpu_usage.replace('.', '').isdigit():
-                return f"{float(cpu_usage):.1f}%"
-            return "0.0%"
-        except Exception as e:
-            logger.error(f"❌ 采集CPU使用率失败：{str(e)}")
-            return "0.0%"
+            row = conn.execute('SELECT * FROM settings LIMIT 1').fetchone()
+        finally:
+            conn.close()
+        stored = {key: row[key] for key in SETTINGS_DEFAULTS}
+        try:
+            return validate_settings(stored)
+        except SettingsError as e:
+            # 旧版本未校验时可能写入了无效值：按默认值运行，避免调度与接口因空值出错
+            logger.warning(f"⚠️ 数据库中的设置无效（{str(e)}），使用默认值")
+            return dict(SETTINGS_DEFAULTS)
+
+    def reload(self):
+        """从数据库重新加载"""
+        settings = self._load()
+        with self._lock:
+            self._replace(settings)
+
+    def refresh(self):
+        """重新读取并与缓存比较（单行读取，供定期检查），内容有变化时替换缓存并返回 True"""
+        settings = self._load()
+        with self._lock:
+            if self._current is not None and self._current[0] == settings:
+                return False
+            self._replace(settings)
+            return True
+
+    def snapshot(self):
+        """返回 (设置字典, 版本号, etag)，设置字典只读"""
+        if self._current is None:
+            self.reload()
+        return self._current
+
+    def get(self, key=None):
+        """返回当前设置字典（只读），或其中一项"""
+        settings = self.snapshot()[0]
+        return settings if key is None else settings[key]
+
+    def update(self, values):
+        """写穿透：未提供的项取默认值（与原接口行为一致），校验通过且写库成功后替换缓存；取值无效抛出 SettingsError"""
+        settings = validate_settings(values)
+        with self._lock:
+            conn = get_db_connection()
+            try:
+                with conn:
+                    conn.execute('''
+                        UPDATE settings SET
+                            refresh_interval = ?,
+                            cpu_threshold = ?,
+                            mem_threshold = ?,
+                            theme = ?,
+                            data_retention = ?,
+                            update_time = ?
+                        WHERE id = 1
+                    ''', [
+                        settings['refresh_interval'],
+                        settings['cpu_threshold'],
+                        settings['mem_threshold'],
+                        settings['theme'],
+                        settings['data_retention'],
+                        datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+                    ])
+            finally:
+                conn.close()
+            self._replace(settings)
+        return settings
+
+settings_cache = SettingsCache()
+
+def migrate_legacy_history():
+    """后台分批把 history_legacy 迁移到新 history 表（从最新数据开始），采集不停机
+
+    每批在一个短事务内完成“插入新表 + 删除旧行”，中断后重启会从剩余数据继续；
+    迁移完成后删除空的 history_legacy 表。
+    """
+    conn = get_db_connection()
+    try:
+        if not conn.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='history_legacy'").fetchone():
+            return
+        total = 0
+        while True:
+            row = conn.execute('SELECT MAX(id) AS max_id FROM history_legacy').fetchone()
+            if row['max_id'] is None:
+                break
+            low = row['max_id'] - HISTORY_MIGRATION_BATCH + 1
+            with conn:
+                # 旧表 record_time 为本地时间文本，'utc' 修饰符将其换算为 UTC epoch 秒
+                cursor = conn.execute('''
+                    INSERT OR IGNORE INTO history (ip, record_time, username, cpu, mem, disk, status)
+                    SELECT ip, ts, username,
+                           CASE WHEN st = 'online' THEN cpu END,
+                           CASE WHEN st = 'online' THEN mem END,
+                           CASE WHEN st = 'online' THEN disk END,
+                           st
+                    FROM (
+                        SELECT ip, username,
+                               CAST(strftime('%s', record_time, 'utc') AS INTEGER) AS ts,
+                               CAST(REPLACE(cpu, '%', '') AS REAL) AS cpu,
+                               CAST(REPLACE(mem, '%', '') AS REAL) AS mem,
+                               CAST(REPLACE(disk, '%', '') AS REAL) AS disk,
+                               -- 旧数据无状态列时按原逻辑推断：CPU > 0 视为在线，离线行不保留 0 值指标
+                               COALESCE(status, CASE WHEN CAST(REPLACE(cpu, '%', '') AS REAL) > 0
+                                                     THEN 'online' ELSE 'offline' END) AS st
+                        FROM history_legacy WHERE id >= ?
+                    )
+                ''', [low])
+                conn.execute('DELETE FROM history_legacy WHERE id >= ?', [low])
+            total += cursor.rowcount
+            time.sleep(HISTORY_MIGRATION_PAUSE)
+        with conn:
+            conn.execute('DROP TABLE history_legacy')
+        logger.info(f"✅ 旧版历史数据迁移完成，共迁移 {total} 条记录")
+        if total:
+            # 迁移的数据早于当前聚合窗口，补算其预聚合
+            backfill_rollups(conn, end=int(time.time()) // 3600 * 3600)
+    except Exception as e:
+        logger.error(f"❌ 旧版历史数据迁移失败：{str(e)}")
+    finally:
+        conn.close()
+
+def start_history_migration():
+    """启动后台迁移线程（无旧表时立即结束）"""
+    Thread(target=migrate_legacy_history, name='history-migration', daemon=True).start()
+
+# ===================== 预聚合（1m / 15m / 1h） =====================
+def percentile(values, pct):
+    """最近秩法百分位（values 需已排序且非空）"""
+    return values[max(int(math.ceil(pct / 100.0 * len(values))) - 1, 0)]
+
+def finalize_rollup_bucket(ip, bucket):
+    """把桶累加状态转换为预聚合表的一行"""
+    row = [ip, bucket['record_time'], bucket['username']]
+    for metric in ROLLUP_METRICS:
+        values = sorted(bucket[metric])
+        if values:
+            row += [round(sum(values) / len(values), 2), values[0], values[-1], round(percentile(values, 95), 2)]
+        else:
+            row += [None, None, None, None]
+    row += [bucket['online'], bucket['offline']]
+    return tuple(row)
+
+def rollup_insert_sql(table):
+    return f'''
+        INSERT OR REPLACE INTO {table} (ip, record_time, username,
+            cpu, cpu_min, cpu_max, cpu_p95, mem, mem_min, mem_max, mem_p95,
+            disk, disk_min, disk_max, disk_p95, online_count, offline_count)
+        VALUES ({', '.join('?' * 17)})
+    '''
+
+class RollupAggregator:
+    """随写入在内存中累加每台主机当前的 1m/15m/1h 桶，桶结束后输出聚合行
+
+    乱序到达的旧桶数据不在内存中合并，而是记录下来由写线程从原始数据重新计算。
+    从库中恢复（restored=True）而本进程尚未写入新数据的桶不输出，避免用旧的部分数据覆盖其他进程写入的聚合行。
+    """
+    def __init__(self):
+        self._open = {level: {} for level in ROLLUP_LEVELS}     # level -> ip -> 桶状态
+        self._closed = {level: [] for level in ROLLUP_LEVELS}   # level -> 已结束的聚合行
+        self._late = {}                                          # (level, ip, 桶起点) -> 迟到的离线 / 超时采样数
 
     @staticmethod
-    def get_mem_usage(ssh):
-        """采集内存使用率（Linux）"""
+    def _new_bucket(record_time, username):
+        bucket = {'record_time': record_time, 'username': username, 'online': 0, 'offline': 0}
+        for metric in ROLLUP_METRICS:
+            bucket[metric] = array('d')
+        return bucket
+
+    def add(self, rows, restored=False):
+        """累加一批原始行 (ip, record_time, username, cpu, mem, disk, status)，restored 表示从库中恢复的行"""
+        for ip, record_time, username, cpu, mem, disk, status in rows:
+            for level, (_, seconds) in ROLLUP_LEVELS.items():
+                start = record_time - record_time % seconds
+                buckets = self._open[level]
+                bucket = buckets.get(ip)
+                if bucket is None or start > bucket['record_time']:
+                    if bucket is not None and bucket['dirty']:
+                        self._closed[level].append(finalize_rollup_bucket(ip, bucket))
+                    bucket = buckets[ip] = self._new_bucket(start, username)
+                    bucket['dirty'] = False
+                elif start < bucket['record_time']:
+                    key = (level, ip, start)
+                    self._late[key] = self._late.get(key, 0) + (status != 'online')
+                    continue
+                if not restored:
+                    bucket['dirty'] = True
+                if status == 'online':
+                    bucket['online'] += 1
+                    for metric, value in (('cpu', cpu), ('mem', mem), ('disk', disk)):
+                        if value is not None:
+                            bucket[metric].append(value)
+                else:
+                    bucket['offline'] += 1
+
+    def take_closed(self, now=None, force=False):
+        """取出已结束的聚合行；长时间无新数据的桶（如主机已删除）也一并结束，force 时全部结束"""
+        now = now or time.time()
+        result = {}
+        for level, (_, seconds) in ROLLUP_LEVELS.items():
+            buckets = self._open[level]
+            for ip in [ip for ip, b in buckets.items() if force or b['record_time'] + seconds + 60 < now]:
+                bucket = buckets.pop(ip)
+                if bucket['dirty']:
+                    self._closed[level].append(finalize_rollup_bucket(ip, bucket))
+            result[level], self._closed[level] = self._closed[level], []
+        return result
+
+    def take_late(self):
+        """取出 {(level, ip, 桶起点): 迟到的离线 / 超时采样数}"""
+        late, self._late = self._late, {}
+        return late
+
+    def restore_offline(self, level, ip, start, username, offline):
+        """恢复当前桶的离线采样数（离线采样不写 history，只能从已写入的聚合行读回）"""
+        bucket = self._open[level].get(ip)
+        if bucket is None or bucket['record_time'] < start:
+            bucket = self._open[level][ip] = self._new_bucket(start, username)
+            bucket['dirty'] = False
+        elif bucket['record_time'] > start:
+            return
+        # 超时采样带指标、已从 history 计入，取较大值避免重复计数
+        bucket['offline'] = max(bucket['offline'], offline)
+
+    def forget(self, ip):
+        """丢弃某台主机未结束的桶（主机交给其他采集进程时调用，不写入部分数据）"""
+        for buckets in self._open.values():
+            buckets.pop(ip, None)
+        self._late = {key: count for key, count in self._late.items() if key[1] != ip}
+
+    def checkpoint(self, ips):
+        """保存这些主机未结束的桶以及待输出的聚合行，写库失败时由 rollback 恢复"""
+        # 桶只会追加：记录桶对象、计数和各指标数组长度即可，不复制数组
+        open_buckets = {level: {ip: self._mark_bucket(buckets.get(ip)) for ip in ips}
+                        for level, buckets in self._open.items()}
+        return open_buckets, {level: list(rows) for level, rows in self._closed.items()}, dict(self._late)
+
+    def rollback(self, checkpoint, closed):
+        """写库失败：恢复 checkpoint 时的状态；已取出的其他主机的聚合行（closed）放回待输出队列"""
+        open_buckets, self._closed, self._late = checkpoint
+        for level, saved in open_buckets.items():
+            for ip, mark in saved.items():
+                if mark is None:
+                    self._open[level].pop(ip, None)
+                    continue
+                bucket, online, offline, dirty, lengths = mark
+                bucket['online'], bucket['offline'], bucket['dirty'] = online, offline, dirty
+                for metric, length in zip(ROLLUP_METRICS, lengths):
+                    del bucket[metric][length:]
+                self._open[level][ip] = bucket
+            self._closed[level] += [row for row in closed.get(level, []) if row[0] not in saved]
+
+    @staticmethod
+    def _mark_bucket(bucket):
+        if bucket is None:
+            return None
+        return (bucket, bucket['online'], bucket['offline'], bucket['dirty'],
+                [len(bucket[metric]) for metric in ROLLUP_METRICS])
+
+    def snapshot_open(self):
+        """当前未结束桶的聚合行（定期写入，使查询能看到最新一段）"""
+        return {level: [finalize_rollup_bucket(ip, b) for ip, b in buckets.items() if b['dirty']]
+                for level, buckets in self._open.items()}
+
+def write_rollups(conn, rollups):
+    """写入 {level: [聚合行]}（调用方负责事务）"""
+    for level, rows in rollups.items():
+        if rows:
+            conn.executemany(rollup_insert_sql(ROLLUP_LEVELS[level][0]), rows)
+
+def recompute_rollup(conn, level, ip, start, late_offline=0):
+    """从原始数据重新计算某台主机某个桶（处理乱序到达的数据）
+
+    离线采样不写 history：离线数取已写入聚合行中的值加上本次迟到的离线 / 超时采样数 late_offline。
+    """
+    table, seconds = ROLLUP_LEVELS[level]
+    rows = conn.execute('''
+        SELECT ip, record_time, username, cpu, mem, disk, status FROM history
+        WHERE ip = ? AND record_time >= ? AND record_time < ?
+    ''', [ip, start, start + seconds]).fetchall()
+    existing = conn.execute(f'SELECT username, offline_count FROM {table} WHERE ip = ? AND record_time = ?',
+                            [ip, start]).fetchone()
+    if not rows and existing is None:
+        return
+    bucket = RollupAggregator._new_bucket(start, rows[-1][2] if rows else existing[0])
+    for _, _, _, cpu, mem, disk, status in rows:
+        if status == 'online':
+            bucket['online'] += 1
+            for metric, value in (('cpu', cpu), ('mem', mem), ('disk', disk)):
+                if value is not None:
+                    bucket[metric].append(value)
+        else:
+            bucket['offline'] += 1
+    if existing is not None:
+        bucket['offline'] = existing[1] + late_offline
+    else:
+        bucket['offline'] = max(bucket['offline'], late_offline)
+    conn.execute(rollup_insert_sql(table), finalize_rollup_bucket(ip, bucket))
+
+def backfill_rollups(conn, end, start=None, window=86400):
+    """按天分段从原始数据补算 [start, end) 范围的预聚合（end 需按小时对齐）"""
+    if start is None:
+        start = conn.execute('SELECT MIN(record_time) FROM history').fetchone()[0]
+        if start is None:
+            return
+        start -= start % 3600
+    for window_start in range(start, end, window):
+        aggregator = RollupAggregator()
+        window_end = min(window_start + window, end)
+        cursor = conn.execute('''
+            SELECT ip, record_time, username, cpu, mem, disk, status FROM history
+            WHERE record_time >= ? AND record_time < ? ORDER BY ip, record_time
+        ''', [window_start, window_end])
+        while True:
+            rows = cursor.fetchmany(5000)
+            if not rows:
+                break
+            aggregator.add([tuple(r) for r in rows])
+        with conn:
+            write_rollups(conn, aggregator.take_closed(force=True))
+    logger.info(f"✅ 预聚合补算完成：{datetime.fromtimestamp(start)} ~ {datetime.fromtimestamp(end)}")
+
+# ===================== 告警引擎（随写入逐条评估） =====================
+# 参与告警的指标 -> settings 中的阈值项
+ALERT_METRICS = {'cpu': 'cpu_threshold', 'mem': 'mem_threshold'}
+
+class AlertEngine:
+    """按 (ip, 指标) 维护告警状态机，每个采样 O(1) 评估，只产生状态变化
+
+    ok -> pending：超过阈值（与前端一致，取 >）
+    pending -> firing：持续超过阈值达到 sustain 秒（写入 firing）
+    pending -> ok：持续时间未达到即回落
+    firing -> ok：回落到 阈值 - hysteresis 以下（写入 resolved），其间的小幅波动不会反复告警
+    离线采样（指标为空）和时间早于已评估采样的数据不改变状态。
+    """
+    def __init__(self, sustain=ALERT_SUSTAIN, hysteresis=ALERT_HYSTERESIS):
+        self.sustain = sustain
+        self.hysteresis = hysteresis
+        self._lock = Lock()
+        self._states = {}     # (ip, metric) -> [状态, 首次越限时刻, 最近采样时刻, 最近值, 阈值]
+        self._pending = []    # 评估之外产生的状态变化（如删除主机时恢复），下次写入时一并落库
+
+    def restore(self, conn, ips=None):
+        """从 alerts 表恢复仍处于 firing 的告警（每个 (ip, 指标) 的最后一条记录）
+
+        启动时恢复全部；采集分片接手主机时只恢复这些主机。
+        """
+        sql = '''
+            SELECT a.ip, a.metric, a.state, a.value, a.threshold, a.started_at, a.record_time
+            FROM alerts a
+            JOIN (SELECT ip, metric, MAX(id) AS id FROM alerts GROUP BY ip, metric) last ON a.id = last.id
+        '''
+        params = []
+        if ips is not None:
+            sql += ' WHERE a.ip IN (SELECT value FROM json_each(?))'
+            params.append(json.dumps(list(ips)))
+        rows = conn.execute(sql, params).fetchall()
+        with self._lock:
+            for ip in ips or []:
+                for metric in ALERT_METRICS:
+                    self._states.pop((ip, metric), None)
+            for row in rows:
+                if row['state'] == 'firing':
+                    self._states[(row['ip'], row['metric'])] = \
+                        ['firing', row['started_at'], row['record_time'], row['value'], row['threshold']]
+        return sum(1 for row in rows if row['state'] == 'firing')
+
+    def evaluate(self, rows, settings):
+        """评估一批 (ip, record_time, username, cpu, mem, disk, status)，返回状态变化列表"""
+        # 行内指标列位置：ip, record_time, username 之后依次为 cpu, mem, disk
+        thresholds = [(metric, 3 + ROLLUP_METRICS.index(metric), settings[key]) for metric, key in ALERT_METRICS.items()]
+        with self._lock:
+            transitions, self._pending = self._pending, []
+            for row in rows:
+                ip, ts = row[0], row[1]
+                for metric, column, threshold in thresholds:
+                    value = row[column]
+                    if value is None:
+                        continue
+                    state = self._states.get((ip, metric))
+                    if state is None:
+                        if value <= threshold:
+                            continue   # 绝大多数采样：无状态、未越限，直接跳过
+                        state = self._states[(ip, metric)] = ['ok', ts, ts, value, threshold]
+                    elif ts < state[2]:
+                        continue
+                    state[2], state[3], state[4] = ts, value, threshold
+                    if state[0] == 'firing':
+                        if value < threshold - self.hysteresis:
+                            transitions.append((ip, metric, 'resolved', value, threshold, state[1], ts))
+                            del self._states[(ip, metric)]
+                        continue
+                    if value <= threshold:
+                        del self._states[(ip, metric)]
+                        continue
+                    if state[0] == 'ok':
+                        state[0], state[1] = 'pending', ts
+                    if ts - state[1] >= self.sustain:
+                        state[0] = 'firing'
+                        transitions.append((ip, metric, 'firing', value, threshold, state[1], ts))
+        return transitions
+
+    def checkpoint(self, ips):
+        """保存这些主机的告警状态和待写入的状态变化，写库失败时由 rollback 恢复"""
+        with self._lock:
+            return ({key: list(state) for key, state in self._states.items() if key[0] in ips},
+                    list(self._pending), ips)
+
+    def rollback(self, checkpoint):
+        """写库失败：恢复状态，本批产生的状态变化未落库，之后重新评估时再次产生"""
+        states, pending, ips = checkpoint
+        with self._lock:
+            for key in [key for key in self._states if key[0] in ips]:
+                del self._states[key]
+            self._states.update(states)
+            self._pending = pending + self._pending
+
+    def forget(self, ip):
+        """删除主机：仍在告警中的记为恢复，清除状态"""
+        now = int(time.time())
+        with self._lock:
+            for key in [key for key in self._states if key[0] == ip]:
+                state = self._states.pop(key)
+                if state[0] == 'firing':
+                    self._pending.append((ip, key[1], 'resolved', None, state[4], state[1], now))
+
+    def drop(self, ip):
+        """主机交给其他采集进程：只清除本进程的状态，不记录恢复"""
+        with self._lock:
+            for metric in ALERT_METRICS:
+                self._states.pop((ip, metric), None)
+
+    def active(self):
+        """当前处于 firing 的告警"""
+        with self._lock:
+            return [{'ip': ip, 'metric': metric, 'value': state[3], 'threshold': state[4],
+                     'started_at': state[1], 'last_seen': state[2]}
+                    for (ip, metric), state in self._states.items() if state[0] == 'firing']
+
+    @staticmethod
+    def write(conn, transitions):
+        conn.executemany('''
+            INSERT INTO alerts (ip, metric, state, value, threshold, started_at, record_time)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        ''', transitions)
+
+alert_engine = AlertEngine()
+
+class HostStatusTracker:
+    """按主机维护在线 / 离线状态，只产生状态变化（写入 host_status 表）
+
+    有任一指标的采样视为在线，否则为离线；离线原因取采样附带的 reason（缺省为 status）。
+    离线采样本身不写 history，离线时段由相邻两条状态记录界定。
+    """
+    def __init__(self):
+        self._lock = Lock()
+        self._states = {}     # ip -> [状态, 原因, 进入该状态的时刻, 最近采样时刻]
+        self._pending = []
+
+    def restore(self, conn, ips=None):
+        """从 host_status 表恢复每台主机最后的状态：启动时恢复全部，采集分片接手主机时只恢复这些主机"""
+        sql = '''
+            SELECT s.ip, s.state, s.reason, s.record_time
+            FROM host_status s
+            JOIN (SELECT ip, MAX(id) AS id FROM host_status GROUP BY ip) last ON s.id = last.id
+        '''
+        params = []
+        if ips is not None:
+            sql += ' WHERE s.ip IN (SELECT value FROM json_each(?))'
+            params.append(json.dumps(list(ips)))
+        rows = conn.execute(sql, params).fetchall()
+        with self._lock:
+            for ip in ips or []:
+                self._states.pop(ip, None)
+            for row in rows:
+                self._states[row['ip']] = [row['state'], row['reason'], row['record_time'], row['record_time']]
+        return sum(1 for row in rows if row['state'] == 'offline')
+
+    def evaluate(self, rows):
+        """评估一批 (ip, record_time, username, cpu, mem, disk, status[, reason])，返回状态变化列表"""
+        with self._lock:
+            transitions, self._pending = self._pending, []
+            for row in rows:
+                ip, ts = row[0], row[1]
+                if row[3] is not None or row[4] is not None or row[5] is not None:
+                    state, reason = 'online', None
+                else:
+                    state = 'offline'
+                    reason = (row[7] if len(row) > 7 else None) or row[6]
+                current = self._states.get(ip)
+                if current is not None:
+                    if ts < current[3]:
+                        continue
+                    current[3] = ts
+                    if (current[0], current[1]) == (state, reason):
+                        continue
+                self._states[ip] = [state, reason, ts, ts]
+                transitions.append((ip, state, reason, ts))
+        return transitions
+
+    def checkpoint(self, ips):
+        """保存这些主机的状态和待写入的状态变化，写库失败时由 rollback 恢复"""
+        with self._lock:
+            return ({ip: list(self._states[ip]) for ip in ips if ip in self._states}, list(self._pending), ips)
+
+    def rollback(self, checkpoint):
+        """写库失败：恢复状态，本批产生的状态变化之后重新评估时再次产生"""
+        states, pending, ips = checkpoint
+        with self._lock:
+            for ip in ips:
+                self._states.pop(ip, None)
+            self._states.update(states)
+            self._pending = pending + self._pending
+
+    def forget(self, ip):
+        """删除主机：仍处于离线的记一条下线结束（state=removed），清除状态"""
+        with self._lock:
+            current = self._states.pop(ip, None)
+            if current is not None and current[0] == 'offline':
+                self._pending.append((ip, 'removed', None, int(time.time())))
+
+    def drop(self, ip):
+        """主机交给其他采集进程：只清除本进程的状态"""
+        with self._lock:
+            self._states.pop(ip, None)
+
+    @staticmethod
+    def write(conn, transitions):
+        conn.executemany('INSERT INTO host_status (ip, state, reason, record_time) VALUES (?, ?, ?, ?)', transitions)
+
+host_status = HostStatusTracker()
+
+# ===================== 历史数据写入队列（单一写线程） =====================
+class HistoryWriter:
+    """history 表的唯一写入者：采集结果入队，专用线程攒批 executemany 后一次提交
+
+    推送采样由 Web 进程写入 ingest_queue 表，写线程取出本进程持有租约的主机的采样，与写 history 在同一事务中删除。
+    """
+    INGEST = object()   # 队列中的唤醒标记：有新的推送采样
+    INGEST_POLL = 1.0   # 秒：推送队列的轮询间隔（收不到通知时）
+    INSERT_SQL = '''
+        INSERT OR REPLACE INTO history (ip, record_time, username, cpu, mem, disk, status)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    '''
+    LATEST_SQL = '''
+        INSERT INTO host_latest (ip, record_time, cpu, mem, disk, status, reason, written_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT (ip) DO UPDATE SET
+            record_time = excluded.record_time, cpu = excluded.cpu, mem = excluded.mem,
+            disk = excluded.disk, status = excluded.status, reason = excluded.reason,
+            written_at = excluded.written_at
+        WHERE excluded.record_time >= host_latest.record_time
+    '''
+
+    def __init__(self, batch_max=HISTORY_BATCH_MAX, queue_max=HISTORY_QUEUE_MAX):
+        self.batch_max = batch_max
+        self.queue_max = queue_max
+        self._queue = queue.Queue()
+        self._lock = Lock()
+        self._thread = None
+        self._pending = 0     # 已入队未提交的行数
+        self.rollups = RollupAggregator()
+        self._known = set()          # 已从库中恢复过预聚合 / 告警 / 在线状态的主机
+        self._open_flushed_at = 0.0  # 上次写入未结束桶的时间
+        self._stats = {'rows_written': 0, 'batches': 0, 'rows_dropped': 0, 'errors': 0,
+                       'last_batch_size': 0, 'max_batch_size': 0,
+                       'last_commit_ms': 0.0, 'max_commit_ms': 0.0, 'total_commit_ms': 0.0}
+
+    def start(self):
+        if self._thread is None:
+            self._thread = Thread(target=self._run, name='history-writer', daemon=True)
+            self._thread.start()
+            atexit.register(self.stop)
+
+    def submit(self, rows):
+        """入队一批行 (ip, record_time, username, cpu, mem, disk, status[, reason])；队列已满时丢弃并返回 False
+
+        指标全为空的离线 / 超时行不写 history，只计入预聚合的离线数、更新 host_latest 并在状态变化时写 host_status。
+        """
+        if not rows:
+            return True
+        with self._lock:
+            if self._pending + len(rows) > self.queue_max:
+                self._stats['rows_dropped'] += len(rows)
+                logger.warning(f"⚠️ 历史写入队列已满（{self._pending} 行），丢弃 {len(rows)} 行")
+                return False
+            self._pending += len(rows)
+        self._queue.put(rows)
+        return True
+
+    def stop(self, timeout=10):
+        """写完队列中剩余数据后退出写线程"""
+        if self._thread is not None and self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join(timeout)
+
+    def _run(self):
+        # 启动时不恢复任何主机的状态：接手（采集分片）或首次写入某台主机时才从库中恢复，
+        # 其他进程负责的主机不会被本进程的旧状态覆盖
+        conn = get_db_connection()
         try:
-            stdin, stdout, stderr = ssh.exec_command("free | grep Mem | awk '{print $2, $3}'")
-            mem_data = stdout.read().decode().strip().split()
-            if len(mem_data) == 2:
-                mem_total = int(mem_data[0])
-                mem_used = int(mem_data[1])
-                mem_usage = f"{(mem_used / mem_total) * 100:.1f}%"
-                return mem_usage
-            return "0.0%"
+            drained_at = 0.0
+            while True:
+                try:
+                    item = self._queue.get(timeout=self.INGEST_POLL)
+                except queue.Empty:
+                    # 空闲时取推送队列；没有推送数据时也结束过期的桶（如主机已删除）
+                    if not self._drain_ingest(conn):
+                        self._write(conn, [])
+                    drained_at = time.monotonic()
+                    continue
+                if item is None:
+                    break
+                if isinstance(item, tuple):
+                    self._handover(conn, *item)
+                    continue
+                woken = item is self.INGEST
+                batch = [] if woken else list(item)
+                stopping = False
+                control = None
+                # 把已经排队的数据并入同一事务，积压时自动形成大批量（遇到交接指令先写完之前的数据）
+                while len(batch) < self.batch_max:
+                    try:
+                        item = self._queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    if item is None:
+                        stopping = True
+                        break
+                    if isinstance(item, tuple):
+                        control = item
+                        break
+                    if item is self.INGEST:
+                        woken = True
+                    else:
+                        batch.extend(item)
+                if batch:
+                    self._write(conn, batch)
+                # 推送数据：收到通知时或写入繁忙（没有空闲超时）时至少每 INGEST_POLL 秒取一次
+                if woken or time.monotonic() - drained_at >= self.INGEST_POLL:
+                    self._drain_ingest(conn)
+                    drained_at = time.monotonic()
+                if control:
+                    self._handover(conn, *control)
+                if stopping:
+                    break
+            # 退出前写入未结束的桶（部分数据），重启后由 _restore 接着累加
+            with conn:
+                write_rollups(conn, self.rollups.take_closed(force=True))
+        finally:
+            conn.close()
+
+    def _rebuild_rollups(self, conn, ips):
+        """从原始数据恢复这些主机当前（最长粒度）桶内的累加状态"""
+        longest = max(seconds for _, seconds in ROLLUP_LEVELS.values())
+        now = int(time.time())
+        rows = conn.execute('''
+            SELECT ip, record_time, username, cpu, mem, disk, status FROM history
+            WHERE record_time >= ? AND ip IN (SELECT value FROM json_each(?)) ORDER BY record_time
+        ''', [now - now % longest, json.dumps(list(ips))]).fetchall()
+        self.rollups.add([tuple(r) for r in rows], restored=True)
+        # 离线采样不写 history：当前桶的离线数从已写入的聚合行读回
+        for level, (table, seconds) in ROLLUP_LEVELS.items():
+            for row in conn.execute(f'''
+                SELECT ip, username, offline_count FROM {table}
+                WHERE record_time = ? AND offline_count > 0 AND ip IN (SELECT value FROM json_each(?))
+            ''', [now - now % seconds, json.dumps(list(ips))]):
+                self.rollups.restore_offline(level, row['ip'], now - now % seconds, row['username'],
+                                             row['offline_count'])
+
+    def _restore(self, conn, ips):
+        """从库中恢复这些主机的预聚合桶、进行中的告警和在线状态（接手主机或首次写入时）"""
+        for ip in ips:
+            self.rollups.forget(ip)
+        self._rebuild_rollups(conn, ips)
+        restored = alert_engine.restore(conn, ips)
+        offline = host_status.restore(conn, ips)
+        self._known.update(ips)
+        if restored or offline:
+            logger.info(f"🔔 已恢复 {len(ips)} 台主机的状态：进行中的告警 {restored} 条，离线主机 {offline} 台")
+
+    def wake_ingest(self):
+        """推送队列有新数据（通知回调）"""
+        if self._thread is not None:
+            self._queue.put(self.INGEST)
+
+    def _drain_ingest(self, conn):
+        """取出本进程负责的主机的推送采样并写入，返回取出的行数"""
+        rows = ingest_queue.take(conn, collector_membership.owned(), self.batch_max)
+        if rows:
+            with self._lock:
+                self._pending += len(rows)
+            self._write(conn, [tuple(row[1:]) for row in rows], ingest_ids=[row[0] for row in rows])
+        return len(rows)
+
+    def handover(self, adopted, released):
+        """采集分片变化：接手的主机从库中恢复预聚合与告警状态，移交的主机丢弃内存状态（在写线程中按队列顺序执行）"""
+        if adopted or released:
+            self._queue.put((list(adopted), list(released)))
+
+    def _handover(self, conn, adopted, released):
+        # 移交的主机中已被删除的（删除可能发生在 Web 进程）：告警记为恢复、离线记为结束，下次写入时落库
+        deleted = set(released) - {row[0] for row in conn.execute(
+            'SELECT ip FROM hosts WHERE ip IN (SELECT value FROM json_each(?))', [json.dumps(list(released))])}
+        for ip in released:
+            self.rollups.forget(ip)
+            if ip in deleted:
+                alert_engine.forget(ip)
+                host_status.forget(ip)
+            else:
+                alert_engine.drop(ip)
+                host_status.drop(ip)
+            self._known.discard(ip)
+        if adopted:
+            self._restore(conn, adopted)
+
+    def _write(self, conn, batch, ingest_ids=None):
+        started = time.perf_counter()
+        transitions = status_changes = []
+        checkpoints = None
+        closed = {}
+        flush_open = False
+        try:
+            # 只有带指标的采样进入 history / 告警评估；离线采样只计入预聚合的离线数
+            samples = [row[:7] for row in batch if row[3] is not None or row[4] is not None or row[5] is not None]
+            ips = {row[0] for row in batch}
+            unknown = ips - self._known
+            if unknown:
+                self._restore(conn, unknown)
+            # 内存状态先于事务更新：提交失败时回滚到此处，避免状态变化丢失、聚合行丢失或重试时重复累加
+            checkpoints = (host_status.checkpoint(ips), alert_engine.checkpoint(ips), self.rollups.checkpoint(ips))
+            status_changes = host_status.evaluate(batch)
+            self.rollups.add([row[:7] for row in batch])
+            transitions = alert_engine.evaluate(samples, settings_cache.get())
+            closed = self.rollups.take_closed()
+            late = self.rollups.take_late()
+            # 每分钟把未结束的桶按当前部分数据写入一次，查询不必等桶结束
+            flush_open = time.monotonic() - self._open_flushed_at >= 60
+            with conn:
+                if ingest_ids:
+                    conn.execute('DELETE FROM ingest_queue WHERE id IN (SELECT value FROM json_each(?))',
+                                 [json.dumps(ingest_ids)])
+                if samples:
+                    conn.executemany(self.INSERT_SQL, samples)
+                if batch:
+                    latest = {}
+                    for row in batch:
+                        if row[0] not in latest or row[1] >= latest[row[0]][1]:
+                            latest[row[0]] = row
+                    written_at = time.time()
+                    conn.executemany(self.LATEST_SQL, [(row[0], row[1], row[3], row[4], row[5], row[6],
+                                                        row[7] if len(row) > 7 else None, written_at)
+                                                       for row in latest.values()])
+                if status_changes:
+                    HostStatusTracker.write(conn, status_changes)
+                if transitions:
+                    AlertEngine.write(conn, transitions)
+                write_rollups(conn, closed)
+                for (level, ip, start), late_offline in late.items():
+                    recompute_rollup(conn, level, ip, start, late_offline)
+                if flush_open:
+                    write_rollups(conn, self.rollups.snapshot_open())
+            ok = True
+            if flush_open:
+                self._open_flushed_at = time.monotonic()
         except Exception as e:
-            logger.error(f"❌ 采集内存使用率失败：{str(e)}")
-            return "0.0%"
+            ok = False
+            logger.error(f"❌ 历史数据批量写入失败（{len(batch)} 行）：{str(e)}")
+            if checkpoints is not None:
+                host_status.rollback(checkpoints[0])
+                alert_engine.rollback(checkpoints[1])
+                self.rollups.rollback(checkpoints[2], closed)
+        if ok and transitions:
+            self._publish_alerts(transitions)
+        if ok and status_changes:
+            self._publish_status(status_changes)
+        if ok and batch:
+            # 唤醒各 Web 进程的 SnapshotFollower 立即读取（实时推送由它们从库中发出）
+            notify_channel.send('data', 'web')
+        if not batch:
+            return
+        elapsed = time.perf_counter() - started
+        elapsed_ms = elapsed * 1000
+        if ok:
+            metrics.observe('monitor_db_write_seconds', elapsed)
+            metrics.inc('monitor_db_rows_written_total', len(batch))
+        else:
+            metrics.inc('monitor_db_write_errors_total')
+        with self._lock:
+            self._pending -= len(batch)
+            if not ok:
+                self._stats['errors'] += 1
+                return
+            self._stats['rows_written'] += len(batch)
+            self._stats['batches'] += 1
+            self._stats['last_batch_size'] = len(batch)
+            self._stats['max_batch_size'] = max(self._stats['max_batch_size'], len(batch))
+            self._stats['last_commit_ms'] = round(elapsed_ms, 2)
+            self._stats['max_commit_ms'] = round(max(self._stats['max_commit_ms'], elapsed_ms), 2)
+            self._stats['total_commit_ms'] += elapsed_ms
+
+    @staticmethod
+    def _publish_alerts(transitions):
+        """告警变化计数与日志；SSE 推送由 Web 进程的 SnapshotFollower 读取 alerts 表后发出（采集可能在其他进程）"""
+        metrics.inc('monitor_alert_transitions_total', len(transitions))
+        for ip, metric, state, value, threshold, _, _ in transitions:
+            icon = '🚨' if state == 'firing' else '✅'
+            logger.warning(f"{icon} 告警{'触发' if state == 'firing' else '恢复'}：{ip} {metric}={value}（阈值 {threshold}）")
+
+    @staticmethod
+    def _publish_status(changes):
+        metrics.inc('monitor_host_status_transitions_total', len(changes))
+        for ip, state, reason, _ in changes:
+            if state == 'offline':
+                logger.warning(f"📴 主机 {ip} 离线（{reason}）")
+
+    def stats(self):
+        with self._lock:
+            result = dict(self._stats)
+            result['queue_depth'] = self._pending
+        result['avg_commit_ms'] = round(result.pop('total_commit_ms') / result['batches'], 2) if result['batches'] else 0.0
+        return result
+
+history_writer = HistoryWriter()
+
+class IngestQueue:
+    """推送采样的库内队列：任一 Web 进程写入并通知采集进程，由持有该主机租约的采集进程的写线程取出
+
+    同一主机的预聚合、告警和在线状态因此只在一个进程中维护，与它由哪个 Web worker 接收无关。
+    """
+    def __init__(self, queue_max=HISTORY_QUEUE_MAX):
+        self.queue_max = queue_max
+
+    def submit(self, rows):
+        """写入一批 (ip, record_time, username, cpu, mem, disk, status)；积压超过 queue_max 行时拒绝并返回 False"""
+        if not rows:
+            return True
+        with get_db_connection() as conn:
+            if self.depth(conn) + len(rows) > self.queue_max:
+                return False
+            conn.executemany('''
+                INSERT INTO ingest_queue (ip, record_time, username, cpu, mem, disk, status)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            ''', rows)
+        notify_channel.send('ingest', 'collector')
+        return True
+
+    @staticmethod
+    def depth(conn):
+        """积压行数上限估计（按自增 id 范围，不做全表计数）"""
+        row = conn.execute('SELECT MAX(id) - MIN(id) + 1 FROM ingest_queue').fetchone()
+        return row[0] or 0
+
+    @staticmethod
+    def take(conn, ips, limit):
+        """按到达顺序取出 ips（None 为全部主机）的采样：(id, ip, record_time, username, cpu, mem, disk, status)"""
+        sql = 'SELECT id, ip, record_time, username, cpu, mem, disk, status FROM ingest_queue'
+        params = []
+        if ips is not None:
+            if not ips:
+                return []
+            sql += ' WHERE ip IN (SELECT value FROM json_each(?))'
+            params.append(json.dumps(sorted(ips)))
+        return conn.execute(sql + ' ORDER BY id LIMIT ?', params + [limit]).fetchall()
+
+ingest_queue = IngestQueue()
+
+# ===================== 冷数据归档（按天、按列的 NumPy 文件） =====================
+class HistoryArchive:
+    """history 的冷数据层：每天（本地日期）一个目录，每列一个 .npy 文件，读取时内存映射
+
+    - ts.npy：uint32 epoch 秒
+    - cpu.npy / mem.npy / disk.npy：uint16 定点数（值 × 10，与采集精度一致，无损），65535 为空值
+    - status.npy：uint8 状态码（STATUS_CODES 下标）
+    行按 (ip, record_time) 排序，manifest.json 记录每天每台主机在列中的 [起始行, 行数, 用户名]，
+    单主机查询只读取对应区间；archived_until 之前的原始数据只存在于归档，history 表只查询此后的数据。
+    每行 11 字节，约为 SQLite 中同样数据的四分之一，且文件可直接顺序读取 / 内存映射。
+    """
+    METRICS = ('cpu', 'mem', 'disk')
+    STATUS_CODES = ('online', 'offline', 'timeout')
+    NULL = 0xFFFF
+
+    def __init__(self, root=None):
+        self._root = root
+        self._lock = Lock()
+        self._manifest = None
+        self._manifest_key = None
+
+    @property
+    def root(self):
+        return self._root or ARCHIVE_DIR or os.path.join(os.path.dirname(DB_PATH), 'archive')
+
+    @staticmethod
+    def day_of(ts):
+        return datetime.fromtimestamp(ts).strftime('%Y-%m-%d')
+
+    @staticmethod
+    def day_range(day):
+        """本地日期的 [起始, 结束) epoch 秒"""
+        start = datetime.strptime(day, '%Y-%m-%d')
+        return int(start.timestamp()), int((start + timedelta(days=1)).timestamp())
+
+    def manifest(self):
+        """读取 manifest（文件变化后重新加载，归档进程写入后其他进程立即可见）"""
+        path = os.path.join(self.root, 'manifest.json')
+        try:
+            key = (path, os.stat(path).st_mtime_ns)
+        except FileNotFoundError:
+            return {'archived_until': None, 'days': {}}
+        with self._lock:
+            if key != self._manifest_key:
+                with open(path, encoding='utf-8') as f:
+                    self._manifest = json.load(f)
+                self._manifest_key = key
+            return self._manifest
+
+    def _save_manifest(self, manifest):
+        path = os.path.join(self.root, 'manifest.json')
+        with open(path + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, ensure_ascii=False)
+        os.replace(path + '.tmp', path)
+
+    def boundary(self):
+        return self.manifest().get('archived_until')
+
+    def _open(self, day):
+        folder = os.path.join(self.root, day)
+        return {name: np.load(os.path.join(folder, f'{name}.npy'), mmap_mode='r')
+                for name in ('ts',) + self.METRICS + ('status',)}
+
+    def archive_day(self, conn, day):
+        """把某天 history 中的数据写入归档（该天已归档时与原文件合并，同一时刻以库中数据为准），返回行数
+
+        写入顺序：列文件写到临时目录后整体替换 -> 更新 manifest（推进 archived_until）；
+        之后由调用方删除库中该天数据。中途中断时库中数据仍在，下次重新合并即可。
+        """
+        start, end = self.day_range(day)
+        manifest = json.loads(json.dumps(self.manifest()))
+        old_info = manifest['days'].get(day)
+        old = self._open(day) if old_info else None
+        ips = [row[0] for row in conn.execute(
+            'SELECT DISTINCT ip FROM history WHERE record_time >= ? AND record_time < ?', [start, end])]
+        cursor = conn.cursor()
+        cursor.row_factory = None
+        columns = {name: [] for name in ('ts',) + self.METRICS + ('status',)}
+        hosts = {}
+        offset = 0
+        for ip in sorted(set(ips) | set(old_info['hosts'] if old_info else [])):
+            rows = cursor.execute(f'''
+                SELECT record_time, {', '.join(f'IFNULL(CAST(ROUND({m} * 10) AS INTEGER), {self.NULL})' for m in self.METRICS)},
+                       CASE status WHEN 'online' THEN 0 WHEN 'offline' THEN 1 ELSE 2 END
+                FROM history WHERE ip = ? AND record_time >= ? AND record_time < ? ORDER BY record_time
+            ''', [ip, start, end]).fetchall()
+            data = np.array(rows, dtype=np.int64).reshape(-1, 5)
+            username = None
+            if old_info and ip in old_info['hosts']:
+                first, count, username = old_info['hosts'][ip]
+                previous = np.column_stack([old['ts'][first:first + count]] +
+                                           [old[m][first:first + count] for m in self.METRICS] +
+                                           [old['status'][first:first + count]]).astype(np.int64)
+                data = np.concatenate([previous, data])
+                # 稳定排序后同一时刻保留最后一条（库中数据排在归档之后）
+                data = data[np.argsort(data[:, 0], kind='stable')]
+                data = data[np.append(data[1:, 0] != data[:-1, 0], True)]
+            if rows:
+                username = conn.execute('SELECT username FROM history WHERE ip = ? AND record_time >= ? LIMIT 1',
+                                        [ip, start]).fetchone()[0]
+            if not len(data):
+                continue
+            columns['ts'].append(data[:, 0].astype(np.uint32))
+            for i, metric in enumerate(self.METRICS):
+                columns[metric].append(data[:, i + 1].astype(np.uint16))
+            columns['status'].append(data[:, 4].astype(np.uint8))
+            hosts[ip] = [offset, len(data), username]
+            offset += len(data)
+        if not hosts:
+            return 0
+
+        os.makedirs(self.root, exist_ok=True)
+        folder = os.path.join(self.root, day)
+        staging = f'{folder}.tmp'
+        shutil.rmtree(staging, ignore_errors=True)
+        os.makedirs(staging)
+        for name, parts in columns.items():
+            np.save(os.path.join(staging, f'{name}.npy'), np.concatenate(parts))
+        if os.path.exists(folder):
+            # 已打开的内存映射不受影响（文件删除后映射仍有效）
+            shutil.rmtree(folder)
+        os.replace(staging, folder)
+        manifest['days'][day] = {'start': start, 'end': end, 'rows': offset, 'hosts': hosts,
+                                 'bytes': sum(os.path.getsize(os.path.join(folder, f)) for f in os.listdir(folder))}
+        manifest['archived_until'] = max(manifest.get('archived_until') or 0, end)
+        self._save_manifest(manifest)
+        return offset
+
+    def expire(self, expire_time):
+        """删除整天早于 expire_time 的归档，返回删除的天数"""
+        manifest = json.loads(json.dumps(self.manifest()))
+        expired = [day for day, info in manifest['days'].items() if info['end'] <= expire_time]
+        if not expired:
+            return 0
+        for day in expired:
+            del manifest['days'][day]
+        self._save_manifest(manifest)
+        for day in expired:
+            shutil.rmtree(os.path.join(self.root, day), ignore_errors=True)
+        return len(expired)
+
+    def _days(self, start_ts, end_ts, descending):
+        days = [(day, info) for day, info in self.manifest()['days'].items()
+                if info['start'] <= end_ts and info['end'] > start_ts]
+        return sorted(days, key=lambda item: item[1]['start'], reverse=descending)
+
+    def iter_rows(self, start_ts, end_ts, host_ip=None, before=None):
+        """按 (record_time, ip) 降序逐块产出 [start_ts, end_ts] 内的归档行（字段与 /api/history 原始粒度一致）
+
+        before 为分页游标 (record_time, ip)，只返回排在其后的行。按 ARCHIVE_SCAN_WINDOW 分段读取，
+        每段内对各主机区间二分定位，内存占用与查询跨度无关。
+        """
+        labels = {}
+
+        def label(ts):
+            text = labels.get(ts)
+            if text is None:
+                if len(labels) > 100000:
+                    labels.clear()
+                text = labels[ts] = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(ts))
+            return text
+
+        for day, info in self._days(start_ts, end_ts, descending=True):
+            columns = self._open(day)
+            ips = sorted(info['hosts']) if host_ip is None else [host_ip] if host_ip in info['hosts'] else []
+            if not ips:
+                continue
+            window_end = min(end_ts, info['end'] - 1)
+            window_floor = max(start_ts, info['start'])
+            while window_end >= window_floor:
+                window_start = max(window_floor, window_end - ARCHIVE_SCAN_WINDOW + 1)
+                index, rank = [], []
+                for i, ip in enumerate(ips):
+                    first, count, _ = info['hosts'][ip]
+                    ts = columns['ts'][first:first + count]
+                    upper = window_end
+                    lo = np.searchsorted(ts, window_start, 'left')
+                    if before is not None:
+                        # (ts, ip) < 游标：ip 排在游标之前的主机可取同一时刻
+                        upper = min(upper, before[0] if ip < before[1] else before[0] - 1)
+                    hi = np.searchsorted(ts, upper, 'right')
+                    if hi > lo:
+                        index.append(np.arange(first + lo, first + hi))
+                        rank.append(np.full(hi - lo, i))
+                if index:
+                    index = np.concatenate(index)
+                    rank = np.concatenate(rank)
+                    ts = columns['ts'][index].astype(np.int64)
+                    order = np.lexsort((-rank, -ts))
+                    index, rank, ts = index[order], rank[order], ts[order].tolist()
+                    values = [columns[m][index].tolist() for m in self.METRICS]
+                    status = columns['status'][index].tolist()
+                    rows = []
+                    for j, host in enumerate(rank.tolist()):
+                        ip = ips[host]
+                        cpu, mem, disk = (None if v[j] == self.NULL else v[j] / 10 for v in values)
+                        rows.append({'ts': ts[j], 'record_time': label(ts[j]), 'ip': ip,
+                                     'username': info['hosts'][ip][2], 'cpu': cpu, 'mem': mem, 'disk': disk,
+                                     'status': self.STATUS_CODES[status[j]]})
+                    for i in range(0, len(rows), HISTORY_EXPORT_CHUNK):
+                        yield rows[i:i + HISTORY_EXPORT_CHUNK]
+                window_end = window_start - 1
+
+    def host_series(self, start_ts, end_ts, host_ip=None):
+        """[start_ts, end_ts] 内每台主机按时间升序的 (record_time, cpu, mem, disk) float 数组（空值为 NaN）"""
+        parts = {}
+        for day, info in self._days(start_ts, end_ts, descending=False):
+            columns = self._open(day)
+            for ip, (first, count, _) in info['hosts'].items():
+                if host_ip is not None and ip != host_ip:
+                    continue
+                ts = columns['ts'][first:first + count]
+                lo, hi = np.searchsorted(ts, start_ts, 'left'), np.searchsorted(ts, end_ts, 'right')
+                if hi <= lo:
+                    continue
+                block = np.empty((hi - lo, 4))
+                block[:, 0] = ts[lo:hi]
+                for i, metric in enumerate(self.METRICS):
+                    raw = columns[metric][first + lo:first + hi]
+                    block[:, i + 1] = np.where(raw == self.NULL, np.nan, raw / 10)
+                parts.setdefault(ip, []).append(block)
+        return {ip: np.concatenate(blocks) for ip, blocks in parts.items()}
+
+    def stats(self):
+        manifest = self.manifest()
+        days = manifest['days'].values()
+        boundary = manifest.get('archived_until')
+        return {
+            'root': self.root,
+            'hot_days': ARCHIVE_HOT_DAYS,
+            'archived_until': datetime.fromtimestamp(boundary).strftime('%Y-%m-%d %H:%M:%S') if boundary else None,
+            'days': len(manifest['days']),
+            'rows': sum(info['rows'] for info in days),
+            'bytes': sum(info.get('bytes', 0) for info in days),
+        }
+
+history_archive = HistoryArchive()
+
+# ===================== 过期数据清理（后台分批） =====================
+def hot_cutoff():
+    """热数据窗口的起点（本地零点对齐）；未开启归档返回 None"""
+    if ARCHIVE_HOT_DAYS <= 0:
+        return None
+    today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+    return int((today - timedelta(days=ARCHIVE_HOT_DAYS)).timestamp())
+
+class RetentionWorker:
+    """按 data_retention 设置分批删除过期历史数据，每批一个短事务，不长时间占用写锁
+
+    开启归档时先把早于热数据窗口（ARCHIVE_HOT_DAYS 天）的原始数据按天移入冷数据层，
+    data_retention 同时约束两层：过期的归档按天删除；1m 预聚合只保留热数据窗口。
+    状态变化表（host_status / alerts）同样按保留期限清理，但保留现有主机的最后一条（当前状态，恢复时读取）；
+    推送队列中早于保留期限的采样（如长期没有存活的采集进程负责该主机）直接丢弃并计数。
+    """
+    # 状态变化表 -> 当前状态的分组列
+    EVENT_TABLES = {'host_status': 'ip', 'alerts': 'ip, metric'}
+
+    def __init__(self, interval=RETENTION_INTERVAL, chunk_rows=RETENTION_CHUNK_ROWS, pause=RETENTION_CHUNK_PAUSE):
+        self.interval = interval
+        self.chunk_rows = chunk_rows
+        self.pause = pause
+        self._wakeup = Event()
+        self._thread = None
+        self._stats = {'runs': 0, 'rows_deleted': 0, 'last_run': None, 'last_run_rows': 0, 'last_run_seconds': 0.0,
+                       'rows_archived': 0, 'days_archived': 0, 'archive_days_expired': 0, 'events_deleted': 0,
+                       'ingest_rows_expired': 0}
+
+    def start(self):
+        if self._thread is None:
+            self._thread = Thread(target=self._run, name='retention', daemon=True)
+            self._thread.start()
+
+    def trigger(self):
+        """立即执行一次清理（如保留天数被调小）"""
+        self._wakeup.set()
+
+    def _run(self):
+        while True:
+            try:
+                self.run_once()
+            except Exception as e:
+                logger.error(f"❌ 过期数据清理失败：{str(e)}")
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+
+    def _delete_before(self, conn, table, end, start=None):
+        """分批删除 [start, end) 内的行，返回删除行数"""
+        deleted = 0
+        while True:
+            # 通过 record_time 索引取最早的一小批主键再删除
+            with conn:
+                cursor = conn.execute(f'''
+                    DELETE FROM {table} WHERE (ip, record_time) IN (
+                        SELECT ip, record_time FROM {table}
+                        WHERE record_time >= ? AND record_time < ? ORDER BY record_time LIMIT ?
+                    )
+                ''', [start or 0, end, self.chunk_rows])
+            deleted += cursor.rowcount
+            if cursor.rowcount < self.chunk_rows:
+                return deleted
+            time.sleep(self.pause)
+
+    def _delete_events_before(self, conn, table, group, end):
+        """分批删除早于 end 的状态变化，现有主机每组的最后一条除外，返回删除行数"""
+        deleted = 0
+        while True:
+            with conn:
+                cursor = conn.execute(f'''
+                    DELETE FROM {table} WHERE id IN (
+                        SELECT id FROM {table}
+                        WHERE record_time < ? AND id NOT IN (
+                            SELECT MAX(id) FROM {table} WHERE ip IN (SELECT ip FROM hosts) GROUP BY {group}
+                        )
+                        ORDER BY record_time LIMIT ?
+                    )
+                ''', [end, self.chunk_rows])
+            deleted += cursor.rowcount
+            if cursor.rowcount < self.chunk_rows:
+                return deleted
+            time.sleep(self.pause)
+
+    def _expire_ingest(self, conn, end):
+        """丢弃推送队列中早于 end 的采样，返回行数"""
+        expired = 0
+        while True:
+            with conn:
+                cursor = conn.execute('''
+                    DELETE FROM ingest_queue WHERE id IN (
+                        SELECT id FROM ingest_queue WHERE record_time < ? ORDER BY id LIMIT ?
+                    )
+                ''', [end, self.chunk_rows])
+            expired += cursor.rowcount
+            if cursor.rowcount < self.chunk_rows:
+                return expired
+            time.sleep(self.pause)
+
+    def archive(self, conn, expire_time):
+        """把早于热数据窗口、尚未过期的原始数据逐天移入冷数据层（最早的一天先处理）"""
+        cutoff = hot_cutoff()
+        if cutoff is None:
+            return
+        while True:
+            oldest = conn.execute('SELECT MIN(record_time) FROM history WHERE record_time >= ?',
+                                  [expire_time]).fetchone()[0]
+            if oldest is None or oldest >= cutoff:
+                return
+            day = HistoryArchive.day_of(oldest)
+            started = time.monotonic()
+            rows = history_archive.archive_day(conn, day)
+            start, end = HistoryArchive.day_range(day)
+            self._delete_before(conn, 'history', end, start)
+            self._stats['rows_archived'] += rows
+            self._stats['days_archived'] += 1
+            logger.info(f"🧊 已归档 {day} 的历史数据 {rows} 条，耗时 {time.monotonic() - started:.2f} 秒")
+
+    def run_once(self):
+        """归档热数据窗口之外的数据，删除早于保留期限的数据（两层），直到没有过期行"""
+        started = time.monotonic()
+        conn = get_db_connection()
+        deleted = 0
+        try:
+            retention_days = settings_cache.get('data_retention')
+            expire_time = int((datetime.now() - timedelta(days=retention_days)).timestamp())
+            self.archive(conn, expire_time)
+            deleted += self._delete_before(conn, 'history', expire_time)
+            cutoff = hot_cutoff()
+            for level, (table, _) in ROLLUP_LEVELS.items():
+                if level in ROLLUP_HOT_LEVELS and cutoff is not None:
+                    deleted += self._delete_before(conn, table, max(expire_time, cutoff))
+                else:
+                    deleted += self._delete_before(conn, table, expire_time)
+            events = sum(self._delete_events_before(conn, table, group, expire_time)
+                         for table, group in self.EVENT_TABLES.items())
+            self._stats['events_deleted'] += events
+            deleted += events
+            expired = self._expire_ingest(conn, expire_time)
+            if expired:
+                self._stats['ingest_rows_expired'] += expired
+                logger.warning(f"⚠️ 推送队列中 {expired} 条采样超过保留期限仍未写入（没有存活的采集进程负责这些主机？），已丢弃")
+            self._stats['archive_days_expired'] += history_archive.expire(expire_time)
+        finally:
+            conn.close()
+        elapsed = time.monotonic() - started
+        self._stats.update(last_run=datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+                           last_run_rows=deleted, last_run_seconds=round(elapsed, 3))
+        self._stats['runs'] += 1
+        self._stats['rows_deleted'] += deleted
+        if deleted:
+            logger.info(f"🗑️ 清理 {retention_days} 天前的历史数据 {deleted} 条，耗时 {elapsed:.2f} 秒")
+
+    def stats(self):
+        return dict(self._stats, archive=history_archive.stats())
+
+retention_worker = RetentionWorker()
+
+# ===================== 最近采样环形缓冲（内存，定长） =====================
+class RecentRing:
+    """单台主机的定长环形缓冲：时间戳 float64 + 指标 float32（cpu/mem/disk/load1，缺失为 NaN）
+
+    每台主机占用 capacity × 24 字节，与采样频率和运行时长无关。
+    """
+    __slots__ = ('ts', 'values', 'head', 'size')
+    METRICS = ('cpu', 'mem', 'disk', 'load1')
+
+    def __init__(self, capacity):
+        self.ts = np.zeros(capacity, dtype=np.float64)
+        self.values = np.full((capacity, len(self.METRICS)), np.nan, dtype=np.float32)
+        self.head = 0   # 下一次写入位置
+        self.size = 0
+
+    def append(self, ts, values):
+        if self.size and ts <= self.ts[self.head - 1]:
+            return False
+        self.ts[self.head] = ts
+        self.values[self.head] = values
+        self.head = (self.head + 1) % len(self.ts)
+        self.size = min(self.size + 1, len(self.ts))
+        return True
+
+    def window(self, since):
+        """返回 ts > since 的采样（按时间升序的副本）"""
+        capacity = len(self.ts)
+        order = np.arange(self.head - self.size, self.head) % capacity
+        start = np.searchsorted(self.ts[order], since, side='right')
+        order = order[start:]
+        return self.ts[order], self.values[order]
+
+class RecentBuffers:
+    """所有主机的最近采样：随快照发布写入，/api/recent 直接读取，不访问 SQLite"""
+    def __init__(self, capacity=RECENT_CAPACITY):
+        self.capacity = capacity
+        self._lock = Lock()
+        self._rings = {}
+
+    def append(self, ip, ts, cpu, mem, disk, load1=None):
+        values = [np.nan if v is None else v for v in (cpu, mem, disk, load1)]
+        with self._lock:
+            ring = self._rings.get(ip)
+            if ring is None:
+                ring = self._rings[ip] = RecentRing(self.capacity)
+            ring.append(ts, values)
+
+    def forget(self, ip):
+        with self._lock:
+            self._rings.pop(ip, None)
+
+    def window(self, since, ips=None):
+        """返回 {ip: (ts, values)}，ips 为空表示全部主机"""
+        with self._lock:
+            rings = self._rings.items() if ips is None else [(ip, self._rings[ip]) for ip in ips if ip in self._rings]
+            return {ip: ring.window(since) for ip, ring in rings}
+
+    def rebuild(self, conn, ips):
+        """启动时从 history 尾部重建（每台主机最近 capacity 条）"""
+        since = int(time.time() - self.capacity * get_refresh_interval() * 2)
+        rows = conn.execute('''
+            SELECT ip, record_time, cpu, mem, disk FROM (
+                SELECT ip, record_time, cpu, mem, disk,
+                       ROW_NUMBER() OVER (PARTITION BY ip ORDER BY record_time DESC) AS rn
+                FROM history WHERE record_time >= ? AND ip IN (SELECT value FROM json_each(?))
+            ) WHERE rn <= ? ORDER BY ip, record_time
+        ''', [since, json.dumps(sorted(ips)), self.capacity]).fetchall()
+        with self._lock:
+            for ip in ips:
+                self._rings.pop(ip, None)
+            for row in rows:
+                ring = self._rings.get(row['ip'])
+                if ring is None:
+                    ring = self._rings[row['ip']] = RecentRing(self.capacity)
+                ring.append(row['record_time'], [np.nan if v is None else v for v in
+                                                 (row['cpu'], row['mem'], row['disk'], None)])
+        return len(rows)
+
+    def stats(self):
+        with self._lock:
+            hosts = len(self._rings)
+            samples = sum(ring.size for ring in self._rings.values())
+        return {'hosts': hosts, 'samples': samples, 'capacity': self.capacity,
+                'bytes': hosts * self.capacity * (8 + 4 * len(RecentRing.METRICS))}
+
+recent_buffers = RecentBuffers()
+
+# ===================== 主机最新数据快照（内存） =====================
+class HostSnapshotStore:
+    """线程安全的主机最新采样快照：采集线程写入，/api/hosts 只读，不触发SSH
+
+    version 在主机增删、主机信息或指标 / 状态变化时递增（仅采样时刻变化不递增），供 /api/dashboard 生成 ETag。
+    """
+    def __init__(self):
+        self._lock = Lock()
+        self._hosts = {}    # ip -> 主机信息 + 最新采样
+        self._seq = 0       # 注册顺序（用于保持“最新添加在前”的排序）
+        self._version = 0
+
+    def register(self, ip, username, port, mode='poll'):
+        """登记主机（启动加载 / 添加主机时调用），尚无采样时指标为空"""
+        with self._lock:
+            entry = self._hosts.get(ip)
+            if entry is None:
+                self._seq += 1
+                entry = {
+                    'ip': ip, 'cpu': None, 'mem': None, 'disk': None,
+                    'load1': None, 'online': False, 'status': 'pending', 'reason': None, 'updated_at': None,
+                    'seq': self._seq
+                }
+                self._hosts[ip] = entry
+            if (entry.get('username'), entry.get('port'), entry.get('mode')) != (username, port, mode):
+                self._version += 1
+            entry['username'] = username
+            entry['port'] = port
+            entry['mode'] = mode
+
+    def publish(self, ip, cpu, mem, disk, status, load1=None, record_time=None, reason=None):
+        """发布某台主机的最新采样（status：online / offline / timeout，reason 为离线原因；主机已被删除则忽略）
+
+        record_time 为采样时刻：不晚于已发布采样的数据（如其他进程写库后被跟进读回）直接忽略。
+        返回与上一次相比指标或状态是否发生变化。
+        """
+        with self._lock:
+            entry = self._hosts.get(ip)
+            if entry is None:
+                return False
+            if record_time is not None and entry.get('record_time') is not None and record_time <= entry['record_time']:
+                return False
+            changed = (entry['cpu'], entry['mem'], entry['disk'], entry['status'], entry['reason']) != \
+                (cpu, mem, disk, status, reason)
+            recent_buffers.append(ip, record_time if record_time is not None else time.time(), cpu, mem, disk, load1)
+            if changed:
+                self._version += 1
+            entry.update(cpu=cpu, mem=mem, disk=disk, status=status, reason=reason, load1=load1, record_time=record_time,
+                         online=status == 'online', updated_at=time.time())
+            return changed
+
+    def record(self, ip, ts, cpu, mem, disk, load1=None):
+        """只写入最近采样缓冲、不改变快照：同一批中较早的采样（调用方按时间顺序写入，最后一条用 publish 发布）"""
+        with self._lock:
+            entry = self._hosts.get(ip)
+            if entry is None or (entry.get('record_time') is not None and ts <= entry['record_time']):
+                return
+            recent_buffers.append(ip, ts, cpu, mem, disk, load1)
+
+    def record_times(self, ips):
+        """{ip: 已发布采样的时刻}"""
+        with self._lock:
+            return {ip: self._hosts[ip].get('record_time') for ip in ips if ip in self._hosts}
+
+    def ips(self):
+        with self._lock:
+            return set(self._hosts)
+
+    def remove(self, ip):
+        with self._lock:
+            if self._hosts.pop(ip, None) is not None:
+                self._version += 1
+        recent_buffers.forget(ip)
+
+    def state(self, stale_after):
+        """(版本号, 已过期主机 IP 元组)：过期只随时间变化、不改变版本号，两者合起来才能判断快照是否变化"""
+        now = time.time()
+        with self._lock:
+            stale = tuple(ip for ip, e in self._hosts.items()
+                          if e['updated_at'] is None or now - e['updated_at'] > stale_after)
+            return self._version, stale
+
+    def get_all(self, stale_after, ips=None):
+        """返回所有（或 ips 指定的）主机快照副本；超过 stale_after 秒未更新的标记为 stale"""
+        now = time.time()
+        with self._lock:
+            entries = self._hosts.values() if ips is None else [self._hosts[ip] for ip in ips if ip in self._hosts]
+            entries = sorted(entries, key=lambda e: e['seq'], reverse=True)
+            entries = [dict(e) for e in entries]
+        result = []
+        for e in entries:
+            updated_at = e.pop('updated_at')
+            e.pop('seq')
+            e.pop('record_time', None)
+            e['updated_at'] = (datetime.fromtimestamp(updated_at).strftime('%Y-%m-%d %H:%M:%S')
+                               if updated_at else None)
+            e['stale'] = updated_at is None or now - updated_at > stale_after
+            # 对外保持 "37.5%" 字符串格式（前端页面按此解析）；无数据（尚未采集 / 离线）为 None
+            for key in ('cpu', 'mem', 'disk'):
+                if e[key] is not None:
+                    e[key] = f"{e[key]:.1f}%"
+            result.append(e)
+        return result
+
+snapshot_store = HostSnapshotStore()
+
+def load_snapshot_hosts():
+    """启动时把 hosts 表登记到快照（最早添加的先登记）"""
+    with get_db_connection() as conn:
+        rows = conn.execute('SELECT ip, username, port, mode FROM hosts ORDER BY created_at ASC, id ASC').fetchall()
+        for row in rows:
+            snapshot_store.register(row['ip'], row['username'], row['port'], row['mode'])
+        samples = recent_buffers.rebuild(conn, [row['ip'] for row in rows])
+    logger.info(f"✅ 已加载 {len(rows)} 台主机到内存快照，最近采样 {samples} 条")
+
+class IngestTokenStore:
+    """推送主机的上报令牌：数据库只保存 SHA-256 摘要，内存维护 摘要 -> (ip, username)，校验为一次字典查找"""
+    def __init__(self):
+        self._lock = Lock()
+        self._tokens = None
+        self._fingerprint = None   # 推送主机的 (数量, 最大 id)：增删主机都会改变
 
     @staticmethod
-    def get_disk_usage(ssh):
-        """采集磁盘使用率（Linux，默认/分区）"""
+    def hash(token):
+        return hashlib.sha256(token.encode()).hexdigest()
+
+    @staticmethod
+    def generate():
+        return secrets.token_urlsafe(24)
+
+    FINGERPRINT_SQL = "SELECT COUNT(*), IFNULL(MAX(id), 0) FROM hosts WHERE mode = 'push'"
+
+    def reload(self):
+        with get_db_connection() as conn:
+            rows = conn.execute("SELECT ip, username, token_hash FROM hosts WHERE mode = 'push'").fetchall()
+            fingerprint = tuple(conn.execute(self.FINGERPRINT_SQL).fetchone())
+        with self._lock:
+            self._tokens = {row['token_hash']: (row['ip'], row['username']) for row in rows if row['token_hash']}
+            self._fingerprint = fingerprint
+
+    def refresh(self):
+        """定期检查：推送主机有增删（其他进程 / 其他机器上的实例修改，且通知丢失）时重新加载"""
+        if self._tokens is None:
+            return
+        with get_db_connection() as conn:
+            fingerprint = tuple(conn.execute(self.FINGERPRINT_SQL).fetchone())
+        if fingerprint != self._fingerprint:
+            self.reload()
+
+    def lookup(self, token):
+        """令牌对应的 (ip, username)，无效返回 None"""
+        if self._tokens is None:
+            self.reload()
+        return self._tokens.get(self.hash(token)) if token else None
+
+    def add(self, token_hash, ip, username):
+        if self._tokens is None:
+            self.reload()
+        with self._lock:
+            self._tokens[token_hash] = (ip, username)
+
+    def remove(self, ip):
+        if self._tokens is None:
+            return
+        with self._lock:
+            self._tokens = {h: host for h, host in self._tokens.items() if host[0] != ip}
+
+ingest_tokens = IngestTokenStore()
+
+# ===================== 监控数据采集工具 =====================
+class MonitorCollector:
+    """SSH连接采集服务器监控数据（每台主机每周期一次往返，读取 /proc 与 statvfs）"""
+    # ip -> (total, idle) 上一次的 /proc/stat 累计值，用于计算两次采样间的CPU使用率
+    _cpu_counters = {}
+    _cpu_lock = Lock()
+
+    @staticmethod
+    def build_probe_command(mounts=None):
+        """构造单次探测命令：/proc/stat 首行 + 内存 + 负载 + 各挂载点 statvfs"""
+        mounts = mounts or PROBE_MOUNTS
+        quoted = ' '.join("'" + m.replace("'", "'\\''") + "'" for m in mounts)
+        return (
+            "head -n1 /proc/stat; "
+            "grep -E '^(MemTotal|MemFree|MemAvailable|Buffers|Cached):' /proc/meminfo; "
+            "echo loadavg $(cat /proc/loadavg); "
+            f"stat -f -c 'fs %S %b %f %a %n' {quoted}"
+        )
+
+    @staticmethod
+    def parse_probe_output(output):
+        """解析探测输出，返回 CPU 累计值、内存、负载、各挂载点使用率"""
+        result = {'cpu_total': None, 'cpu_idle': None, 'mem': {}, 'load1': None, 'disks': {}}
+        for line in output.splitlines():
+            parts = line.split()
+            if not parts:
+                continue
+            if parts[0] == 'cpu':
+                # user nice system idle iowait irq softirq steal（guest 已计入 user）
+                ticks = [int(v) for v in parts[1:9]]
+                result['cpu_total'] = sum(ticks)
+                result['cpu_idle'] = ticks[3] + (ticks[4] if len(ticks) > 4 else 0)
+            elif parts[0].endswith(':'):
+                result['mem'][parts[0][:-1]] = int(parts[1])
+            elif parts[0] == 'loadavg':
+                result['load1'] = float(parts[1])
+            elif parts[0] == 'fs' and len(parts) >= 6:
+                blocks, free, avail = int(parts[2]), int(parts[3]), int(parts[4])
+                used = blocks - free
+                # 与 df 的 Use% 口径一致：used / (used + avail)
+                result['disks'][' '.join(parts[5:])] = used * 100.0 / (used + avail) if used + avail else 0.0
+        return result
+
+    @classmethod
+    def cpu_usage_from_counters(cls, ip, total, idle):
+        """根据与上一次采样的累计值差计算CPU使用率；首次采样（或计数器回绕）退化为开机以来平均值"""
+        with cls._cpu_lock:
+            previous = cls._cpu_counters.get(ip)
+            cls._cpu_counters[ip] = (total, idle)
+        if previous:
+            d_total, d_idle = total - previous[0], idle - previous[1]
+            if d_total > 0 and 0 <= d_idle <= d_total:
+                return (d_total - d_idle) * 100.0 / d_total
+        return (total - idle) * 100.0 / total if total else 0.0
+
+    @classmethod
+    def forget(cls, ip):
+        """清除主机的CPU累计值（删除主机时调用）"""
+        with cls._cpu_lock:
+            cls._cpu_counters.pop(ip, None)
+
+    @classmethod
+    def probe(cls, ssh, ip, timeout=None):
+        """执行单次探测，返回 cpu/mem/disk 使用率（百分比数值）和1分钟负载；失败返回 None"""
+        started = time.perf_counter()
         try:
-            stdin, stdout, stderr = ssh.exec_command("df -h / | grep / | awk '{print $5}'")
-            disk_usage = stdout.read().decode().strip()
-            return disk_usage if disk_usage else "0.0%"
+            stdin, stdout, stderr = ssh.exec_command(cls.build_probe_command(), timeout=timeout)
+            output = stdout.read().decode()
+            metrics.observe('monitor_probe_seconds', time.perf_counter() - started, result='ok')
+            data = cls.parse_probe_output(output)
+            if data['cpu_total'] is None or 'MemTotal' not in data['mem']:
+                logger.error(f"❌ 主机 {ip} 探测输出不完整")
+                return None
+
+            cpu = cls.cpu_usage_from_counters(ip, data['cpu_total'], data['cpu_idle'])
+            mem_info = data['mem']
+            # 旧内核（< 3.14）无 MemAvailable，用 MemFree + Buffers + Cached 估算
+            available = mem_info.get('MemAvailable',
+                                     mem_info.get('MemFree', 0) + mem_info.get('Buffers', 0) + mem_info.get('Cached', 0))
+            mem = (mem_info['MemTotal'] - available) * 100.0 / mem_info['MemTotal'] if mem_info['MemTotal'] else 0.0
+            disk = max(data['disks'].values()) if data['disks'] else 0.0
+            return {'cpu': round(cpu, 1), 'mem': round(mem, 1), 'disk': round(disk, 1), 'load1': data['load1']}
         except Exception as e:
-            logger.error(f"❌ 采集磁盘使用率失败：{str(e)}")
-            return "0.0%"
+            metrics.observe('monitor_probe_seconds', time.perf_counter() - started, result='error')
+            logger.error(f"❌ 主机 {ip} 探测失败：{str(e)}")
+            return None
 
     @staticmethod
-    def connect_ssh(ip, username, password, port=22):
-        """建立SSH连接"""
+    def connect_ssh(ip, username, password, port=22, timeout=10):
+        """建立SSH连接，失败时抛出原异常（由调用方用 classify_error 归类原因）"""
         ssh = paramiko.SSHClient()
         ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+        started = time.perf_counter()
         try:
             ssh.connect(
                 hostname=ip,
                 port=port,
                 username=username,
                 password=password,
-                timeout=10,
+                timeout=timeout,
+                banner_timeout=timeout,
+                auth_timeout=timeout,
                 allow_agent=False,
                 look_for_keys=False
             )
+            metrics.observe('monitor_ssh_connect_seconds', time.perf_counter() - started, result='ok')
             logger.info(f"✅ SSH连接成功：{ip}:{port}")
             return ssh
         except Exception as e:
+            metrics.observe('monitor_ssh_connect_seconds', time.perf_counter() - started, result='error')
             logger.error(f"❌ SSH连接失败 {ip}:{port}：{str(e)}")
             ssh.close()
+            raise
+
+    @staticmethod
+    def classify_error(error):
+        """把连接异常归类为离线原因：auth / refused / timeout / unreachable / dns / ssh_error / error"""
+        if isinstance(error, paramiko.AuthenticationException):
+            return 'auth'
+        if isinstance(error, paramiko.ssh_exception.NoValidConnectionsError) and error.errors:
+            # 每个解析地址各自的连接异常，取第一个归类
+            return MonitorCollector.classify_error(next(iter(error.errors.values())))
+        if isinstance(error, ConnectionRefusedError):
+            return 'refused'
+        if isinstance(error, (socket.timeout, TimeoutError)):
+            return 'timeout'
+        if isinstance(error, socket.gaierror):
+            return 'dns'
+        if isinstance(error, OSError):
+            return 'unreachable'
+        if isinstance(error, paramiko.SSHException):
+            return 'ssh_error'
+        return 'error'
+
+# ===================== 实时推送事件中心（SSE） =====================
+class LiveEventHub:
+    """按递增编号广播实时事件，保留最近 backlog 条供断线客户端按 Last-Event-ID 续传；连接数不超过 max_clients"""
+    def __init__(self, backlog=SSE_BACKLOG, max_clients=SSE_MAX_CLIENTS):
+        self._cond = Condition()
+        self._events = deque(maxlen=backlog)   # (id, 事件类型, JSON 文本)
+        self._last_id = 0
+        self.max_clients = max_clients
+        self._clients = 0
+        self._rejected = 0
+
+    def connect(self):
+        """登记一个连接，已达上限返回 False"""
+        with self._cond:
+            if self._clients >= self.max_clients:
+                self._rejected += 1
+                return False
+            self._clients += 1
+            return True
+
+    def disconnect(self):
+        with self._cond:
+            self._clients -= 1
+
+    def stats(self):
+        with self._cond:
+            return {'clients': self._clients, 'max_clients': self.max_clients, 'rejected': self._rejected,
+                    'last_id': self._last_id}
+
+    def publish(self, event_type, data):
+        payload = json.dumps(data, ensure_ascii=False)
+        with self._cond:
+            self._last_id += 1
+            self._events.append((self._last_id, event_type, payload))
+            self._cond.notify_all()
+
+    @property
+    def last_id(self):
+        with self._cond:
+            return self._last_id
+
+    def events_after(self, event_id):
+        """返回编号大于 event_id 的事件；若已超出保留范围（需要重新发快照）返回 None"""
+        with self._cond:
+            if event_id == self._last_id:
+                return []
+            # 编号超前（服务重启后编号重置）或已被挤出保留范围
+            if event_id > self._last_id or not self._events or self._events[0][0] > event_id + 1:
+                return None
+            return [event for event in self._events if event[0] > event_id]
+
+    def wait(self, event_id, timeout):
+        """等待出现编号不等于 event_id 的新事件，超时返回 False"""
+        with self._cond:
+            return self._cond.wait_for(lambda: self._last_id != event_id, timeout)
+
+live_events = LiveEventHub()
+
+# ===================== 进程间通知（本机 Unix 数据报） =====================
+class NotifyChannel:
+    """本机进程间的轻量通知：每个进程在通知目录下绑定一个 Unix 数据报套接字（<角色>-<pid>.sock），
+    send() 向目标角色的每个套接字发一个只含主题的数据报，不等待、不重试
+
+    数据只经数据库传递，通知只用于唤醒对方立即读取；收不到通知时（跨机器部署、接收缓冲区已满）
+    各方仍按周期轮询数据库，只是延迟变大。主题：data（有新采样写入）、hosts（主机增删）、settings（设置修改）、
+    ingest（有新的推送采样待写入）。
+    """
+    def __init__(self, directory=None):
+        self._directory = directory
+        self._sock = None
+        self._path = None
+        self._sender = None
+        self._handlers = {}
+        self._stats = {'sent': 0, 'received': 0, 'stale_removed': 0}
+
+    @property
+    def directory(self):
+        return self._directory or NOTIFY_DIR or os.path.join(os.path.dirname(DB_PATH), 'notify')
+
+    def subscribe(self, topic, handler):
+        self._handlers.setdefault(topic, []).append(handler)
+
+    def open(self, role):
+        """绑定本进程的接收套接字并启动接收线程（每个进程一次；不支持 Unix 套接字的平台只轮询）"""
+        if self._sock is not None or not hasattr(socket, 'AF_UNIX'):
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, f'{role}-{os.getpid()}.sock')
+        if os.path.exists(path):
+            os.unlink(path)
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        sock.bind(path)
+        self._sock, self._path = sock, path
+        Thread(target=self._receive_loop, name='notify', daemon=True).start()
+        atexit.register(self.close)
+
+    def close(self):
+        if self._path:
+            try:
+                os.unlink(self._path)
+            except OSError:
+                pass
+
+    def _receive_loop(self):
+        while True:
+            try:
+                topic = self._sock.recv(256).decode('utf-8', 'replace')
+            except OSError:
+                return
+            self._stats['received'] += 1
+            for handler in self._handlers.get(topic, []):
+                try:
+                    handler()
+                except Exception as e:
+                    logger.error(f"❌ 处理通知 {topic} 失败：{str(e)}")
+
+    def send(self, topic, role='*'):
+        """通知目标角色（web / collector / *）的所有进程（含本进程），返回送达的进程数"""
+        if not hasattr(socket, 'AF_UNIX'):
+            return 0
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return 0
+        if self._sender is None:
+            sender = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+            sender.setblocking(False)
+            self._sender = sender
+        delivered = 0
+        for name in names:
+            if not name.endswith('.sock') or (role != '*' and not name.startswith(f'{role}-')):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                self._sender.sendto(topic.encode(), path)
+                delivered += 1
+            except (ConnectionRefusedError, FileNotFoundError):
+                # 进程已退出留下的套接字文件
+                try:
+                    os.unlink(path)
+                    self._stats['stale_removed'] += 1
+                except OSError:
+                    pass
+            except OSError:
+                pass   # 对方接收缓冲区已满：已有未处理的通知，丢弃本条即可
+        self._stats['sent'] += delivered
+        return delivered
+
+    def stats(self):
+        return dict(self._stats, role_socket=self._path)
+
+notify_channel = NotifyChannel()
+
+# ===================== SSH 会话池（长连接复用） =====================
+class SSHSessionPool:
+    """按 (ip, port, username) 复用已认证的SSH连接：存活探测、断线重连、空闲关闭（失败退避由 HostCircuitBreaker 负责）"""
+    def __init__(self, idle_timeout=SSH_POOL_IDLE_TIMEOUT):
+        self.idle_timeout = idle_timeout
+        self._lock = Lock()
+        self._sessions = {}   # key -> {'ssh', 'password', 'last_used', 'lock'}
+        self._stats = {'hits': 0, 'misses': 0, 'handshakes': 0, 'failures': 0, 'closed_idle': 0}
+
+    def _entry(self, key):
+        with self._lock:
+            entry = self._sessions.get(key)
+            if entry is None:
+                entry = {'ssh': None, 'password': None, 'last_used': 0.0, 'lock': Lock()}
+                self._sessions[key] = entry
+            return entry
+
+    def _count(self, name):
+        with self._lock:
+            self._stats[name] += 1
+
+    @staticmethod
+    def _is_alive(ssh):
+        """廉价存活探测：传输层仍活跃且能写出 SSH_MSG_IGNORE（不产生往返）"""
+        transport = ssh.get_transport() if ssh else None
+        if transport is None or not transport.is_active() or not transport.is_authenticated():
+            return False
+        try:
+            transport.send_ignore()
+            return True
+        except Exception:
+            return False
+
+    def acquire(self, ip, username, password, port=22, timeout=10):
+        """获取可用连接（复用或重连），连接失败时抛出原异常；调用方不要关闭返回的连接"""
+        key = (ip, int(port), username)
+        entry = self._entry(key)
+        with entry['lock']:
+            ssh = entry['ssh']
+            if ssh is not None and entry['password'] == password and self._is_alive(ssh):
+                entry['last_used'] = time.time()
+                self._count('hits')
+                return ssh
+            if ssh is not None:
+                ssh.close()
+                entry['ssh'] = None
+
+            self._count('misses')
+            self._count('handshakes')
+            try:
+                ssh = MonitorCollector.connect_ssh(ip, username, password, port, timeout=timeout)
+            except Exception:
+                self._count('failures')
+                raise
+
+            entry.update(ssh=ssh, password=password, last_used=time.time())
+            return ssh
+
+    def invalidate(self, ip, username, port=22):
+        """命令执行中发现连接失效时丢弃该会话，下次 acquire 重连"""
+        entry = self._entry((ip, int(port), username))
+        with entry['lock']:
+            if entry['ssh'] is not None:
+                entry['ssh'].close()
+                entry['ssh'] = None
+
+    def close_host(self, ip):
+        """关闭某个IP的全部会话（删除主机时调用）"""
+        with self._lock:
+            keys = [key for key in self._sessions if key[0] == ip]
+            entries = [self._sessions.pop(key) for key in keys]
+        for entry in entries:
+            with entry['lock']:
+                if entry['ssh'] is not None:
+                    entry['ssh'].close()
+                    entry['ssh'] = None
+
+    def close_idle(self):
+        """关闭超过 idle_timeout 未使用的会话"""
+        now = time.time()
+        with self._lock:
+            entries = list(self._sessions.values())
+        closed = 0
+        for entry in entries:
+            # 正在被使用（加锁中）的会话跳过
+            if not entry['lock'].acquire(blocking=False):
+                continue
+            try:
+                if entry['ssh'] is not None and now - entry['last_used'] > self.idle_timeout:
+                    entry['ssh'].close()
+                    entry['ssh'] = None
+                    closed += 1
+            finally:
+                entry['lock'].release()
+        if closed:
+            with self._lock:
+                self._stats['closed_idle'] += closed
+            logger.info(f"🔌 关闭 {closed} 个空闲SSH会话")
+
+    def stats(self):
+        with self._lock:
+            result = dict(self._stats)
+            result['active_sessions'] = sum(1 for e in self._sessions.values() if e['ssh'] is not None)
+        return result
+
+ssh_pool = SSHSessionPool()
+
+# ===================== 主机熔断（不可达主机不占用采集时间） =====================
+class HostCircuitBreaker:
+    """按主机的熔断器
+
+    closed：正常采集，连续失败 threshold 次后进入 open；
+    open：退避期内直接跳过（不发起连接、不占用采集线程），到期后先做 probe_timeout 秒的 TCP 端口探测，
+          端口不通则退避加倍（上限 backoff_max），端口可达进入 half_open；
+    half_open：放行一次 SSH 采集，成功恢复 closed，失败回到 open 并加倍退避。
+    跳过与探测失败都返回离线原因（refused / timeout / unreachable / auth ...），由调用方记为离线。
+    """
+    def __init__(self, threshold=BREAKER_THRESHOLD, backoff_base=SSH_POOL_BACKOFF_BASE,
+                 backoff_max=SSH_POOL_BACKOFF_MAX, probe_timeout=BREAKER_PROBE_TIMEOUT):
+        self.threshold = threshold
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.probe_timeout = probe_timeout
+        self._lock = Lock()
+        self._hosts = {}   # ip -> {'state', 'failures', 'opens', 'retry_at', 'reason'}
+        self._stats = {'skips': 0, 'probes': 0, 'probe_failures': 0, 'opened': 0, 'recovered': 0}
+
+    def check(self, ip, port):
+        """采集前调用：返回 None 表示放行 SSH，否则返回离线原因（本周期跳过该主机）"""
+        with self._lock:
+            entry = self._hosts.get(ip)
+            if entry is None or entry['state'] != 'open':
+                return None
+            if time.time() < entry['retry_at']:
+                self._stats['skips'] += 1
+                return entry['reason']
+            self._stats['probes'] += 1
+        reason = self.probe(ip, port, self.probe_timeout)
+        if reason:
+            with self._lock:
+                self._stats['probe_failures'] += 1
+            self.failure(ip, reason)
+            return reason
+        with self._lock:
+            entry['state'] = 'half_open'
+        return None
+
+    @staticmethod
+    def probe(ip, port, timeout):
+        """TCP 端口探测（不做SSH握手），可达返回 None，否则返回原因"""
+        try:
+            socket.create_connection((ip, port), timeout=timeout).close()
+            return None
+        except Exception as e:
+            return MonitorCollector.classify_error(e)
+
+    def success(self, ip):
+        with self._lock:
+            entry = self._hosts.pop(ip, None)
+            if entry is None or entry['state'] == 'closed':
+                return
+            self._stats['recovered'] += 1
+        logger.info(f"✅ 主机 {ip} 恢复连接，解除熔断")
+
+    def failure(self, ip, reason):
+        with self._lock:
+            entry = self._hosts.get(ip)
+            if entry is None:
+                entry = self._hosts[ip] = {'state': 'closed', 'failures': 0, 'opens': 0, 'retry_at': 0.0, 'reason': None}
+            entry['failures'] += 1
+            entry['reason'] = reason
+            if entry['state'] == 'closed' and entry['failures'] < self.threshold:
+                return
+            if entry['state'] == 'closed':
+                self._stats['opened'] += 1
+                logger.warning(f"⚠️ 主机 {ip} 连续 {entry['failures']} 次采集失败（{reason}），进入熔断")
+            delay = min(self.backoff_base * (2 ** entry['opens']), self.backoff_max)
+            entry.update(state='open', opens=entry['opens'] + 1, retry_at=time.time() + delay)
+
+    def forget(self, ip):
+        with self._lock:
+            self._hosts.pop(ip, None)
+
+    def hosts(self):
+        """未处于正常状态的主机：{ip: {state, failures, reason, retry_in}}"""
+        now = time.time()
+        with self._lock:
+            return {ip: {'state': e['state'], 'failures': e['failures'], 'reason': e['reason'],
+                         'retry_in': round(max(e['retry_at'] - now, 0), 1) if e['state'] == 'open' else None}
+                    for ip, e in self._hosts.items()}
+
+    def stats(self):
+        with self._lock:
+            result = dict(self._stats)
+            result['open'] = sum(1 for e in self._hosts.values() if e['state'] == 'open')
+            result['failing'] = len(self._hosts)
+        return result
+
+host_breaker = HostCircuitBreaker()
+
+# ===================== 采集分片（多进程 / 多机） =====================
+class HashRing:
+    """一致性哈希环：每个采集进程放置 vnodes 个虚拟节点，主机归属哈希值顺时针方向的第一个节点
+
+    进程增减时只有相邻区间的主机换手，其余主机的会话和CPU计数不受影响。
+    """
+    def __init__(self, nodes, vnodes=COLLECTOR_VNODES):
+        points = sorted((self._hash(f'{node}#{i}'), node) for node in nodes for i in range(vnodes))
+        self._keys = [point[0] for point in points]
+        self._nodes = [point[1] for point in points]
+
+    @staticmethod
+    def _hash(key):
+        return int.from_bytes(hashlib.md5(key.encode()).digest()[:8], 'big')
+
+    def owner(self, key):
+        if not self._keys:
             return None
+        return self._nodes[bisect_left(self._keys, self._hash(key)) % len(self._keys)]
+
+class CollectorMembership:
+    """采集进程成员管理：心跳登记 + 一致性哈希分配 + 主机租约
+
+    - 每个进程定期写 collector_workers 心跳并续期自己持有的租约，超过 TTL 未心跳即视为退出
+    - 每个采集周期开始时按存活进程构建哈希环，释放不再归属自己的主机，
+      对归属自己的主机申请租约（仅当无人持有、自己持有或原租约已过期时成功）
+    - 只采集成功持有租约的主机：成员变化期间同一台主机不会被两个进程同时采集
+    进程崩溃后其主机在一个 TTL（约一个刷新周期）后由其他进程接手；正常退出时立即释放。
+    """
+    LEASE_SQL = '''
+        INSERT INTO host_leases (ip, worker_id, expires_at) VALUES (?, ?, ?)
+        ON CONFLICT (ip) DO UPDATE SET worker_id = excluded.worker_id, expires_at = excluded.expires_at
+        WHERE host_leases.worker_id = excluded.worker_id OR host_leases.expires_at < ?
+    '''
+
+    def __init__(self, vnodes=COLLECTOR_VNODES, lease_min=COLLECTOR_LEASE_MIN):
+        self.vnodes = vnodes
+        self.lease_min = lease_min
+        self.worker_id = None
+        self._stop = Event()
+        self._thread = None
+        self._owned = set()
+        self._stats = {'workers': 0, 'assigned': 0, 'owned': 0, 'waiting': 0, 'adopted': 0, 'released': 0,
+                       'heartbeat_errors': 0}
+
+    def ttl(self):
+        return max(get_refresh_interval(), self.lease_min)
+
+    def start(self, worker_id=None):
+        """登记本进程（进程标识在启动时确定，多进程 fork/spawn 后各不相同）"""
+        if self._thread is not None:
+            return
+        self.worker_id = worker_id or os.environ.get('COLLECTOR_WORKER_ID') or f'{socket.gethostname()}:{os.getpid()}'
+        self._heartbeat()
+        self._thread = Thread(target=self._run, name='collector-heartbeat', daemon=True)
+        self._thread.start()
+        atexit.register(self.stop)
+        logger.info(f"🧩 采集进程 {self.worker_id} 已加入分片")
+
+    def stop(self):
+        """退出：删除心跳和租约，其他进程下个周期即可接手"""
+        if self._thread is None or self._stop.is_set():
+            return
+        self._stop.set()
+        try:
+            with get_db_connection() as conn:
+                conn.execute('DELETE FROM host_leases WHERE worker_id = ?', [self.worker_id])
+                conn.execute('DELETE FROM collector_workers WHERE worker_id = ?', [self.worker_id])
+        except Exception as e:
+            logger.error(f"❌ 释放采集租约失败：{str(e)}")
+
+    def _heartbeat(self):
+        now = time.time()
+        ttl = self.ttl()
+        # 最近一轮采集的结束时刻，供不运行采集的 Web 进程做健康检查
+        since = collect_scheduler.seconds_since_last_cycle()
+        last_cycle_at = None if since is None else now - since
+        stats = json.dumps(collector_report(), separators=(',', ':'))
+        conn = get_db_connection()
+        try:
+            with conn:
+                conn.execute('''
+                    INSERT INTO collector_workers (worker_id, hostname, pid, started_at, heartbeat_at, last_cycle_at, stats)
+                    VALUES (?, ?, ?, ?, ?, ?, ?)
+                    ON CONFLICT (worker_id) DO UPDATE SET heartbeat_at = excluded.heartbeat_at,
+                                                          last_cycle_at = excluded.last_cycle_at,
+                                                          stats = excluded.stats
+                ''', [self.worker_id, socket.gethostname(), os.getpid(), now, now, last_cycle_at, stats])
+                conn.execute('UPDATE host_leases SET expires_at = ? WHERE worker_id = ?', [now + ttl, self.worker_id])
+                # 清理早已退出的进程记录
+                conn.execute('DELETE FROM collector_workers WHERE heartbeat_at < ?', [now - 10 * ttl])
+        finally:
+            conn.close()
+
+    def _run(self):
+        while not self._stop.wait(self.ttl() / 3):
+            try:
+                self._heartbeat()
+            except Exception as e:
+                self._stats['heartbeat_errors'] += 1
+                logger.error(f"❌ 采集进程心跳失败：{str(e)}")
+            # 其他机器上的实例收不到本机通知：随心跳检查设置和推送令牌
+            poll_shared_state()
+
+    def claim(self, hosts):
+        """返回本周期由本进程负责的主机（hosts 为全部主机：轮询主机由本进程采集，推送主机的采样由本进程写入）"""
+        if self.worker_id is None:
+            return hosts
+        now = time.time()
+        ttl = self.ttl()
+        conn = get_db_connection()
+        try:
+            alive = [row[0] for row in conn.execute(
+                'SELECT worker_id FROM collector_workers WHERE heartbeat_at >= ?', [now - ttl])]
+            if self.worker_id not in alive:
+                alive.append(self.worker_id)
+            ring = HashRing(alive, self.vnodes)
+            assigned = {host['ip'] for host in hosts if ring.owner(host['ip']) == self.worker_id}
+            with conn:
+                conn.execute('''
+                    DELETE FROM host_leases
+                    WHERE worker_id = ? AND ip NOT IN (SELECT value FROM json_each(?))
+                ''', [self.worker_id, json.dumps(sorted(assigned))])
+                conn.executemany(self.LEASE_SQL, [(ip, self.worker_id, now + ttl, now) for ip in assigned])
+                owned = {row[0] for row in conn.execute(
+                    'SELECT ip FROM host_leases WHERE worker_id = ?', [self.worker_id])}
+        finally:
+            conn.close()
+
+        adopted, released = owned - self._owned, self._owned - owned
+        if adopted or released:
+            # 接手的主机从库中恢复预聚合/告警状态；移交的主机关闭会话、丢弃本进程状态
+            history_writer.handover(adopted, released)
+            for ip in released:
+                ssh_pool.close_host(ip)
+                MonitorCollector.forget(ip)
+            logger.info(f"🧩 采集分片变化：{len(alive)} 个进程，接手 {len(adopted)} 台，移交 {len(released)} 台")
+        self._owned = owned
+        self._stats.update(workers=len(alive), assigned=len(assigned), owned=len(owned),
+                           waiting=len(assigned - owned))
+        self._stats['adopted'] += len(adopted)
+        self._stats['released'] += len(released)
+        return [host for host in hosts if host['ip'] in owned]
+
+    def owned(self):
+        """本进程持有租约的主机；未参与分片（单进程）时返回 None，表示全部主机"""
+        return None if self.worker_id is None else set(self._owned)
+
+    def stats(self):
+        result = dict(self._stats)
+        result['worker_id'] = self.worker_id
+        return result
+
+collector_membership = CollectorMembership()
+
+class SnapshotFollower:
+    """Web 进程跟进库中的数据变化（采集可能在独立进程 / 其他实例中进行）
+
+    - 读取 host_latest 中新写入的采样发布到本进程快照（已由本进程发布的采样按采样时刻去重）
+    - 读取新增的 alerts / host_status 记录推送给 SSE 客户端
+    - 定期与 hosts 表对齐主机列表（其他进程 / 实例添加、删除的主机）
+    - 主机变为过期 / 恢复时推送 update：采集停滞时没有新采样，过期只能由这里按时间发现
+    - host_latest 每台主机只有最新一条：与上次发布之间的采样（如推送的整批）从 history 补进最近采样缓冲
+    收到 data / hosts 通知时立即读取，否则每 poll 秒轮询一次。
+    """
+    LOOKBACK = 5    # 秒：覆盖写入时刻与提交时刻之差、多机时钟偏差
+
+    def __init__(self, poll=FOLLOW_POLL, host_sync=5.0):
+        self.poll = poll
+        self.host_sync = host_sync
+        self._thread = None
+        self._wakeup = Event()
+        self._resync = Event()
+
+    def start(self):
+        if self._thread is None:
+            notify_channel.subscribe('data', self._wakeup.set)
+            notify_channel.subscribe('hosts', self.resync)
+            self._thread = Thread(target=self._run, name='snapshot-follower', daemon=True)
+            self._thread.start()
+
+    def resync(self):
+        """主机列表已变化：下一轮立即对齐"""
+        self._resync.set()
+        self._wakeup.set()
+
+    def _run(self):
+        watermark = 0.0
+        synced_at = 0.0
+        stale = None
+        conn = get_db_connection()
+        try:
+            # 只推送启动之后产生的告警 / 状态变化
+            alert_id = conn.execute('SELECT IFNULL(MAX(id), 0) FROM alerts').fetchone()[0]
+            status_id = conn.execute('SELECT IFNULL(MAX(id), 0) FROM host_status').fetchone()[0]
+        finally:
+            conn.close()
+        while True:
+            try:
+                conn = get_db_connection()
+                try:
+                    if self._resync.is_set() or time.monotonic() - synced_at >= self.host_sync:
+                        self._resync.clear()
+                        self._sync_hosts(conn)
+                        poll_shared_state()
+                        synced_at = time.monotonic()
+                    rows = conn.execute('''
+                        SELECT ip, record_time, cpu, mem, disk, status, reason, written_at FROM host_latest
+                        WHERE written_at > ? ORDER BY written_at
+                    ''', [watermark - self.LOOKBACK]).fetchall()
+                    between = self._between(conn, rows)
+                    alerts = conn.execute('''
+                        SELECT id, ip, metric, state, value, threshold, started_at, record_time
+                        FROM alerts WHERE id > ? ORDER BY id
+                    ''', [alert_id]).fetchall()
+                    changes = conn.execute('''
+                        SELECT id, ip, state, reason, record_time FROM host_status WHERE id > ? ORDER BY id
+                    ''', [status_id]).fetchall()
+                finally:
+                    conn.close()
+                for row in between:
+                    snapshot_store.record(row['ip'], row['record_time'], row['cpu'], row['mem'], row['disk'])
+                changed = [row['ip'] for row in rows
+                           if snapshot_store.publish(row['ip'], row['cpu'], row['mem'], row['disk'], row['status'],
+                                                     record_time=row['record_time'], reason=row['reason'])]
+                if rows:
+                    watermark = max(watermark, rows[-1]['written_at'])
+                # 过期状态变化（不伴随指标变化）的主机一并推送
+                current = set(snapshot_store.state(get_stale_after())[1])
+                if stale is not None:
+                    known = snapshot_store.ips()
+                    changed += [ip for ip in current ^ stale if ip in known and ip not in changed]
+                stale = current
+                if changed:
+                    live_events.publish('update', build_live_update(changed))
+                if alerts:
+                    alert_id = alerts[-1]['id']
+                    live_events.publish('alert', {'alerts': [
+                        {key: row[key] for key in row.keys() if key != 'id'} for row in alerts]})
+                if changes:
+                    status_id = changes[-1]['id']
+                    live_events.publish('status', {'hosts': [
+                        {key: row[key] for key in row.keys() if key != 'id'} for row in changes]})
+            except Exception as e:
+                logger.error(f"❌ 快照跟进失败：{str(e)}")
+            self._wakeup.wait(self.poll)
+            self._wakeup.clear()
+
+    @staticmethod
+    def _between(conn, rows):
+        """已发布采样与 host_latest 新一条之间写入 history 的采样（按主机、时间升序），一条语句按主键查找"""
+        published = snapshot_store.record_times([row['ip'] for row in rows])
+        spans = [[row['ip'], published[row['ip']], row['record_time']] for row in rows
+                 if published.get(row['ip']) is not None and row['record_time'] - published[row['ip']] > 1]
+        if not spans:
+            return []
+        return conn.execute('''
+            SELECT h.ip, h.record_time, h.cpu, h.mem, h.disk
+            FROM json_each(?) j
+            JOIN history h ON h.ip = json_extract(j.value, '$[0]')
+                          AND h.record_time > json_extract(j.value, '$[1]')
+                          AND h.record_time < json_extract(j.value, '$[2]')
+            ORDER BY h.ip, h.record_time
+        ''', [json.dumps(spans)]).fetchall()
+
+    def _sync_hosts(self, conn):
+        rows = conn.execute('SELECT ip, username, port, mode FROM hosts ORDER BY created_at ASC, id ASC').fetchall()
+        known = snapshot_store.ips()
+        for row in rows:
+            if row['ip'] not in known:
+                snapshot_store.register(row['ip'], row['username'], row['port'], row['mode'])
+        removed = known - {row['ip'] for row in rows}
+        for ip in removed:
+            snapshot_store.remove(ip)
+        if removed:
+            live_events.publish('remove', {'ips': sorted(removed), 'overview': dashboard_view.current()['overview']})
+
+snapshot_follower = SnapshotFollower()
+
+# ===================== 新增：定时采集数据任务（存入 history 表） =====================
+# 采集线程池（常驻，避免每个周期重复创建线程）
+collect_executor = ThreadPoolExecutor(max_workers=COLLECT_MAX_WORKERS, thread_name_prefix='collect')
+
+def offline_result(host, status, reason):
+    """离线 / 超时结果：指标为空并附带原因，写线程只记录状态变化，不写 history"""
+    return {'ip': host['ip'], 'username': host['username'], 'record_time': int(time.time()),
+            'cpu': None, 'mem': None, 'disk': None, 'load1': None, 'status': status, 'reason': reason}
+
+def collect_host(host):
+    """采集单台主机（在线程池中执行），超过单机时限的结果标记为 timeout；熔断中的主机不发起SSH"""
+    started = time.monotonic()
+    reason = host_breaker.check(host['ip'], host['port'])
+    if reason:
+        metrics.observe('monitor_host_collect_seconds', time.monotonic() - started, status='skipped')
+        return offline_result(host, 'offline', reason)
+    sample = None
+    try:
+        ssh = ssh_pool.acquire(host['ip'], host['username'], host['password'], host['port'],
+                               timeout=COLLECT_HOST_TIMEOUT)
+    except Exception as e:
+        ssh = None
+        reason = MonitorCollector.classify_error(e)
+    if ssh:
+        sample = MonitorCollector.probe(ssh, host['ip'], timeout=COLLECT_HOST_TIMEOUT)
+        if not sample:
+            # 连接已建立但探测失败，丢弃会话，下个周期重连
+            ssh_pool.invalidate(host['ip'], host['username'], host['port'])
+            reason = 'probe_failed'
+    if not sample:
+        host_breaker.failure(host['ip'], reason)
+        metrics.observe('monitor_host_collect_seconds', time.monotonic() - started, status='offline')
+        return offline_result(host, 'offline', reason)
+    host_breaker.success(host['ip'])
+    status = 'timeout' if time.monotonic() - started > COLLECT_HOST_TIMEOUT else 'online'
+    metrics.observe('monitor_host_collect_seconds', time.monotonic() - started, status=status)
+    return {'ip': host['ip'], 'username': host['username'], 'status': status, 'reason': None,
+            'record_time': int(time.time()), **sample}
+
+def host_phase(ip, spread):
+    """主机在周期内的固定相位（按IP哈希均匀分布在 [0, spread)），使同一主机的采样间隔保持稳定"""
+    return (zlib.crc32(ip.encode()) / 2 ** 32) * spread
+
+def run_collect_cycle(hosts, spread=0.0):
+    """并发采集一批主机
+
+    各主机在 spread 秒内按相位 + 抖动错开提交，最多等待到 spread + COLLECT_CYCLE_TIMEOUT 秒，
+    未按时完成的主机返回 timeout 结果。
+    """
+    started = time.monotonic()
+    futures = {}
+    schedule = sorted(((host_phase(host['ip'], spread) + random.uniform(0, COLLECT_JITTER if spread else 0), host)
+                       for host in hosts), key=lambda item: item[0])
+    for offset, host in schedule:
+        delay = started + offset - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        futures[collect_executor.submit(collect_host, host)] = host
+    deadline = started + spread + COLLECT_CYCLE_TIMEOUT
+    done, not_done = wait(futures, timeout=max(deadline - time.monotonic(), 0))
+
+    results = []
+    for future in done:
+        host = futures[future]
+        try:
+            results.append(future.result())
+        except Exception as e:
+            logger.error(f"❌ 采集主机 {host['ip']} 异常：{str(e)}")
+            results.append(offline_result(host, 'offline', 'error'))
+    for future in not_done:
+        # 尚未开始的任务直接取消；已在执行的由SSH超时自行结束（并自行更新熔断状态），结果丢弃
+        if future.cancel():
+            host_breaker.failure(futures[future]['ip'], 'timeout')
+        results.append(offline_result(futures[future], 'timeout', 'timeout'))
+    if not_done:
+        logger.warning(f"⚠️ 本周期 {len(not_done)} 台主机未在时限内完成，已标记为超时")
+    return results
 
-# ===================== 新增：定时采集数据任务（存入 history 表） =====================
 def collect_server_data():
-    """定时采集所有主机数据，存入 history 表 + 清理过期数据"""
-    collector = MonitorCollector()
+    """定时采集所有主机数据，存入 history 表（过期数据由 RetentionWorker 清理）"""
     conn = get_db_connection()
     cursor = conn.cursor()
 
     try:
-        # 1. 获取所有已添加主机
-        cursor.execute('SELECT ip, username, password, port FROM hosts')
-        hosts = cursor.fetchall()
+        # 1. 多个采集进程时按租约分配主机（push 主机也参与分配：其推送采样由持有租约的进程写入），
+        #    本进程只 SSH 轮询持有租约的 poll 主机
+        cursor.execute("SELECT ip, username, password, port, mode FROM hosts")
+        hosts = [host for host in collector_membership.claim(cursor.fetchall()) if host['mode'] == 'poll']
         if not hosts:
-            logger.info("⚠️ 暂无已添加的主机，跳过数据采集")
-            conn.close()
-            # 读取刷新频率，启动下一次采集
-            restart_collect_task()
+            logger.info("⚠️ 暂无需要本进程 SSH 轮询的主机，跳过数据采集")
             return
 
-        # 2. 遍历主机采集数据并存入 history 表
-        for host in hosts:
-            ip = host['ip']
-            username = host['username']
-            password = host['password']
-            port = host['port']
-
-            # 建立SSH连接采集数据
-            ssh = collector.connect_ssh(ip, username, password, port)
-            if ssh:
-                cpu = collector.get_cpu_usage(ssh)
-                mem = collector.get_mem_usage(ssh)
-                disk = collector.get_disk_usage(ssh)
-                ssh.close()
-            else:
-                # 连接失败，存入离线数据
-                cpu = "0.0%"
-                mem = "0.0%"
-                disk = "0.0%"
+        # 2. 并发采集所有主机数据（在周期前半段错开发起，平滑SSH与写库负载）
+        cycle_started = time.monotonic()
+        results = run_collect_cycle(hosts, spread=get_refresh_interval() * COLLECT_SPREAD)
 
-            # 存入 history 表
-            cursor.execute('''
-                INSERT INTO history (ip, username, cpu, mem, disk, record_time)
-                VALUES (?, ?, ?, ?, ?, ?)
-            ''', [ip, username, cpu, mem, disk, datetime.now().strftime('%Y-%m-%d %H:%M:%S')])
-            logger.info(f"📝 已记录主机 {ip} 历史数据：CPU={cpu}, MEM={mem}")
-
-        # 3. 清理过期数据（按系统设置的保留天数）
-        cursor.execute('SELECT data_retention FROM settings LIMIT 1')
-        retention_days = cursor.fetchone()['data_retention']
-        expire_time = (datetime.now() - timedelta(days=retention_days)).strftime('%Y-%m-%d %H:%M:%S')
-        cursor.execute('DELETE FROM history WHERE record_time < ?', [expire_time])
-        logger.info(f"🗑️ 清理 {retention_days} 天前的历史数据（过期时间：{expire_time}）")
+        # 3. 发布到内存快照，并交给写线程批量写入 history 表
+        rows = []
+        changed_ips = []
+        for row in results:
+            # 发布到内存快照（/api/hosts 直接读取），记录发生变化的主机用于实时推送
+            if snapshot_store.publish(row['ip'], row['cpu'], row['mem'], row['disk'], row['status'], row['load1'],
+                                      row['record_time'], row['reason']):
+                changed_ips.append(row['ip'])
+            rows.append((row['ip'], row['record_time'], row['username'], row['cpu'], row['mem'], row['disk'],
+                         row['status'], row['reason']))
+            metrics.inc('monitor_host_samples_total', status=row['status'])
+            if LOG_SAMPLES:
+                logger.info(f"📝 已记录主机 {row['ip']} 历史数据：CPU={row['cpu']}, MEM={row['mem']}, 状态={row['status']}"
+                            + (f"（{row['reason']}）" if row['reason'] else ''))
+        history_writer.submit(rows)
+        if changed_ips:
+            live_events.publish('update', build_live_update(changed_ips))
+        cycle_seconds = time.monotonic() - cycle_started
+        metrics.observe('monitor_collect_cycle_seconds', cycle_seconds)
+        logger.info(f"⏱️ 本周期采集 {len(results)} 台主机，耗时 {cycle_seconds:.2f} 秒")
 
-        conn.commit()
+        ssh_pool.close_idle()
     except Exception as e:
         logger.error(f"❌ 定时数据采集失败：{str(e)}")
     finally:
         conn.close()
-        # 启动下一次采集任务
-        restart_collect_task()
 
-def restart_collect_task():
-    """读取系统设置的刷新频率，启动下一次采集"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute('SELECT refresh_interval FROM settings LIMIT 1')
-    interval = cursor.fetchone()['refresh_interval']
-    conn.close()
-    # 定时执行（interval 秒后）
-    Timer(interval, collect_server_data).start()
-    logger.info(f"⏰ 下一次数据采集将在 {interval} 秒后执行")
+def get_refresh_interval():
+    """系统设置的刷新频率（秒），读取内存缓存"""
+    return settings_cache.get('refresh_interval')
+
+def get_stale_after():
+    """快照过期时间：超过 3 个采集周期未更新即视为过期"""
+    return max(get_refresh_interval() * 3, 15)
+
+class CollectScheduler:
+    """固定频率调度采集任务：常驻调度线程 + 常驻执行线程
+
+    - 按 next_tick += interval 推进，周期不受单次采集耗时影响，不会漂移
+    - 到点时上一轮仍在执行则跳过本次（记为 overrun）；落后多个周期时直接跳到下一个未来时刻
+    - 每次到点重新读取 refresh_interval；设置被修改时调用 reschedule() 立即按新间隔重新计算
+    """
+    def __init__(self, job, interval_getter):
+        self.job = job
+        self.interval_getter = interval_getter
+        self._wakeup = Event()      # 设置变更 / 停止时唤醒调度线程
+        self._kick = Event()        # 通知执行线程开始一轮采集
+        self._running = Event()     # 执行线程正在采集
+        self._stopping = False
+        self._threads = []
+        self._last_tick = None
+        self._last_finished = None  # 上一轮采集结束时刻（monotonic）
+        self._stats = {'ticks': 0, 'cycles': 0, 'overruns': 0, 'skipped_ticks': 0, 'interval': None,
+                       'last_lag_ms': 0.0, 'max_lag_ms': 0.0, 'last_cycle_seconds': 0.0, 'max_cycle_seconds': 0.0}
+
+    def start(self):
+        if not self._threads:
+            self._threads = [Thread(target=self._tick_loop, name='collect-scheduler', daemon=True),
+                             Thread(target=self._run_loop, name='collect-runner', daemon=True)]
+            for thread in self._threads:
+                thread.start()
+            logger.info("⏰ 采集调度器已启动（固定频率）")
+
+    def stop(self):
+        self._stopping = True
+        self._wakeup.set()
+        self._kick.set()
+
+    def reschedule(self):
+        """刷新频率已修改：唤醒调度线程按新间隔重新计算下一次时刻"""
+        self._wakeup.set()
+
+    def _tick_loop(self):
+        next_tick = time.monotonic()
+        while not self._stopping:
+            delay = next_tick - time.monotonic()
+            if delay > 0:
+                if self._wakeup.wait(delay):
+                    self._wakeup.clear()
+                    if self._last_tick is not None:
+                        next_tick = self._last_tick + max(self.interval_getter(), 1)
+                    continue
+            now = time.monotonic()
+            lag_ms = (now - next_tick) * 1000
+            self._last_tick = next_tick
+            self._stats['ticks'] += 1
+            self._stats['last_lag_ms'] = round(lag_ms, 2)
+            self._stats['max_lag_ms'] = round(max(self._stats['max_lag_ms'], lag_ms), 2)
+            if self._running.is_set():
+                self._stats['overruns'] += 1
+                logger.warning("⚠️ 上一轮采集尚未结束，跳过本次调度")
+            else:
+                self._running.set()
+                self._kick.set()
+
+            interval = max(self.interval_getter(), 1)
+            self._stats['interval'] = interval
+            next_tick += interval
+            if next_tick < time.monotonic():
+                # 落后超过一个周期：跳过错过的时刻，不做补偿性连续采集
+                missed = math.ceil((time.monotonic() - next_tick) / interval)
+                next_tick += missed * interval
+                self._stats['skipped_ticks'] += missed
+
+    def _run_loop(self):
+        while True:
+            self._kick.wait()
+            self._kick.clear()
+            if self._stopping:
+                break
+            started = time.monotonic()
+            try:
+                self.job()
+            except Exception as e:
+                logger.error(f"❌ 采集任务异常：{str(e)}")
+            finally:
+                elapsed = time.monotonic() - started
+                self._stats['cycles'] += 1
+                self._stats['last_cycle_seconds'] = round(elapsed, 3)
+                self._stats['max_cycle_seconds'] = round(max(self._stats['max_cycle_seconds'], elapsed), 3)
+                self._last_finished = time.monotonic()
+                self._running.clear()
+
+    def started(self):
+        return bool(self._threads)
+
+    def seconds_since_last_cycle(self):
+        """距上一轮采集结束的秒数，尚未完成过采集返回 None"""
+        return None if self._last_finished is None else time.monotonic() - self._last_finished
+
+    def stats(self):
+        result = dict(self._stats)
+        result['running'] = self._running.is_set()
+        since = self.seconds_since_last_cycle()
+        result['seconds_since_last_cycle'] = None if since is None else round(since, 3)
+        return result
+
+collect_scheduler = CollectScheduler(collect_server_data, get_refresh_interval)
+
+# ===================== 响应压缩与监控大屏聚合 =====================
+COMPRESS_MIN_BYTES = 1024   # 小于该大小的响应不压缩
+
+def negotiate_encoding():
+    """按 Accept-Encoding 选择压缩方式：br（已安装 brotli 时）优先，其次 gzip，否则 None"""
+    accepted = request.accept_encodings
+    if brotli is not None and accepted['br']:
+        return 'br'
+    if accepted['gzip']:
+        return 'gzip'
+    return None
+
+def compress_body(body, encoding):
+    if encoding == 'br':
+        return brotli.compress(body, quality=5)
+    # wbits=31 输出带 gzip 头的压缩流
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    return compressor.compress(body) + compressor.flush()
+
+def compress_response(response):
+    """按客户端支持的编码压缩非流式响应（已编码、流式或过小的响应原样返回）"""
+    response.vary.add('Accept-Encoding')
+    if response.direct_passthrough or response.is_streamed or 'Content-Encoding' in response.headers:
+        return response
+    body = response.get_data()
+    encoding = negotiate_encoding() if len(body) >= COMPRESS_MIN_BYTES else None
+    if encoding:
+        response.set_data(compress_body(body, encoding))
+        response.headers['Content-Encoding'] = encoding
+    return response
+
+def percent_value(text):
+    """快照中的 "37.5%" 转回数值（与页面 parseFloat 的结果一致），无数据返回 None"""
+    return None if text is None else float(text.rstrip('%'))
+
+class DashboardView:
+    """/api/dashboard 的响应缓存：快照版本、过期主机和设置都未变化时直接复用上次序列化（及压缩）的结果
+
+    ETag 为响应内容的摘要（不含更新时刻等每次采样都会变化的字段），多个 Web 进程对同一份数据给出相同的 ETag；
+    压缩后的表示在 ETag 后附加编码名以区分。
+    """
+    def __init__(self):
+        self._lock = Lock()
+        self._cached = None     # (缓存键, 响应体, etag, {编码: 压缩后的响应体}, 响应数据)
+
+    def render(self):
+        """返回 (缓存键对应的响应体, etag, 压缩结果字典)"""
+        return self._current()[1:4]
+
+    def current(self):
+        """返回当前的响应数据（hosts / overview / settings），供实时推送复用同一份告警标记和概览统计"""
+        return self._current()[4]
+
+    def _current(self):
+        stale_after = get_stale_after()
+        version, stale = snapshot_store.state(stale_after)
+        settings, _, settings_etag = settings_cache.snapshot()
+        key = (version, stale, settings_etag)
+        cached = self._cached
+        if cached is not None and cached[0] == key:
+            return cached
+        with self._lock:
+            cached = self._cached
+            if cached is not None and cached[0] == key:
+                return cached
+            data = self.build(snapshot_store.get_all(stale_after), settings)
+            body = json.dumps(data, ensure_ascii=False, separators=(',', ':')).encode()
+            etag = hashlib.sha1(body).hexdigest()[:20]
+            self._cached = (key, body, etag, {}, data)
+            return self._cached
+
+    @staticmethod
+    def build(hosts, settings):
+        cpu_threshold = settings['cpu_threshold']
+        mem_threshold = settings['mem_threshold']
+        overview = {'total': len(hosts), 'online': 0, 'offline': 0, 'stale': 0, 'pending': 0,
+                    'cpu_alerts': 0, 'mem_alerts': 0, 'avg_cpu': 0.0, 'avg_mem': 0.0}
+        cpu_values, mem_values = [], []
+        result = []
+        for host in hosts:
+            cpu = percent_value(host['cpu'])
+            mem = percent_value(host['mem'])
+            if cpu is not None:
+                cpu_values.append(cpu)
+            if mem is not None:
+                mem_values.append(mem)
+            alerts = {'cpu': cpu is not None and cpu > cpu_threshold, 'mem': mem is not None and mem > mem_threshold}
+            overview['cpu_alerts'] += alerts['cpu']
+            overview['mem_alerts'] += alerts['mem']
+            if host['stale']:
+                overview['stale'] += 1
+            if host['status'] == 'pending':
+                overview['pending'] += 1
+            elif host['online'] and not host['stale']:
+                overview['online'] += 1
+            else:
+                overview['offline'] += 1
+            result.append({key: host[key] for key in ('ip', 'username', 'port', 'mode', 'cpu', 'mem', 'disk',
+                                                      'status', 'reason', 'online', 'stale')})
+            result[-1]['alerts'] = alerts
+        # 平均值只统计有数据的主机：尚未采集和离线的主机不按 0 拉低全局平均
+        if cpu_values:
+            overview['avg_cpu'] = round(sum(cpu_values) / len(cpu_values), 1)
+        if mem_values:
+            overview['avg_mem'] = round(sum(mem_values) / len(mem_values), 1)
+        return {'hosts': result, 'overview': overview,
+                'settings': {'cpu_threshold': cpu_threshold, 'mem_threshold': mem_threshold}}
+
+dashboard_view = DashboardView()
+
+@app.route('/api/dashboard', methods=['GET'])
+def get_dashboard():
+    """监控大屏数据：主机列表、告警阈值、概览统计和告警标记（一次请求）；内容未变化时返回 304"""
+    try:
+        body, etag, compressed = dashboard_view.render()
+        encoding = negotiate_encoding() if len(body) >= COMPRESS_MIN_BYTES else None
+        if encoding:
+            etag = f'{etag}-{encoding}'
+        headers = {'ETag': f'"{etag}"', 'Cache-Control': 'no-cache', 'Vary': 'Accept-Encoding'}
+        if request.if_none_match.contains_weak(etag):
+            return '', 304, headers
+        if encoding:
+            if encoding not in compressed:
+                compressed[encoding] = compress_body(body, encoding)
+            body = compressed[encoding]
+            headers['Content-Encoding'] = encoding
+        return Response(body, content_type='application/json', headers=headers), 200
+    except Exception as e:
+        logger.error(f"❌ /api/dashboard 报错：{str(e)}")
+        return jsonify({'error': '查询失败', 'detail': str(e)}), 500
 
 # ===================== 原有核心接口（保持不变） =====================
 @app.route('/api/hosts', methods=['GET'])
 def get_hosts():
-    """获取主机列表（自动采集最新数据）"""
+    """获取主机列表（读取采集线程发布的内存快照，不触发SSH）"""
     try:
-        logger.info("📥 收到 /api/hosts 查询请求")
-        collector = MonitorCollector()
-        
-        with sqlite3.connect(DB_PATH) as conn:
-            conn.row_factory = sqlite3.Row
-            cursor = conn.cursor()
-            cursor.execute('SELECT id, ip, username, password, port FROM hosts ORDER BY created_at DESC')
-            hosts = cursor.fetchall()
-            
-            # 批量采集数据并更新（移除 updated_at 更新）
-            for host in hosts:
-                ssh = collector.connect_ssh(
-                    ip=host['ip'],
-                    username=host['username'],
-                    password=host['password'],
-                    port=host['port']
-                )
-                if ssh:
-                    cpu = collector.get_cpu_usage(ssh)
-                    mem = collector.get_mem_usage(ssh)
-                    disk = collector.get_disk_usage(ssh)
-                    ssh.close()
-                    
-                    # 更新数据库（只更新监控数据，不涉及 updated_at）
-                    cursor.execute('''
-                        UPDATE hosts SET cpu=?, mem=?, disk=? WHERE id=?
-                    ''', (cpu, mem, disk, host['id']))
-                    conn.commit()
-        
-        # 重新查询更新后的数据
-        cursor.execute('''
-            SELECT ip, username, port, cpu, mem, disk FROM hosts
-            ORDER BY created_at DESC
-        ''')
-        result = []
-        for row in cursor.fetchall():
-            result.append({
-                'ip': row['ip'],
-                'username': row['username'],
-                'port': row['port'],
-                'cpu': row['cpu'],
-                'mem': row['mem'],
-                'disk': row['disk']
-            })
-        
-        logger.info(f"📤 查询完成，共 {len(result)} 台主机（已更新监控数据）")
+        result = snapshot_store.get_all(get_stale_after())
         return jsonify(result), 200
     except Exception as e:
         logger.error(f"❌ /api/hosts 报错：{str(e)}")
         return jsonify({'error': '查询失败', 'detail': str(e)}), 500
 
+def format_sse(event_id, event_type, payload):
+    return f"id: {event_id}\nevent: {event_type}\ndata: {payload}\n\n"
+
+def build_live_snapshot():
+    """连接（或续传失败）时发送的完整快照：与 /api/dashboard 相同（全部主机 + 概览统计 + 告警阈值）"""
+    return dashboard_view.render()[0].decode()
+
+def build_live_update(ips):
+    """变化主机的推送内容：主机数据（含告警标记）+ 最新概览统计，页面无需自行计算"""
+    data = dashboard_view.current()
+    wanted = set(ips)
+    return {'hosts': [host for host in data['hosts'] if host['ip'] in wanted], 'overview': data['overview']}
+
+@app.route('/api/stream', methods=['GET'])
+def stream_live_updates():
+    """SSE 实时推送：连接时发送快照，之后只推送变化的主机；断线重连按 Last-Event-ID 补发
+
+    每个连接占用一个工作线程，超过 SSE_MAX_CLIENTS 时返回 503，客户端退回轮询 /api/dashboard。
+    """
+    try:
+        last_event_id = int(request.headers.get('Last-Event-ID', ''))
+    except ValueError:
+        last_event_id = None
+    if not live_events.connect():
+        return jsonify({'error': '实时推送连接数已达上限，请改用轮询'}), 503, {'Retry-After': '60'}
+
+    def generate():
+        current = last_event_id
+        missed = live_events.events_after(current) if current is not None else None
+        if missed is None:
+            # 先取编号再取快照：期间产生的更新会在下面重复推送，客户端按主机覆盖即可
+            current = live_events.last_id
+            yield format_sse(current, 'snapshot', build_live_snapshot())
+        else:
+            for event in missed:
+                current = event[0]
+                yield format_sse(*event)
+        while True:
+            if not live_events.wait(current, SSE_HEARTBEAT):
+                yield ': ping\n\n'
+                continue
+            events = live_events.events_after(current)
+            if events is None:
+                # 客户端消费过慢，已超出保留范围，重新发送快照
+                current = live_events.last_id
+                yield format_sse(current, 'snapshot', build_live_snapshot())
+                continue
+            for event in events:
+                current = event[0]
+                yield format_sse(*event)
+
+    response = Response(stream_with_context(generate()), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'  # 关闭 Nginx 代理缓冲
+    response.call_on_close(live_events.disconnect)
+    return response
+
 @app.route('/api/add_host', methods=['POST'])
 def add_host():
     """添加主机接口"""
@@ -287,19 +3246,25 @@ def add_host():
         username = data.get('username')
         password = data.get('password')
         port = data.get('port', 22)
+        mode = data.get('mode', 'poll')
 
+        if mode == 'push':
+            return add_push_host(ip, username or 'agent')
+        if mode != 'poll':
+            return jsonify({'status': 'fail', 'message': 'mode 取值应为 poll/push'}), 400
         if not (ip and username and password):
             logger.warning("⚠️ 缺少必填参数")
             return jsonify({'status': 'fail', 'message': 'IP、用户名、密码不能为空'}), 400
 
-        # 验证SSH连接（确保能采集数据）
-        collector = MonitorCollector()
-        ssh = collector.connect_ssh(ip, username, password, port)
-        if not ssh:
-            return jsonify({'status': 'fail', 'message': 'SSH连接失败，请检查账号密码和端口'}), 400
-        ssh.close()
+        # 验证SSH连接（确保能采集数据；连接保留在会话池中供采集复用）
+        try:
+            ssh_pool.acquire(ip, username, password, port)
+        except Exception as e:
+            reason = MonitorCollector.classify_error(e)
+            return jsonify({'status': 'fail', 'message': 'SSH连接失败，请检查账号密码和端口', 'reason': reason}), 400
+        host_breaker.forget(ip)
 
-        with sqlite3.connect(DB_PATH) as conn:
+        with get_db_connection() as conn:
             cursor = conn.cursor()
             # 检查IP 是否已存在
             cursor.execute('SELECT ip FROM hosts WHERE ip = ?', (ip,))
@@ -312,21 +3277,61 @@ def add_host():
             ''', (ip, username, password, port))
             conn.commit()
 
+        snapshot_store.register(ip, username, int(port))
+        live_events.publish('update', build_live_update([ip]))
+        notify_channel.send('hosts', 'web')
         logger.info(f"✅ 主机 {ip} 添加成功")
         return jsonify({'status': 'success', 'message': '添加主机成功'}), 201
     except Exception as e:
         logger.error(f"❌ 添加主机失败：{str(e)}")
         return jsonify({'status': 'fail', 'message': str(e)}), 500
 
+def add_push_host(ip, username):
+    """添加推送主机：不建立SSH连接，生成上报令牌（只在此处返回一次，库中保存摘要）"""
+    if not ip:
+        return jsonify({'status': 'fail', 'message': 'IP不能为空'}), 400
+    token = IngestTokenStore.generate()
+    token_hash = IngestTokenStore.hash(token)
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('SELECT ip FROM hosts WHERE ip = ?', (ip,))
+        if cursor.fetchone():
+            return jsonify({'status': 'fail', 'message': '该主机已添加'}), 400
+        cursor.execute('''
+            INSERT INTO hosts (ip, username, password, port, mode, token_hash)
+            VALUES (?, ?, '', 0, 'push', ?)
+        ''', (ip, username, token_hash))
+        conn.commit()
+
+    ingest_tokens.add(token_hash, ip, username)
+    snapshot_store.register(ip, username, 0, 'push')
+    live_events.publish('update', build_live_update([ip]))
+    notify_channel.send('hosts', 'web')
+    logger.info(f"✅ 推送主机 {ip} 添加成功")
+    return jsonify({'status': 'success', 'message': '添加主机成功', 'mode': 'push', 'token': token}), 201
+
 @app.route('/api/delete_host/<ip>', methods=['DELETE'])
 def delete_host(ip):
     """删除主机接口"""
     try:
-        with sqlite3.connect(DB_PATH) as conn:
+        with get_db_connection() as conn:
             cursor = conn.cursor()
             cursor.execute('DELETE FROM hosts WHERE ip = ?', (ip,))
+            deleted = cursor.rowcount
+            cursor.execute('DELETE FROM host_latest WHERE ip = ?', (ip,))
+            cursor.execute('DELETE FROM host_leases WHERE ip = ?', (ip,))
+            cursor.execute('DELETE FROM ingest_queue WHERE ip = ?', (ip,))
             conn.commit()
-            if cursor.rowcount > 0:
+            if deleted > 0:
+                snapshot_store.remove(ip)
+                ssh_pool.close_host(ip)
+                MonitorCollector.forget(ip)
+                alert_engine.forget(ip)
+                host_status.forget(ip)
+                host_breaker.forget(ip)
+                ingest_tokens.remove(ip)
+                live_events.publish('remove', {'ips': [ip], 'overview': dashboard_view.current()['overview']})
+                notify_channel.send('hosts', 'web')
                 logger.info(f"✅ 主机 {ip} 删除成功")
                 return jsonify({'status': 'success', 'message': '删除主机成功'}), 200
             else:
@@ -335,10 +3340,548 @@ def delete_host(ip):
         logger.error(f"❌ 删除主机失败：{str(e)}")
         return jsonify({'status': 'fail', 'message': str(e)}), 500
 
+def collector_report():
+    """采集进程随心跳写入数据库的运行统计：指标原值 + 各组件统计"""
+    return {
+        'metrics': metrics.export(),
+        'components': collector_component_metrics(),
+        'writer': history_writer.stats(),
+        'ssh_pool': dict(ssh_pool.stats(), breaker=host_breaker.stats()),
+        'scheduler': collect_scheduler.stats(),
+    }
+
+def remote_collector_reports():
+    """存活的独立采集进程随心跳上报的统计：[(worker_id, 最近一轮采集结束时刻, 统计)]"""
+    with get_db_connection() as conn:
+        rows = conn.execute('''
+            SELECT worker_id, last_cycle_at, stats FROM collector_workers
+            WHERE heartbeat_at >= ? AND stats IS NOT NULL ORDER BY worker_id
+        ''', [time.time() - collector_membership.ttl()]).fetchall()
+    return [(row['worker_id'], row['last_cycle_at'], json.loads(row['stats'])) for row in rows]
+
+def collector_stats(key):
+    """采集相关接口的统计：本进程运行采集时返回 None（使用本进程的统计）；
+    否则按采集进程列出其心跳上报的统计（Web 进程本身不运行这些组件）"""
+    if collect_scheduler.started():
+        return None
+    return {'mode': 'remote', 'workers': [dict(report[key], worker_id=worker_id)
+                                          for worker_id, _, report in remote_collector_reports()]}
+
+@app.route('/api/ssh_pool', methods=['GET'])
+def get_ssh_pool_stats():
+    """SSH会话池统计（命中/未命中/握手次数等）及主机熔断统计"""
+    remote = collector_stats('ssh_pool')
+    if remote is not None:
+        return jsonify(remote), 200
+    return jsonify(dict(ssh_pool.stats(), breaker=host_breaker.stats())), 200
+
+@app.route('/api/db_writer', methods=['GET'])
+def get_db_writer_stats():
+    """历史写入队列统计（队列深度、批大小、提交耗时）及推送队列积压"""
+    with get_db_connection() as conn:
+        depth = IngestQueue.depth(conn)
+    remote = collector_stats('writer')
+    if remote is not None:
+        return jsonify(dict(remote, ingest_queue_depth=depth)), 200
+    return jsonify(dict(history_writer.stats(), ingest_queue_depth=depth)), 200
+
+@app.route('/api/scheduler', methods=['GET'])
+def get_scheduler_stats():
+    """采集调度统计（周期、超时跳过次数、调度延迟）"""
+    remote = collector_stats('scheduler')
+    if remote is not None:
+        return jsonify(remote), 200
+    return jsonify(collect_scheduler.stats()), 200
+
+@app.route('/api/collectors', methods=['GET'])
+def get_collectors():
+    """采集分片状态：存活的采集进程及各自持有的主机数"""
+    try:
+        now = time.time()
+        with get_db_connection() as conn:
+            rows = conn.execute('''
+                SELECT w.worker_id, w.hostname, w.pid, w.started_at, w.heartbeat_at, w.last_cycle_at,
+                       (SELECT COUNT(*) FROM host_leases l WHERE l.worker_id = w.worker_id) AS hosts
+                FROM collector_workers w ORDER BY w.worker_id
+            ''').fetchall()
+        ttl = collector_membership.ttl()
+        return jsonify({
+            'mode': COLLECTOR_MODE,
+            'local': collector_membership.stats(),
+            'workers': [{
+                'worker_id': row['worker_id'],
+                'hostname': row['hostname'],
+                'pid': row['pid'],
+                'uptime': round(now - row['started_at'], 1),
+                'heartbeat_age': round(now - row['heartbeat_at'], 1),
+                'last_cycle_age': None if row['last_cycle_at'] is None else round(now - row['last_cycle_at'], 1),
+                'alive': now - row['heartbeat_at'] <= ttl,
+                'hosts': row['hosts'],
+            } for row in rows],
+        }), 200
+    except Exception as e:
+        logger.error(f"❌ 查询采集分片状态失败：{str(e)}")
+        return jsonify({'error': '查询采集分片状态失败', 'detail': str(e)}), 500
+
+@app.route('/api/retention', methods=['GET'])
+def get_retention_stats():
+    """过期数据清理任务统计"""
+    return jsonify(retention_worker.stats()), 200
+
+# ===================== 运行指标与健康检查 =====================
+PROCESS_STARTED = time.monotonic()
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def record_request_metrics(response):
+    started = g.get('request_started')
+    if started is not None:
+        # 按路由模板而非实际路径打标签（/api/delete_host/<ip>），避免标签基数随主机数增长
+        endpoint = request.url_rule.rule if request.url_rule else 'unmatched'
+        metrics.observe('monitor_http_request_seconds', time.perf_counter() - started,
+                        endpoint=endpoint, method=request.method)
+        metrics.inc('monitor_http_requests_total', endpoint=endpoint, method=request.method,
+                    code=response.status_code)
+    return response
+
+def collector_component_metrics():
+    """采集侧组件（写队列、会话池、熔断、调度器）的现有统计"""
+    writer = history_writer.stats()
+    pool = ssh_pool.stats()
+    breaker = host_breaker.stats()
+    scheduler = collect_scheduler.stats()
+    return [
+        ('monitor_db_queue_depth', 'gauge', 'History rows queued but not committed', writer['queue_depth'], {}),
+        ('monitor_db_rows_dropped_total', 'counter', 'History rows dropped (queue full)', writer['rows_dropped'], {}),
+        ('monitor_ssh_pool_active_sessions', 'gauge', 'Open pooled SSH sessions', pool['active_sessions'], {}),
+        ('monitor_ssh_pool_hits_total', 'counter', 'SSH pool reuses', pool['hits'], {}),
+        ('monitor_ssh_pool_handshakes_total', 'counter', 'SSH handshakes', pool['handshakes'], {}),
+        ('monitor_ssh_pool_failures_total', 'counter', 'SSH connect failures', pool['failures'], {}),
+        ('monitor_breaker_open_hosts', 'gauge', 'Hosts with an open circuit breaker', breaker['open'], {}),
+        ('monitor_breaker_skips_total', 'counter', 'Collections skipped by an open breaker', breaker['skips'], {}),
+        ('monitor_breaker_probes_total', 'counter', 'TCP probes sent to hosts with an open breaker',
+         breaker['probes'], {}),
+        ('monitor_scheduler_overruns_total', 'counter', 'Ticks skipped because a cycle was still running',
+         scheduler['overruns'], {}),
+        ('monitor_scheduler_tick_lag_seconds', 'gauge', 'Lateness of the last scheduler tick',
+         scheduler['last_lag_ms'] / 1000, {}),
+    ]
+
+def since_last_cycle_metric(since, labels):
+    return ('monitor_collector_seconds_since_last_cycle', 'gauge', 'Seconds since the last completed collection cycle',
+            -1 if since is None else since, labels)
+
+def component_metrics():
+    """快照、最近采样缓冲、SSE 的统计，以及采集侧组件的统计，导出时读取
+
+    本进程运行采集时导出本进程的采集组件；否则（Web 进程）导出各采集进程随心跳上报的值，附加 worker 标签。
+    """
+    recent = recent_buffers.stats()
+    sse = live_events.stats()
+    result = [
+        ('monitor_hosts', 'gauge', 'Hosts in the in-memory snapshot', len(snapshot_store.get_all(get_stale_after())), {}),
+        ('monitor_recent_buffer_bytes', 'gauge', 'Memory reserved by per-host recent sample rings', recent['bytes'], {}),
+        ('monitor_sse_clients', 'gauge', 'Open SSE connections', sse['clients'], {}),
+        ('monitor_sse_rejected_total', 'counter', 'SSE connections rejected at the per-process cap', sse['rejected'], {}),
+    ]
+    if collect_scheduler.started():
+        return result + collector_component_metrics() + [
+            since_last_cycle_metric(collect_scheduler.seconds_since_last_cycle(), {})]
+    now = time.time()
+    for worker_id, last_cycle_at, report in remote_collector_reports():
+        result += [(name, kind, help_text, value, dict(labels, worker=worker_id))
+                   for name, kind, help_text, value, labels in report.get('components', [])]
+        result.append(since_last_cycle_metric(None if last_cycle_at is None else max(now - last_cycle_at, 0.0),
+                                              {'worker': worker_id}))
+    return result
+
+metrics.register_collector(component_metrics)
+
+@app.route('/api/metrics', methods=['GET'])
+def get_metrics():
+    """运行指标：默认 Prometheus 文本格式；format=json 返回计数器和直方图分位数摘要
+
+    采集在独立进程中运行时，合并各采集进程随心跳上报的计数器和直方图（附加 worker 标签）。
+    """
+    remote = [] if collect_scheduler.started() else \
+        [({'worker': worker_id}, report.get('metrics', {})) for worker_id, _, report in remote_collector_reports()]
+    if request.args.get('format') == 'json':
+        return jsonify(metrics.snapshot(remote)), 200
+    return Response(metrics.render(remote), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+@app.route('/api/health', methods=['GET'])
+def get_health():
+    """健康检查：超过 3 个周期没有完成采集即视为采集滞后，返回 503
+
+    本进程运行采集时只读内存状态；Web 进程（采集在独立进程中）读取存活采集进程心跳中最近一轮采集的结束时刻和写队列深度。
+    """
+    interval = get_refresh_interval()
+    stale_after = get_stale_after()
+    since = collect_scheduler.seconds_since_last_cycle()
+    uptime = time.monotonic() - PROCESS_STARTED
+    queue_depth = history_writer.stats()['queue_depth']
+    running = collect_scheduler.stats()['running']
+    if not collect_scheduler.started():
+        try:
+            now = time.time()
+            with get_db_connection() as conn:
+                last = conn.execute('SELECT MAX(last_cycle_at) FROM collector_workers WHERE heartbeat_at >= ?',
+                                    [now - collector_membership.ttl()]).fetchone()[0]
+            since = None if last is None else max(now - last, 0.0)
+            # 写队列深度、是否正在采集取各采集进程心跳上报的值
+            reports = [report for _, _, report in remote_collector_reports()]
+            queue_depth = sum(report['writer']['queue_depth'] for report in reports)
+            running = any(report['scheduler']['running'] for report in reports)
+        except Exception as e:
+            logger.error(f"❌ 读取采集进程心跳失败：{str(e)}")
+    if since is None:
+        # 启动后尚未完成第一轮采集
+        healthy = uptime <= stale_after
+        lag = max(uptime - interval, 0.0)
+    else:
+        healthy = since <= stale_after
+        lag = max(since - interval, 0.0)
+    body = {
+        'status': 'ok' if healthy else 'lagging',
+        'uptime_seconds': round(uptime, 1),
+        'collector': {
+            'interval': interval,
+            'seconds_since_last_cycle': None if since is None else round(since, 3),
+            'lag_seconds': round(lag, 3),
+            'running': running,
+        },
+        'db_queue_depth': queue_depth,
+    }
+    return jsonify(body), 200 if healthy else 503
+
+# ===================== 推送采集（主机/中继主动上报） =====================
+# 二进制格式：魔数 + 若干帧；每帧为 令牌长度(u8) + 令牌 + 采样数(u16) + 采样记录
+# 采样记录 12 字节小端：ts(u32) cpu/mem/disk(u16，百分比 × 100) load1(u16，× 100)，0xFFFF 表示空
+INGEST_BINARY_MAGIC = b'MSB1'
+INGEST_BINARY_TYPE = 'application/x-monitor-samples'
+INGEST_RECORD_DTYPE = np.dtype([('ts', '<u4'), ('cpu', '<u2'), ('mem', '<u2'), ('disk', '<u2'), ('load1', '<u2')])
+INGEST_NULL = 0xFFFF
+
+metrics.describe('monitor_ingest_samples_total', 'counter', 'Pushed samples by result')
+
+class IngestError(ValueError):
+    """请求体格式错误或过大（整批拒绝），status 为返回的 HTTP 状态码"""
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+def parse_ingest_ndjson(body, header_token):
+    """NDJSON：每行一个采样 {ip, token, ts, cpu, mem, disk, load1, status}
+
+    token 缺省时使用 Authorization 头中的令牌，ip 缺省时取令牌对应的主机。
+    返回 (采样列表, 错误列表)，采样为 (令牌, ip, ts, cpu, mem, disk, load1, status)。
+    """
+    samples, errors = [], []
+    for lineno, line in enumerate(body.splitlines(), 1):
+        if not line.strip():
+            continue
+        try:
+            item = json.loads(line)
+            samples.append((item.get('token') or header_token, item.get('ip'), item.get('ts'), item.get('cpu'),
+                            item.get('mem'), item.get('disk'), item.get('load1'), item.get('status')))
+        except (ValueError, AttributeError):
+            errors.append(f'第 {lineno} 行不是合法的 JSON 对象')
+    return samples, errors
+
+def parse_ingest_binary(body):
+    """二进制格式：逐帧读取令牌，采样记录用 np.frombuffer 整块解码"""
+    if not body.startswith(INGEST_BINARY_MAGIC):
+        raise IngestError('二进制数据缺少魔数 MSB1')
+    samples = []
+    offset = len(INGEST_BINARY_MAGIC)
+    while offset < len(body):
+        token_len = body[offset]
+        token = body[offset + 1:offset + 1 + token_len].decode('ascii', 'replace')
+        offset += 1 + token_len
+        if offset + 2 > len(body):
+            raise IngestError('帧头不完整')
+        count = int.from_bytes(body[offset:offset + 2], 'little')
+        offset += 2
+        size = count * INGEST_RECORD_DTYPE.itemsize
+        if offset + size > len(body):
+            raise IngestError('采样记录长度不足')
+        records = np.frombuffer(body, INGEST_RECORD_DTYPE, count, offset)
+        offset += size
+        columns = {}
+        for name in ('cpu', 'mem', 'disk', 'load1'):
+            values = records[name]
+            columns[name] = np.where(values == INGEST_NULL, np.nan, values / 100.0).tolist()
+        for ts, cpu, mem, disk, load1 in zip(records['ts'].tolist(), columns['cpu'], columns['mem'],
+                                             columns['disk'], columns['load1']):
+            samples.append((token, None, ts, None if cpu != cpu else cpu, None if mem != mem else mem,
+                            None if disk != disk else disk, None if load1 != load1 else load1, None))
+    return samples, []
+
+def read_ingest_body():
+    """读取请求体（支持 Content-Encoding: gzip），超过 INGEST_MAX_BYTES 抛出 IngestError"""
+    if request.content_length and request.content_length > INGEST_MAX_BYTES:
+        raise IngestError(f'请求体超过 {INGEST_MAX_BYTES} 字节', 413)
+    body = request.get_data(cache=False)
+    if request.headers.get('Content-Encoding', '').lower() == 'gzip':
+        decompressor = zlib.decompressobj(wbits=47)
+        try:
+            body = decompressor.decompress(body, INGEST_MAX_BYTES + 1)
+        except zlib.error:
+            raise IngestError('gzip 数据无效')
+    if len(body) > INGEST_MAX_BYTES:
+        raise IngestError(f'请求体超过 {INGEST_MAX_BYTES} 字节', 413)
+    return body
+
+@app.route('/api/ingest', methods=['POST'])
+def ingest_samples():
+    """推送采集：主机或中继批量上报采样，写入推送队列后由负责该主机的采集进程进入与轮询相同的写入和告警链路
+
+    Content-Type 为 application/x-monitor-samples 时按二进制格式解析，否则按 NDJSON。
+    每个采样须携带所属主机的令牌（NDJSON 可统一放在 Authorization: Bearer 头中）；
+    令牌无效、主机不匹配、时间超出范围或指标越界的采样逐条拒绝，其余照常入库。
+    """
+    try:
+        try:
+            body = read_ingest_body()
+            if request.mimetype == INGEST_BINARY_TYPE:
+                samples, errors = parse_ingest_binary(body)
+            else:
+                auth = request.headers.get('Authorization', '')
+                header_token = auth[7:].strip() if auth.lower().startswith('bearer ') else None
+                samples, errors = parse_ingest_ndjson(body.decode('utf-8', 'replace'), header_token)
+        except IngestError as e:
+            return jsonify({'error': '上报数据格式错误', 'detail': str(e)}), e.status
+
+        parse_errors = len(errors)
+        now = time.time()
+        rows = []
+        accepted = []         # (ts, ip, cpu, mem, disk, load1)：全部写入最近采样缓冲
+        latest = {}           # ip -> 本批最新的一条采样（发布到快照）
+        auth_failures = 0
+        hosts_by_token = {}   # 同一令牌在批内只校验一次
+        for token, ip, ts, cpu, mem, disk, load1, status in samples:
+            if token not in hosts_by_token:
+                hosts_by_token[token] = ingest_tokens.lookup(token)
+            host = hosts_by_token[token]
+            if host is None or (ip is not None and ip != host[0]):
+                auth_failures += 1
+                continue
+            try:
+                ts = int(now if ts is None else ts)
+                cpu, mem, disk = [None if v is None else round(float(v), 1) for v in (cpu, mem, disk)]
+                load1 = None if load1 is None else float(load1)
+            except (TypeError, ValueError):
+                errors.append(f'{host[0]}：指标或时间不是数值')
+                continue
+            if not now - INGEST_MAX_AGE <= ts <= now + INGEST_MAX_SKEW:
+                errors.append(f'{host[0]}：采样时间 {ts} 超出可接受范围')
+                continue
+            if any(v is not None and not 0 <= v <= 100 for v in (cpu, mem, disk)):
+                errors.append(f'{host[0]}：指标应在 0~100 之间')
+                continue
+            if status not in ('online', 'offline', 'timeout'):
+                status = 'online' if cpu is not None else 'offline'
+            if status != 'online':
+                cpu = mem = disk = None
+            rows.append((host[0], ts, host[1], cpu, mem, disk, status))
+            accepted.append((ts, host[0], cpu, mem, disk, load1))
+            if host[0] not in latest or ts >= latest[host[0]][0]:
+                latest[host[0]] = (ts, cpu, mem, disk, status, load1)
+
+        if auth_failures:
+            errors.append(f'{auth_failures} 条采样的令牌无效或与主机不匹配')
+        if auth_failures and not rows:
+            metrics.inc('monitor_ingest_samples_total', auth_failures, result='unauthorized')
+            return jsonify({'error': '令牌无效', 'accepted': 0, 'rejected': auth_failures}), 401
+
+        if not ingest_queue.submit(rows):
+            metrics.inc('monitor_ingest_samples_total', len(rows), result='throttled')
+            return jsonify({'error': '写入队列已满，请稍后重试'}), 503, {'Retry-After': str(max(get_refresh_interval(), 1))}
+
+        # 较早的采样按时间顺序只进最近采样缓冲，每台主机最新的一条发布到快照
+        accepted.sort(key=lambda sample: sample[0])
+        for ts, ip, cpu, mem, disk, load1 in accepted:
+            if ts < latest[ip][0]:
+                snapshot_store.record(ip, ts, cpu, mem, disk, load1)
+        changed_ips = [ip for ip, (ts, cpu, mem, disk, status, load1) in latest.items()
+                       if snapshot_store.publish(ip, cpu, mem, disk, status, load1, ts)]
+        if changed_ips:
+            live_events.publish('update', build_live_update(changed_ips))
+
+        rejected = len(samples) - len(rows) + parse_errors
+        metrics.inc('monitor_ingest_samples_total', len(rows), result='accepted')
+        if rejected:
+            metrics.inc('monitor_ingest_samples_total', rejected, result='rejected')
+        if LOG_SAMPLES:
+            logger.info(f"📥 收到推送采样 {len(rows)} 条（{len(latest)} 台主机），拒绝 {rejected} 条")
+        return jsonify({'accepted': len(rows), 'rejected': rejected, 'errors': errors[:20]}), 200
+    except Exception as e:
+        logger.error(f"❌ /api/ingest 报错：{str(e)}")
+        return jsonify({'error': '处理上报数据失败', 'detail': str(e)}), 500
+
+
+# ===================== 新增：最近采样接口（内存环形缓冲） =====================
+@app.route('/api/recent', methods=['GET'])
+def get_recent():
+    """最近 seconds 秒的采样（图表 / 迷你折线图用），只读内存缓冲，不访问数据库
+
+    参数：seconds（默认 300）、host_ip（可选，逗号分隔多台）、metrics（可选，默认 cpu,mem,disk,load1）
+    返回按主机分组的并行数组：{ip: {record_time: [...], cpu: [...], ...}}，按时间升序，缺失值为 null
+    """
+    try:
+        try:
+            seconds = int(request.args.get('seconds', 300))
+        except ValueError:
+            return jsonify({'error': 'seconds 必须为整数'}), 400
+        if not 1 <= seconds <= RECENT_MAX_SECONDS:
+            return jsonify({'error': f'seconds 取值范围为 1~{RECENT_MAX_SECONDS}'}), 400
+        names = [m.strip() for m in request.args.get('metrics', ','.join(RecentRing.METRICS)).split(',') if m.strip()]
+        unknown = [m for m in names if m not in RecentRing.METRICS]
+        if unknown:
+            return jsonify({'error': f'不支持的指标：{",".join(unknown)}'}), 400
+        host_ip = request.args.get('host_ip', '').strip()
+        ips = [ip.strip() for ip in host_ip.split(',') if ip.strip()] if host_ip else None
+
+        since = time.time() - seconds
+        columns = [RecentRing.METRICS.index(m) for m in names]
+        hosts = {}
+        for ip, (ts, values) in recent_buffers.window(since, ips).items():
+            series = {'record_time': np.round(ts, 3).tolist()}
+            for name, col in zip(names, columns):
+                series[name] = nan_to_none(values[:, col])
+            hosts[ip] = series
+        response = jsonify({'seconds': seconds, 'interval': get_refresh_interval(), 'hosts': hosts})
+        response.headers['Cache-Control'] = 'no-cache'
+        return response, 200
+    except Exception as e:
+        logger.error(f"❌ 查询最近采样失败：{str(e)}")
+        return jsonify({'error': '查询最近采样失败', 'detail': str(e)}), 500
+
 # ===================== 新增：历史记录接口 =====================
+# 状态码对应的中文标签（CSV 导出用）
+STATUS_LABELS = {'online': '在线', 'offline': '离线', 'timeout': '超时'}
+
+# 预聚合粒度下额外返回的列
+ROLLUP_EXTRA_KEYS = [f'{metric}_{stat}' for metric in ROLLUP_METRICS for stat in ('min', 'max', 'p95')] + \
+                    ['online_count', 'offline_count']
+ROLLUP_EXTRA_COLUMNS = ', '.join(f'h.{key}' for key in ROLLUP_EXTRA_KEYS)
+ROLLUP_EXTRA_HEADERS = ['CPU最小值', 'CPU最大值', 'CPU P95', '内存最小值', '内存最大值', '内存 P95',
+                        '磁盘最小值', '磁盘最大值', '磁盘 P95', '在线采样数', '离线采样数']
+
+def pick_history_resolution(start_ts, end_ts):
+    """选择能让单台主机点数不超过 HISTORY_MAX_POINTS 的最细粒度（只在热数据窗口保留的粒度不用于更早的范围）"""
+    span = max(end_ts - start_ts, 0)
+    if span / max(get_refresh_interval(), 1) <= HISTORY_MAX_POINTS:
+        return 'raw'
+    cutoff = hot_cutoff()
+    for level, (_, seconds) in ROLLUP_LEVELS.items():
+        if level in ROLLUP_HOT_LEVELS and cutoff is not None and start_ts < cutoff:
+            continue
+        if span / seconds <= HISTORY_MAX_POINTS:
+            return level
+    return '1h'
+
+# 分页查询单页最大行数
+HISTORY_PAGE_MAX = int(os.environ.get('HISTORY_PAGE_MAX', 50000))
+
+def encode_history_cursor(ts, ip):
+    """分页游标：上一页最后一行的 (record_time, ip)，base64url 编码"""
+    return base64.urlsafe_b64encode(f'{ts}|{ip}'.encode()).decode().rstrip('=')
+
+def decode_history_cursor(token):
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)).decode()
+        ts, ip = raw.split('|', 1)
+        return int(ts), ip
+    except Exception:
+        raise ValueError(f'invalid cursor: {token}')
+
+# CSV 流式导出：每次从游标读取的行数
+HISTORY_EXPORT_CHUNK = int(os.environ.get('HISTORY_EXPORT_CHUNK', 5000))
+
+def stream_history_csv(conn, sql, params, resolution, compress=False, archived=None):
+    """按块读取游标并逐块产出CSV（可选 gzip），archived 为冷数据层的行块（接在库中数据之后），
+    结束或客户端断开时关闭连接"""
+    output = StringIO()
+    writer = csv.writer(output)
+    # wbits=31 输出带 gzip 头的压缩流
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31) if compress else None
+
+    def take():
+        data = output.getvalue().encode('utf-8')
+        output.seek(0)
+        output.truncate()
+        return compressor.compress(data) if compressor else data
+
+    total = 0
+    try:
+        header = ['记录时间', '主机IP', '用户名', 'CPU使用率', '内存使用率', '磁盘使用率', '状态']
+        if resolution != 'raw':
+            header += ROLLUP_EXTRA_HEADERS
+        writer.writerow(header)
+        cursor = conn.execute(sql, params)
+        chunks = iter(lambda: cursor.fetchmany(HISTORY_EXPORT_CHUNK), [])
+        if archived is not None:
+            chunks = itertools.chain(chunks, archived)
+        for rows in chunks:
+            for row in rows:
+                line = [
+                    row['record_time'], row['ip'], row['username'],
+                    format_percent(row['cpu']), format_percent(row['mem']), format_percent(row['disk']),
+                    STATUS_LABELS.get(row['status'], row['status'])
+                ]
+                if resolution != 'raw':
+                    line += [row[key] for key in ROLLUP_EXTRA_KEYS]
+                writer.writerow(line)
+            total += len(rows)
+            chunk = take()
+            if chunk:
+                yield chunk
+        chunk = take()
+        if compressor:
+            chunk += compressor.flush()
+        if chunk:
+            yield chunk
+        logger.info(f"📤 导出历史数据CSV完成：{total} 条记录")
+    finally:
+        conn.close()
+
+def format_percent(value):
+    """数值百分比格式化为 "37.5%"，空值返回空字符串"""
+    return f"{value:.1f}%" if value is not None else ''
+
+# 离线 / 超时采样不写 history：原始粒度查询把 host_status 中每段离线的起点作为一行指标为空的记录并入结果
+HISTORY_OFFLINE_SQL = '''
+    SELECT h.record_time AS ts, datetime(h.record_time, 'unixepoch', 'localtime') AS record_time,
+           h.ip, IFNULL(o.username, '') AS username, NULL AS cpu, NULL AS mem, NULL AS disk,
+           CASE WHEN h.reason = 'timeout' THEN 'timeout' ELSE 'offline' END AS status
+    FROM host_status h LEFT JOIN hosts o ON o.ip = h.ip
+    WHERE h.state = 'offline' AND h.record_time BETWEEN ? AND ?
+'''
+
+def merge_offline_rows(chunks, markers):
+    """把离线起点行（已按 (时间, ip) 降序）并入同样降序的归档行块"""
+    pending = deque(dict(row) for row in markers)
+    for rows in chunks:
+        merged = []
+        for row in rows:
+            while pending and (pending[0]['ts'], pending[0]['ip']) > (row['ts'], row['ip']):
+                merged.append(pending.popleft())
+            merged.append(row)
+        yield merged
+    if pending:
+        yield list(pending)
+
 @app.route('/api/history', methods=['GET'])
 def get_history():
-    """历史记录查询 + CSV导出"""
+    """历史记录查询 + CSV导出
+
+    可选参数：resolution（raw/1m/15m/1h/auto）、limit + cursor（键集分页）、
+    format=columnar（按列返回）、export=csv（流式导出，compress=gzip 压缩）。
+    """
     try:
         logger.info("📥 收到 /api/history 查询请求")
         # 获取前端查询参数
@@ -352,131 +3895,692 @@ def get_history():
             logger.warning("⚠️ 缺少时间范围参数")
             return jsonify({'error': '请选择查询时间范围'}), 400
 
+        # 前端传入本地时间文本，换算为 epoch 秒以命中 record_time 索引
+        try:
+            start_ts = int(datetime.strptime(start_time, '%Y-%m-%d %H:%M:%S').timestamp())
+            end_ts = int(datetime.strptime(end_time, '%Y-%m-%d %H:%M:%S').timestamp())
+        except ValueError:
+            return jsonify({'error': '时间格式应为 YYYY-MM-DD HH:MM:SS'}), 400
+
+        # 数据粒度：raw（原始采样）/ 1m / 15m / 1h / auto（按时间跨度自动选择）
+        resolution = request.args.get('resolution', 'raw')
+        if resolution == 'auto':
+            resolution = pick_history_resolution(start_ts, end_ts)
+        if resolution != 'raw' and resolution not in ROLLUP_LEVELS:
+            return jsonify({'error': 'resolution 取值应为 raw/1m/15m/1h/auto'}), 400
+
+        # 分页与返回格式：limit + cursor 为键集分页（按 (record_time, ip) 降序），format=columnar 返回按列数组
+        response_format = request.args.get('format', 'rows')
+        if response_format not in ('rows', 'columnar'):
+            return jsonify({'error': 'format 取值应为 rows/columnar'}), 400
+        limit = request.args.get('limit', type=int)
+        if limit is not None and not 1 <= limit <= HISTORY_PAGE_MAX:
+            return jsonify({'error': f'limit 取值范围为 1~{HISTORY_PAGE_MAX}'}), 400
+        page_cursor = request.args.get('cursor')
+        if page_cursor:
+            try:
+                page_cursor = decode_history_cursor(page_cursor)
+            except ValueError:
+                return jsonify({'error': 'cursor 无效'}), 400
+
         # 连接数据库查询
         conn = get_db_connection()
         cursor = conn.cursor()
 
-        # 构造查询SQL
-        sql = '''
-        SELECT h.record_time, h.ip, h.username, h.cpu, h.mem, h.disk,
-               CASE WHEN CAST(REPLACE(h.cpu, '%', '') AS FLOAT) > 0 THEN '在线' ELSE '离线' END AS status
-        FROM history h
-        WHERE h.record_time BETWEEN ? AND ?
-        '''
-        params = [start_time, end_time]
+        # 构造查询SQL（单主机走 (ip, record_time) 主键，全部主机走 record_time 索引）
+        if resolution == 'raw':
+            sql = '''
+            SELECT h.record_time AS ts, datetime(h.record_time, 'unixepoch', 'localtime') AS record_time,
+                   h.ip, h.username, h.cpu, h.mem, h.disk, h.status
+            FROM history h
+            WHERE h.record_time BETWEEN ? AND ?
+            '''
+        else:
+            # 预聚合表：cpu/mem/disk 为桶内平均值，另附 min/max/p95 与在线/离线采样数
+            sql = f'''
+            SELECT h.record_time AS ts, datetime(h.record_time, 'unixepoch', 'localtime') AS record_time,
+                   h.ip, h.username, h.cpu, h.mem, h.disk,
+                   CASE WHEN h.online_count > 0 THEN 'online' ELSE 'offline' END AS status,
+                   {ROLLUP_EXTRA_COLUMNS}
+            FROM {ROLLUP_LEVELS[resolution][0]} h
+            WHERE h.record_time BETWEEN ? AND ?
+            '''
+        params = [start_ts, end_ts]
+
+        # 原始粒度：早于归档边界的部分从冷数据层读取，排在库中数据之后（同样按 (record_time, ip) 降序）
+        archived = None
+        boundary = history_archive.boundary() if resolution == 'raw' else None
+        if boundary is not None and start_ts < boundary:
+            archive_end = min(end_ts, boundary - 1)
+            archived = history_archive.iter_rows(start_ts, archive_end,
+                                                 None if host_ip == 'all' else host_ip, page_cursor or None)
+            marker_sql = HISTORY_OFFLINE_SQL
+            marker_params = [start_ts, archive_end]
+            if host_ip != 'all':
+                marker_sql += ' AND h.ip = ?'
+                marker_params.append(host_ip)
+            if page_cursor:
+                marker_sql += ' AND (h.record_time, h.ip) < (?, ?)'
+                marker_params += list(page_cursor)
+            markers = cursor.execute(marker_sql + ' ORDER BY h.record_time DESC, h.ip DESC', marker_params).fetchall()
+            if markers:
+                archived = merge_offline_rows(archived, markers)
+            params[0] = boundary
 
+        # 筛选条件（原始粒度时 history 与离线起点两部分共用，两者别名都为 h）
+        filters = ''
         # 按IP筛选
         if host_ip != 'all':
-            sql += ' AND h.ip = ?'
+            filters += ' AND h.ip = ?'
             params.append(host_ip)
 
-        # 按时间降序排序
-        sql += ' ORDER BY h.record_time DESC'
+        # 键集分页：从上一页最后一行之后继续。时间上界收紧到游标时刻，
+        # 索引直接从该位置开始扫描，深页与首页代价相同
+        if page_cursor:
+            params[1] = min(end_ts, page_cursor[0])
+            filters += ' AND (h.record_time, h.ip) < (?, ?)'
+            params += list(page_cursor)
 
-        cursor.execute(sql, params)
-        history_data = cursor.fetchall()
-        conn.close()
+        # 按时间降序排序（同一时刻按IP排序，保证分页顺序稳定）
+        if resolution == 'raw':
+            # UNION ALL 按排序合并两部分，history 部分仍沿索引顺序扫描
+            sql = f'{sql}{filters} UNION ALL {HISTORY_OFFLINE_SQL}{filters} ORDER BY ts DESC, ip DESC'
+            params += params
+        else:
+            sql += filters + ' ORDER BY h.record_time DESC, h.ip DESC'
 
-        # 导出CSV
+        # 导出CSV（流式输出，边查边写，内存占用与导出规模无关）
         if export == 'csv':
-            output = StringIO()
-            writer = csv.writer(output)
-            # 写入表头
-            writer.writerow(['记录时间', '主机IP', '用户名', 'CPU使用率', '内存使用率', '磁盘使用率', '状态'])
-            # 写入数据
-            for row in history_data:
-                writer.writerow([
-                    row['record_time'], row['ip'], row['username'],
-                    row['cpu'], row['mem'], row['disk'], row['status']
-                ])
-            # 构建下载响应
-            response = make_response(output.getvalue())
-            filename = f'history_{datetime.now().strftime("%Y%m%d%H%M%S")}.csv'
+            compress = request.args.get('compress') == 'gzip'
+            # 未要求下载 .gz 文件时，客户端支持 gzip 则以传输编码压缩（浏览器自动解压，保存的仍是 .csv）
+            transfer_gzip = not compress and request.accept_encodings['gzip'] > 0
+            filename = f'history_{datetime.now().strftime("%Y%m%d%H%M%S")}.csv' + ('.gz' if compress else '')
+            response = Response(stream_with_context(stream_history_csv(conn, sql, params, resolution,
+                                                                       compress or transfer_gzip, archived)),
+                                mimetype='application/gzip' if compress else 'text/csv')
             response.headers['Content-Disposition'] = f'attachment; filename={filename}'
-            response.headers['Content-Type'] = 'text/csv'
-            logger.info(f"📤 导出历史数据CSV：{len(history_data)} 条记录")
+            response.vary.add('Accept-Encoding')
+            if transfer_gzip:
+                response.headers['Content-Encoding'] = 'gzip'
+            response.headers['X-History-Resolution'] = resolution
+            logger.info(f"📤 开始流式导出历史数据CSV（粒度：{resolution}，压缩：{compress}）")
             return response
 
-        # 返回JSON数据
-        result = []
-        for row in history_data:
-            result.append({
-                'record_time': row['record_time'],
-                'ip': row['ip'],
-                'username': row['username'],
-                'cpu': row['cpu'],
-                'mem': row['mem'],
-                'disk': row['disk'],
-                'status': row['status']
-            })
-        logger.info(f"📤 返回历史数据：{len(result)} 条记录")
-        return jsonify(result), 200
+        if limit is not None:
+            # 多取一行判断是否还有下一页
+            sql += ' LIMIT ?'
+            params.append(limit + 1)
+        cursor.execute(sql, params)
+        history_data = cursor.fetchall()
+        conn.close()
+        if archived is not None:
+            # 库中数据不足一页（或不分页）时继续从归档取，多取的部分在下面按 limit 截断
+            for rows in archived:
+                if limit is not None and len(history_data) > limit:
+                    break
+                history_data += rows
+
+        next_cursor = None
+        if limit is not None and len(history_data) > limit:
+            history_data = history_data[:limit]
+            next_cursor = encode_history_cursor(history_data[-1]['ts'], history_data[-1]['ip'])
+
+        # 兼容旧调用：不分页的行格式仍直接返回数组
+        # （cpu/mem/disk 为数值，离线/超时为 null；status 为 online/offline/timeout）
+        if response_format == 'rows' and limit is None and not page_cursor:
+            result = [dict(row) for row in history_data]
+            for item in result:
+                del item['ts']
+            logger.info(f"📤 返回历史数据：{len(result)} 条记录（粒度：{resolution}）")
+            response = jsonify(result)
+            response.headers['X-History-Resolution'] = resolution
+            return compress_response(response), 200
+
+        if response_format == 'columnar':
+            # 按列返回并行数组，record_time 为 epoch 秒（图表可直接使用）
+            keys = [key for key in history_data[0].keys() if key != 'record_time'] if history_data else []
+            data = {('record_time' if key == 'ts' else key): [row[key] for row in history_data] for key in keys}
+        else:
+            data = [dict(row) for row in history_data]
+            for item in data:
+                del item['ts']
+        logger.info(f"📤 返回历史数据：{len(history_data)} 条记录（粒度：{resolution}，格式：{response_format}）")
+        response = jsonify({
+            'resolution': resolution,
+            'format': response_format,
+            'count': len(history_data),
+            'next_cursor': next_cursor,
+            'data': data
+        })
+        response.headers['X-History-Resolution'] = resolution
+        return compress_response(response), 200
     except Exception as e:
         logger.error(f"❌ /api/history 报错：{str(e)}")
         return jsonify({'error': '查询历史数据失败', 'detail': str(e)}), 500
 
+# ===================== 新增：告警记录接口 =====================
+@app.route('/api/alerts', methods=['GET'])
+def get_alerts():
+    """告警记录：当前进行中的告警（内存状态）+ 时间范围内的状态变化（alerts 表，按时间索引读取）
+
+    可选参数：start_time/end_time（默认最近 24 小时）、host_ip、metric、state（firing/resolved）、limit。
+    """
+    try:
+        host_ip = request.args.get('host_ip', 'all')
+        start_time = request.args.get('start_time')
+        end_time = request.args.get('end_time')
+        try:
+            if start_time and end_time:
+                start_ts = int(datetime.strptime(start_time, '%Y-%m-%d %H:%M:%S').timestamp())
+                end_ts = int(datetime.strptime(end_time, '%Y-%m-%d %H:%M:%S').timestamp())
+            else:
+                end_ts = int(time.time())
+                start_ts = end_ts - 86400
+        except ValueError:
+            return jsonify({'error': '时间格式应为 YYYY-MM-DD HH:MM:SS'}), 400
+        limit = request.args.get('limit', 500, type=int)
+        if not 1 <= limit <= HISTORY_PAGE_MAX:
+            return jsonify({'error': f'limit 取值范围为 1~{HISTORY_PAGE_MAX}'}), 400
+
+        sql = '''
+            SELECT id, ip, metric, state, value, threshold, started_at, record_time AS ts,
+                   datetime(record_time, 'unixepoch', 'localtime') AS record_time
+            FROM alerts WHERE record_time BETWEEN ? AND ?
+        '''
+        params = [start_ts, end_ts]
+        for column in ('metric', 'state'):
+            if request.args.get(column):
+                sql += f' AND {column} = ?'
+                params.append(request.args[column])
+        if host_ip != 'all':
+            sql += ' AND ip = ?'
+            params.append(host_ip)
+        sql += ' ORDER BY record_time DESC, id DESC LIMIT ?'
+        params.append(limit)
+        with get_db_connection() as conn:
+            events = [dict(row) for row in conn.execute(sql, params)]
+
+        active = alert_engine.active()
+        if host_ip != 'all':
+            active = [item for item in active if item['ip'] == host_ip]
+        return jsonify({'active': active, 'events': events}), 200
+    except Exception as e:
+        logger.error(f"❌ /api/alerts 报错：{str(e)}")
+        return jsonify({'error': '查询告警记录失败', 'detail': str(e)}), 500
+
+# ===================== 新增：主机在线状态接口 =====================
+@app.route('/api/host_status', methods=['GET'])
+def get_host_status():
+    """主机在线状态：当前离线主机（各主机最后一条状态记录）、本进程熔断状态 + 时间范围内的上线 / 离线变化
+
+    可选参数：start_time/end_time（默认最近 24 小时）、host_ip、state（online/offline）、limit。
+    """
+    try:
+        host_ip = request.args.get('host_ip', 'all')
+        start_time = request.args.get('start_time')
+        end_time = request.args.get('end_time')
+        try:
+            if start_time and end_time:
+                start_ts = int(datetime.strptime(start_time, '%Y-%m-%d %H:%M:%S').timestamp())
+                end_ts = int(datetime.strptime(end_time, '%Y-%m-%d %H:%M:%S').timestamp())
+            else:
+                end_ts = int(time.time())
+                start_ts = end_ts - 86400
+        except ValueError:
+            return jsonify({'error': '时间格式应为 YYYY-MM-DD HH:MM:SS'}), 400
+        limit = request.args.get('limit', 500, type=int)
+        if not 1 <= limit <= HISTORY_PAGE_MAX:
+            return jsonify({'error': f'limit 取值范围为 1~{HISTORY_PAGE_MAX}'}), 400
+
+        sql = '''
+            SELECT id, ip, state, reason, record_time AS ts,
+                   datetime(record_time, 'unixepoch', 'localtime') AS record_time
+            FROM host_status WHERE record_time BETWEEN ? AND ?
+        '''
+        params = [start_ts, end_ts]
+        if request.args.get('state'):
+            sql += ' AND state = ?'
+            params.append(request.args['state'])
+        if host_ip != 'all':
+            sql += ' AND ip = ?'
+            params.append(host_ip)
+        sql += ' ORDER BY record_time DESC, id DESC LIMIT ?'
+        params.append(limit)
+        with get_db_connection() as conn:
+            events = [dict(row) for row in conn.execute(sql, params)]
+            # 状态记录只在变化时写入，表很小；多进程部署时以库中记录为准
+            offline = {row['ip']: {'reason': row['reason'], 'since': row['record_time']} for row in conn.execute('''
+                SELECT s.ip, s.reason, s.record_time FROM host_status s
+                JOIN (SELECT ip, MAX(id) AS id FROM host_status GROUP BY ip) last ON s.id = last.id
+                WHERE s.state = 'offline'
+            ''')}
+
+        breakers = host_breaker.hosts()
+        if host_ip != 'all':
+            offline = {ip: item for ip, item in offline.items() if ip == host_ip}
+            breakers = {ip: item for ip, item in breakers.items() if ip == host_ip}
+        return jsonify({'offline': offline, 'breakers': breakers, 'events': events}), 200
+    except Exception as e:
+        logger.error(f"❌ /api/host_status 报错：{str(e)}")
+        return jsonify({'error': '查询主机状态失败', 'detail': str(e)}), 500
+
+# ===================== 新增：统计分析接口 =====================
+# 异常检测 z 分数阈值、每台主机最多返回的异常点数、移动平均默认窗口（点数）
+ANALYTICS_Z_THRESHOLD = float(os.environ.get('ANALYTICS_Z_THRESHOLD', 3.0))
+ANALYTICS_MAX_ANOMALIES = int(os.environ.get('ANALYTICS_MAX_ANOMALIES', 20))
+ANALYTICS_MA_WINDOW = int(os.environ.get('ANALYTICS_MA_WINDOW', 12))
+
+def load_metric_matrix(conn, table, start_ts, end_ts, host_ip=None, archived=None):
+    """把时间窗口内的数据装入 (主机数 × 最大点数) 的二维数组
+
+    每台主机占一行、按时间升序排列，点数不足的位置及离线采样为 NaN。
+    先按 ip 分组计数确定每行长度，再一次取出纯数值列直接构造 float 数组（None -> NaN），
+    两次查询在同一个读事务内，看到的是同一份快照。
+    archived 为冷数据层中更早的部分（HistoryArchive.host_series 的结果），拼在各主机序列之前。
+    返回 (ips, ts, {指标: 矩阵})，无数据时 ips 为空列表。
+    """
+    time_column = 'record_time'
+    if not host_ip:
+        # 窗口覆盖表中大部分数据时，按主键 (ip, record_time) 顺序全表扫描，
+        # 比走时间索引回表后再整体排序快数倍；"+" 使 SQLite 不选用时间索引
+        oldest = conn.execute(f'SELECT MIN(record_time) FROM {table}').fetchone()[0]
+        if oldest is not None and end_ts - start_ts > (time.time() - oldest) / 4:
+            time_column = '+record_time'
+    where = f'WHERE {time_column} BETWEEN ? AND ?'
+    params = [start_ts, end_ts]
+    if host_ip:
+        where += ' AND ip = ?'
+        params.append(host_ip)
+
+    cursor = conn.cursor()
+    cursor.row_factory = None
+    conn.execute('BEGIN')
+    try:
+        groups = cursor.execute(f'SELECT ip, COUNT(*) FROM {table} {where} GROUP BY ip ORDER BY ip', params).fetchall()
+        rows = cursor.execute(f'SELECT record_time, cpu, mem, disk FROM {table} {where} ORDER BY ip, record_time',
+                              params).fetchall()
+    finally:
+        conn.rollback()
+    if not rows and not archived:
+        return [], None, {}
+
+    data = np.array(rows, dtype=float).reshape(-1, 4)
+    ips = [ip for ip, _ in groups]
+    counts = [count for _, count in groups]
+    if archived:
+        hot = dict(zip(ips, np.split(data, np.cumsum(counts)[:-1]))) if ips else {}
+        ips = sorted(set(ips) | set(archived))
+        blocks = [np.concatenate([archived[ip], hot[ip]]) if ip in archived and ip in hot
+                  else archived[ip] if ip in archived else hot[ip] for ip in ips]
+        data = np.concatenate(blocks)
+        counts = [len(block) for block in blocks]
+    counts = np.array(counts)
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+    row_index = np.repeat(np.arange(len(counts)), counts)
+    col_index = np.arange(len(data)) - np.repeat(starts, counts)
+    shape = (len(counts), int(counts.max()))
+
+    def to_matrix(column):
+        matrix = np.full(shape, np.nan)
+        matrix[row_index, col_index] = data[:, column]
+        return matrix
+
+    return (ips, to_matrix(0),
+            {metric: to_matrix(i + 1) for i, metric in enumerate(ROLLUP_METRICS)})
+
+def nan_to_none(values, digits=2):
+    """NumPy 数组转为 JSON 可序列化列表（NaN -> None）"""
+    return [None if v != v else round(v, digits) for v in np.asarray(values, dtype=float).tolist()]
+
+def row_percentiles(matrix, counts, percents):
+    """按行计算百分位（线性插值，与 np.percentile 默认方法一致），忽略 NaN
+
+    np.nanpercentile 按行逐个调用，这里整体排序（NaN 排在末尾）后按下标取值。
+    """
+    ordered = np.sort(matrix, axis=1)
+    rows = np.arange(matrix.shape[0])
+    result = []
+    for pct in percents:
+        position = np.maximum(counts - 1, 0) * pct / 100.0
+        low = np.floor(position).astype(int)
+        high = np.ceil(position).astype(int)
+        value = ordered[rows, low] + (ordered[rows, high] - ordered[rows, low]) * (position - low)
+        result.append(np.where(counts > 0, value, np.nan))
+    return result
+
+def compute_analytics(ips, ts, values, start_ts, window, z_threshold, include_series=False):
+    """按主机（矩阵行）整体计算统计量，不逐行遍历数据"""
+    hosts, width = ts.shape
+    rows = np.arange(hosts)
+    present = ~np.isnan(ts)
+    last_pos = present.sum(axis=1) - 1          # 每台主机最后一个点的位置（点按时间连续排列）
+    last_ts = ts[rows, last_pos]
+    hours = (ts - start_ts) / 3600.0
+    window = max(min(window, width), 1)
+    lag = np.maximum(np.arange(1, width + 1) - window, 0)
+
+    result = [{'ip': ip, 'samples': int(n), 'first_time': int(first), 'last_time': int(last)}
+              for ip, n, first, last in zip(ips, present.sum(axis=1), ts[:, 0], last_ts)]
+    series = {'record_time': ts} if include_series else None
+    anomaly_parts = []
+    fleet = {'hosts': hosts, 'samples': int(present.sum())}
+
+    with warnings.catch_warnings(), np.errstate(invalid='ignore', divide='ignore'):
+        # 整行为 NaN（主机全程离线）时各 nan* 函数给出 NaN 并告警，结果按 None 输出
+        warnings.simplefilter('ignore', RuntimeWarning)
+        coverage = (~np.isnan(values['cpu'])).sum(axis=1) / np.maximum(present.sum(axis=1), 1)
+        for item, value in zip(result, nan_to_none(coverage, 3)):
+            item['data_coverage'] = value
+
+        for metric, matrix in values.items():
+            valid = ~np.isnan(matrix)
+            n = valid.sum(axis=1)
+            p50, p95, p99 = row_percentiles(matrix, n, (50, 95, 99))
+            mean = np.nanmean(matrix, axis=1)
+            std = np.nanstd(matrix, axis=1)
+
+            # 最新值：每行最后一个非 NaN
+            last_valid = width - 1 - np.argmax(valid[:, ::-1], axis=1)
+            latest = np.where(n > 0, matrix[rows, last_valid], np.nan)
+
+            # 移动平均：累计和相减得到每个位置前 window 个点（跳过 NaN）的均值，开头不足窗口时取已有点
+            filled = np.where(valid, matrix, 0.0)
+            csum = np.concatenate((np.zeros((hosts, 1)), np.cumsum(filled, axis=1)), axis=1)
+            ccount = np.concatenate((np.zeros((hosts, 1)), np.cumsum(valid, axis=1)), axis=1)
+            moving = (csum[:, 1:] - csum[:, lag]) / (ccount[:, 1:] - ccount[:, lag])
+            moving_latest = np.where(n > 0, moving[rows, last_valid], np.nan)
+
+            # 线性趋势：最小二乘斜率（每小时变化的百分点）
+            x = np.where(valid, hours, 0.0)
+            sx, sy = x.sum(axis=1), filled.sum(axis=1)
+            sxx, sxy = (x * x).sum(axis=1), (x * filled).sum(axis=1)
+            denom = n * sxx - sx * sx
+            slope = np.where((n >= 2) & (denom > 0), (n * sxy - sx * sy) / denom, np.nan)
+
+            # z 分数异常
+            z = (matrix - mean[:, None]) / std[:, None]
+            flags = valid & (std[:, None] > 0) & (np.abs(z) > z_threshold)
+            host_idx, pos_idx = np.nonzero(flags)
+            anomaly_parts.append((metric, host_idx, pos_idx, z[host_idx, pos_idx], matrix[host_idx, pos_idx]))
+
+            stats = {'min': np.nanmin(matrix, axis=1), 'max': np.nanmax(matrix, axis=1), 'mean': mean, 'std': std,
+                     'p50': p50, 'p95': p95, 'p99': p99, 'latest': latest, 'moving_avg': moving_latest}
+            columns = {key: nan_to_none(arr) for key, arr in stats.items()}
+            columns['trend_per_hour'] = nan_to_none(slope, 4)
+            anomaly_counts = flags.sum(axis=1).tolist()
+            for i, item in enumerate(result):
+                item[metric] = {key: column[i] for key, column in columns.items()}
+                item[metric]['anomalies'] = anomaly_counts[i]
+
+            fleet_values = matrix[valid]
+            if fleet_values.size:
+                fp50, fp95, fp99 = np.percentile(fleet_values, [50, 95, 99])
+                fleet[metric] = {'mean': round(float(fleet_values.mean()), 2), 'p50': round(float(fp50), 2),
+                                 'p95': round(float(fp95), 2), 'p99': round(float(fp99), 2)}
+            else:
+                fleet[metric] = None
+
+            if series is not None:
+                series[f'{metric}_ma'] = moving
+
+            if metric == 'disk':
+                # 磁盘写满预测：按当前斜率从最新值线性外推到 100%
+                hours_to_full = np.where(slope > 0, np.maximum(100.0 - latest, 0.0) / slope, np.nan)
+                full_at = last_ts + hours_to_full * 3600
+                for item, h, at in zip(result, nan_to_none(hours_to_full, 1), full_at.tolist()):
+                    item['disk_full_in_hours'] = h
+                    item['disk_full_at'] = None if h is None else \
+                        datetime.fromtimestamp(at).strftime('%Y-%m-%d %H:%M:%S')
+
+    # 每台主机只返回最近的若干个异常点（按主机、时间倒序排序后取各组前 N 个）
+    metric_names = np.concatenate([np.full(len(part[1]), part[0], dtype=object) for part in anomaly_parts])
+    host_idx = np.concatenate([part[1] for part in anomaly_parts])
+    pos_idx = np.concatenate([part[2] for part in anomaly_parts])
+    z_values = np.concatenate([part[3] for part in anomaly_parts])
+    metric_values = np.concatenate([part[4] for part in anomaly_parts])
+    order = np.lexsort((-ts[host_idx, pos_idx], host_idx)) if len(host_idx) else np.array([], dtype=int)
+    if len(order):
+        sorted_hosts = host_idx[order]
+        group_start = np.concatenate(([0], np.flatnonzero(np.diff(sorted_hosts)) + 1))
+        rank = np.arange(len(order)) - np.repeat(group_start, np.diff(np.append(group_start, len(order))))
+        order = order[rank < ANALYTICS_MAX_ANOMALIES]
+    for item in result:
+        item['anomalies'] = []
+    for i in order.tolist():
+        result[host_idx[i]]['anomalies'].append({
+            'time': datetime.fromtimestamp(ts[host_idx[i], pos_idx[i]]).strftime('%Y-%m-%d %H:%M:%S'),
+            'metric': metric_names[i],
+            'value': round(float(metric_values[i]), 2),
+            'z': round(float(z_values[i]), 2),
+        })
+    fleet['hosts_with_anomalies'] = sum(1 for item in result if item['anomalies'])
+
+    if series is not None:
+        for i, item in enumerate(result):
+            count = item['samples']
+            item['series'] = {key: ([int(v) for v in matrix[i, :count].tolist()] if key == 'record_time'
+                                    else nan_to_none(matrix[i, :count]))
+                              for key, matrix in series.items()}
+    return fleet, result
+
+@app.route('/api/analytics', methods=['GET'])
+def get_analytics():
+    """主机统计分析：百分位、移动平均、线性趋势、磁盘写满预测、z 分数异常
+
+    参数：host_ip（默认全部）、start_time/end_time（默认最近 24 小时）、
+    resolution（默认 auto）、window（移动平均点数）、z（异常阈值）、series=1（附带移动平均序列）。
+    """
+    try:
+        host_ip = request.args.get('host_ip', 'all')
+        start_time = request.args.get('start_time')
+        end_time = request.args.get('end_time')
+        try:
+            if start_time and end_time:
+                start_ts = int(datetime.strptime(start_time, '%Y-%m-%d %H:%M:%S').timestamp())
+                end_ts = int(datetime.strptime(end_time, '%Y-%m-%d %H:%M:%S').timestamp())
+            else:
+                end_ts = int(time.time())
+                start_ts = end_ts - 86400
+        except ValueError:
+            return jsonify({'error': '时间格式应为 YYYY-MM-DD HH:MM:SS'}), 400
+
+        resolution = request.args.get('resolution', 'auto')
+        if resolution == 'auto':
+            resolution = pick_history_resolution(start_ts, end_ts)
+        if resolution != 'raw' and resolution not in ROLLUP_LEVELS:
+            return jsonify({'error': 'resolution 取值应为 raw/1m/15m/1h/auto'}), 400
+        window = request.args.get('window', ANALYTICS_MA_WINDOW, type=int)
+        z_threshold = request.args.get('z', ANALYTICS_Z_THRESHOLD, type=float)
+        if window < 1 or z_threshold <= 0:
+            return jsonify({'error': 'window 需为正整数，z 需大于 0'}), 400
+
+        table = 'history' if resolution == 'raw' else ROLLUP_LEVELS[resolution][0]
+        started = time.perf_counter()
+        # 原始粒度跨过归档边界时，更早的部分从冷数据层读取
+        hot_start, archived = start_ts, None
+        boundary = history_archive.boundary() if resolution == 'raw' else None
+        if boundary is not None and start_ts < boundary:
+            archived = history_archive.host_series(start_ts, min(end_ts, boundary - 1),
+                                                   None if host_ip == 'all' else host_ip)
+            hot_start = boundary
+        conn = get_db_connection()
+        try:
+            ips, ts, values = load_metric_matrix(conn, table, hot_start, end_ts,
+                                                 None if host_ip == 'all' else host_ip, archived)
+        finally:
+            conn.close()
+        loaded = time.perf_counter()
+        if ips:
+            fleet, hosts = compute_analytics(ips, ts, values, start_ts, window, z_threshold,
+                                             include_series=request.args.get('series') == '1')
+        else:
+            fleet, hosts = {'hosts': 0, 'samples': 0}, []
+        elapsed = time.perf_counter() - started
+        logger.info(f"📊 统计分析：{fleet['hosts']} 台主机 {fleet['samples']} 个点（粒度：{resolution}），"
+                    f"耗时 {elapsed * 1000:.1f} ms（读取 {(loaded - started) * 1000:.1f} ms）")
+        response = jsonify({
+            'resolution': resolution,
+            'start_time': start_ts,
+            'end_time': end_ts,
+            'window': window,
+            'z_threshold': z_threshold,
+            'fleet': fleet,
+            'hosts': hosts
+        })
+        response.headers['X-History-Resolution'] = resolution
+        return response, 200
+    except Exception as e:
+        logger.error(f"❌ /api/analytics 报错：{str(e)}")
+        return jsonify({'error': '统计分析失败', 'detail': str(e)}), 500
+
 # ===================== 新增：系统设置接口 =====================
 @app.route('/api/settings', methods=['GET', 'POST'])
 def handle_settings():
     """系统设置：读取（GET）+ 保存（POST）"""
     try:
         if request.method == 'GET':
-            # 读取设置
-            logger.info("📥 收到 /api/settings 读取请求")
-            conn = get_db_connection()
-            cursor = conn.cursor()
-            cursor.execute('SELECT * FROM settings LIMIT 1')
-            settings = cursor.fetchone()
-            conn.close()
-            result = {
-                'refresh_interval': settings['refresh_interval'],
-                'cpu_threshold': settings['cpu_threshold'],
-                'mem_threshold': settings['mem_threshold'],
-                'theme': settings['theme'],
-                'data_retention': settings['data_retention']
-            }
-            logger.info(f"📤 返回系统设置：{result}")
-            return jsonify(result), 200
+            # 读取设置（内存缓存；客户端 ETag 未变化时返回 304）
+            settings, version, etag = settings_cache.snapshot()
+            if request.if_none_match.contains_weak(etag.strip('"')):
+                return '', 304, {'ETag': etag}
+            response = jsonify(settings)
+            response.headers['ETag'] = etag
+            response.headers['X-Settings-Version'] = str(version)
+            response.headers['Cache-Control'] = 'no-cache'
+            return response, 200
 
         elif request.method == 'POST':
-            # 保存设置
+            # 保存设置（写库并同步更新内存缓存）
             logger.info("📥 收到 /api/settings 保存请求")
-            settings_data = request.get_json()
-            conn = get_db_connection()
-            cursor = conn.cursor()
-            # 更新设置表
-            cursor.execute('''
-                UPDATE settings SET
-                    refresh_interval = ?,
-                    cpu_threshold = ?,
-                    mem_threshold = ?,
-                    theme = ?,
-                    data_retention = ?,
-                    update_time = ?
-                WHERE id = 1
-            ''', [
-                settings_data.get('refresh_interval', 5),
-                settings_data.get('cpu_threshold', 80),
-                settings_data.get('mem_threshold', 80),
-                settings_data.get('theme', 'dark'),
-                settings_data.get('data_retention', 7),
-                datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-            ])
-            conn.commit()
-            conn.close()
-            logger.info(f"✅ 保存系统设置成功：{settings_data}")
+            values = request.get_json(silent=True)
+            if not isinstance(values, dict):
+                return jsonify({'error': '请求体应为 JSON 对象'}), 400
+            try:
+                settings = settings_cache.update(values)
+            except SettingsError as e:
+                return jsonify({'error': '设置取值无效', 'detail': str(e)}), 400
+            # 保留天数可能被调小，立即触发一次清理
+            retention_worker.trigger()
+            collect_scheduler.reschedule()
+            # 其他 Web / 采集进程重新加载设置
+            notify_channel.send('settings')
+            # 阈值变化会改变所有主机的告警标记：推送完整的大屏数据
+            live_events.publish('settings', dashboard_view.current())
+            logger.info(f"✅ 保存系统设置成功：{settings}")
             return jsonify({'status': 'success', 'message': '设置保存成功！'}), 200
     except Exception as e:
         logger.error(f"❌ /api/settings 报错：{str(e)}")
         return jsonify({'error': '处理设置失败', 'detail': str(e)}), 500
 
 # ===================== 启动服务 =====================
+_services_lock = Lock()
+_web_services_pid = None
+
+def start_web_services():
+    """Web 进程的后台服务：内存快照、库变化跟进、进程间通知（不运行写线程，推送采样经 ingest_queue 交给采集进程）
+
+    每个进程只启动一次。由 create_app() 注册为首个请求前执行，因此 gunicorn --preload
+    在主进程导入时不会启动任何线程，fork 出的每个 worker 在处理首个请求时各自启动。
+    """
+    global _web_services_pid
+    if _web_services_pid == os.getpid():
+        return
+    with _services_lock:
+        if _web_services_pid == os.getpid():
+            return
+        load_snapshot_hosts()  # 登记主机到内存快照
+        snapshot_follower.start()  # 跟进采集进程写入的最新采样、告警与主机变化
+        notify_channel.open('web')
+        _web_services_pid = os.getpid()
+
+def start_collector_services(maintenance=True):
+    """采集进程的后台服务；maintenance 为 True 时同时负责旧数据迁移和过期清理（多个采集进程中只需一个）"""
+    history_writer.start()  # 启动历史数据写线程
+    if maintenance:
+        start_history_migration()  # 后台迁移旧版历史数据
+        retention_worker.start()  # 启动过期数据清理任务
+    collector_membership.start()  # 登记为采集进程，与其他实例分片
+    collect_scheduler.start()  # 启动固定频率采集调度（立即执行首次采集）
+    notify_channel.open('collector')
+
+def reload_settings():
+    """其他进程修改了设置（通知或定期检查发现）：重新读取，有变化时按新设置调度并推送
+
+    本进程保存的设置已在请求中生效并推送，这里读到的内容与缓存相同，不会重复处理。
+    """
+    if settings_cache.refresh():
+        collect_scheduler.reschedule()
+        retention_worker.trigger()
+        live_events.publish('settings', dashboard_view.current())
+
+def poll_shared_state():
+    """定期检查设置和推送令牌（通知是本机数据报，可能丢失，也到不了其他机器）"""
+    try:
+        reload_settings()
+        ingest_tokens.refresh()
+    except Exception as e:
+        logger.error(f"❌ 检查设置 / 推送令牌失败：{str(e)}")
+
+notify_channel.subscribe('settings', reload_settings)
+notify_channel.subscribe('hosts', ingest_tokens.reload)
+notify_channel.subscribe('ingest', history_writer.wake_ingest)
+
+def create_app():
+    """WSGI 入口（wsgi.py）：只初始化数据库，不启动采集；采集由 `python app.py collector` 独立运行"""
+    init_db()  # 初始化数据库（包含新增表）
+    if start_web_services not in app.before_request_funcs.get(None, []):
+        app.before_request(start_web_services)
+    return app
+
+def run_collector_worker(maintenance=False):
+    """独立采集进程：只运行写线程、分片成员和采集调度，不启动 Web 服务"""
+    # Ctrl+C 由守护进程统一处理；收到 SIGTERM 时从主循环正常返回，atexit 中释放租约
+    stopping = Event()
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, lambda *_: stopping.set())
+    start_collector_services(maintenance)
+    while not stopping.wait(1):
+        pass
+
+def run_collectors(processes):
+    """启动 processes 个采集进程并守护，进程异常退出后自动重启"""
+    ctx = multiprocessing.get_context('spawn')
+    workers = {}
+    logger.info(f"🧩 启动 {processes} 个采集进程")
+    try:
+        while True:
+            for slot in range(processes):
+                proc = workers.get(slot)
+                if proc is not None and proc.is_alive():
+                    continue
+                if proc is not None:
+                    logger.warning(f"⚠️ 采集进程 {proc.name} 已退出（exitcode={proc.exitcode}），重新启动")
+                proc = ctx.Process(target=run_collector_worker, args=(slot == 0,),
+                                   name=f'collector-{slot}', daemon=True)
+                proc.start()
+                workers[slot] = proc
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for proc in workers.values():
+            proc.terminate()
+        for proc in workers.values():
+            proc.join(timeout=10)
+
 if __name__ == '__main__':
     init_db()  # 初始化数据库（包含新增表）
-    collect_server_data()  # 启动定时采集任务（首次执行）
+    if len(sys.argv) > 1 and sys.argv[1] == 'collector':
+        # python app.py collector [进程数]：只运行采集进程（Web 进程设置 COLLECTOR_MODE=off）
+        run_collectors(int(sys.argv[2]) if len(sys.argv) > 2 else COLLECTOR_PROCESSES)
+        sys.exit(0)
+    # 开发服务器：Web 服务 + （embedded 模式下）进程内采集；生产环境见 wsgi.py
+    start_web_services()
+    if COLLECTOR_MODE == 'embedded':
+        start_collector_services(maintenance=True)
     app.run(
         host='0.0.0.0',
         port=5000,
         debug=False,
         threaded=True
-    )
\ No newline at end of file
+    )
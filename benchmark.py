@@ -0,0 +1,425 @@
+"""本地性能基准：启动一组模拟SSH主机，测量采集周期、接口延迟、写入吞吐和数据库体积
+
+用法（结果写入 JSON，便于不同提交之间对比）：
+    python benchmark.py --hosts 100 --seed-rows 10000000 --output bench_results.json
+    python benchmark.py --hosts 20 --seed-rows 200000 --cycles 3      # 快速跑一遍
+
+模拟主机基于 paramiko 的服务端接口，每台绑定一个独立的回环地址（127.0.x.y，需 Linux），
+对 MonitorCollector 发出的探测命令返回与真实 /proc、statvfs 同格式的输出，
+可配置响应延迟、抖动和失败率。数据库使用临时文件（或 --db 指定，已灌好的数据会复用）。
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import shlex
+import socket
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+import paramiko
+
+
+# ===================== 模拟主机 =====================
+class FakeHost:
+    """一台模拟主机：维护单调递增的 CPU 累计值，按命令返回 /proc 风格输出"""
+    def __init__(self, ip, port, latency, jitter, failure_rate, seed):
+        self.ip = ip
+        self.port = port
+        self.latency = latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.cpu_ticks = [self.rng.randint(10 ** 5, 10 ** 6) for _ in range(8)]
+        self.cpu_target = self.rng.uniform(5, 95)
+        self.mem_total = self.rng.choice([2, 4, 8, 16, 32]) * 1024 * 1024
+        self.disk_used = self.rng.uniform(0.1, 0.9)
+        self.commands = 0
+        self.failures = 0
+
+    def probe_output(self, mounts):
+        with self.lock:
+            # 本次间隔内的 tick 数，按目标使用率分配到 user/system 与 idle
+            delta = self.rng.randint(400, 600)
+            busy = int(delta * min(max(self.cpu_target + self.rng.gauss(0, 5), 0), 100) / 100)
+            self.cpu_ticks[0] += busy * 3 // 4
+            self.cpu_ticks[2] += busy - busy * 3 // 4
+            self.cpu_ticks[3] += delta - busy
+            cpu_line = 'cpu  ' + ' '.join(str(v) for v in self.cpu_ticks)
+            available = int(self.mem_total * self.rng.uniform(0.2, 0.8))
+        lines = [
+            cpu_line,
+            f'MemTotal:       {self.mem_total} kB',
+            f'MemFree:        {available // 2} kB',
+            f'MemAvailable:   {available} kB',
+            f'Buffers:        {available // 10} kB',
+            f'Cached:         {available // 4} kB',
+            f'loadavg {self.rng.uniform(0, 4):.2f} 0.50 0.40 1/200 12345',
+        ]
+        blocks = 25000000
+        for mount in mounts:
+            free = int(blocks * (1 - self.disk_used))
+            lines.append(f'fs 4096 {blocks} {free} {int(free * 0.95)} {mount}')
+        return '\n'.join(lines) + '\n'
+
+    def handle_exec(self, channel, command):
+        """在独立线程中应答一次 exec 请求"""
+        try:
+            time.sleep(max(self.latency + self.rng.uniform(-self.jitter, self.jitter), 0))
+            self.commands += 1
+            if self.rng.random() < self.failure_rate:
+                # 模拟命令失败：无输出、非零退出码
+                self.failures += 1
+                channel.send_exit_status(1)
+                return
+            if '/proc/stat' in command:
+                # 探测命令末尾为 stat -f -c '<格式>' <挂载点...>
+                mounts = shlex.split(command.split("%n'", 1)[1]) if "%n'" in command else ['/']
+                output = self.probe_output(mounts)
+            elif command.startswith('uname'):
+                output = f'Linux fake-{self.ip} 5.15.0-bench x86_64 GNU/Linux\n'
+            else:
+                output = ''
+            channel.sendall(output.encode())
+            channel.send_exit_status(0)
+        except Exception:
+            pass
+        finally:
+            channel.close()
+
+
+class FakeHostServer(paramiko.ServerInterface):
+    """接受任意用户名/密码，只开放 session + exec"""
+    def __init__(self, host):
+        self.host = host
+
+    def get_allowed_auths(self, username):
+        return 'password'
+
+    def check_auth_password(self, username, password):
+        return paramiko.AUTH_SUCCESSFUL
+
+    def check_channel_request(self, kind, chanid):
+        if kind == 'session':
+            return paramiko.OPEN_SUCCEEDED
+        return paramiko.OPEN_FAILED_ADMINISTRATIVELY_PROHIBITED
+
+    def check_channel_exec_request(self, channel, command):
+        threading.Thread(target=self.host.handle_exec, args=(channel, command.decode()), daemon=True).start()
+        return True
+
+
+class FakeFleet:
+    """N 台模拟主机，每台监听 127.0.x.y:port"""
+    def __init__(self, count, port, latency, jitter, failure_rate, seed=0):
+        self.host_key = paramiko.RSAKey.generate(2048)
+        self.hosts = [FakeHost(f'127.0.{1 + i // 250}.{1 + i % 250}', port, latency, jitter, failure_rate, seed + i)
+                      for i in range(count)]
+        self._sockets = []
+        self._transports = []
+        self._lock = threading.Lock()
+
+    def start(self):
+        for host in self.hosts:
+            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            sock.bind((host.ip, host.port))
+            sock.listen(64)
+            self._sockets.append(sock)
+            threading.Thread(target=self._accept_loop, args=(sock, host), daemon=True).start()
+
+    def _accept_loop(self, sock, host):
+        while True:
+            try:
+                client, _ = sock.accept()
+            except OSError:
+                return
+            try:
+                transport = paramiko.Transport(client)
+                transport.add_server_key(self.host_key)
+                transport.start_server(server=FakeHostServer(host))
+                with self._lock:
+                    self._transports.append(transport)
+            except Exception:
+                client.close()
+
+    def stop(self):
+        for sock in self._sockets:
+            sock.close()
+        with self._lock:
+            for transport in self._transports:
+                transport.close()
+
+    def stats(self):
+        return {'commands': sum(h.commands for h in self.hosts), 'failures': sum(h.failures for h in self.hosts)}
+
+
+# ===================== 统计工具 =====================
+def summarize(samples_ms):
+    """延迟样本（毫秒）的分位数摘要"""
+    if not samples_ms:
+        return {'count': 0}
+    values = sorted(samples_ms)
+    return {
+        'count': len(values),
+        'mean_ms': round(sum(values) / len(values), 3),
+        'p50_ms': round(monitor.percentile(values, 50), 3),
+        'p95_ms': round(monitor.percentile(values, 95), 3),
+        'p99_ms': round(monitor.percentile(values, 99), 3),
+        'max_ms': round(values[-1], 3),
+    }
+
+
+def git_revision():
+    try:
+        cwd = os.path.dirname(os.path.abspath(__file__))
+        commit = subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=cwd, text=True).strip()
+        dirty = bool(subprocess.check_output(['git', 'status', '--porcelain', '--untracked-files=no'],
+                                             cwd=cwd, text=True).strip())
+        return {'commit': commit, 'dirty': dirty}
+    except Exception:
+        return {'commit': None, 'dirty': None}
+
+
+def db_size(path):
+    """数据库文件大小（含 WAL）及各表/索引占用（需 SQLite 编译了 dbstat）"""
+    result = {'file_bytes': os.path.getsize(path),
+              'wal_bytes': os.path.getsize(path + '-wal') if os.path.exists(path + '-wal') else 0}
+    try:
+        with sqlite3.connect(path) as conn:
+            result['objects'] = {name: size for name, size in conn.execute(
+                'SELECT name, SUM(pgsize) FROM dbstat GROUP BY name ORDER BY 2 DESC')}
+    except sqlite3.OperationalError:
+        result['objects'] = None
+    return result
+
+
+# ===================== 各项测量 =====================
+def seed_history(ips, rows, interval, rng):
+    """按采集间隔回填历史数据（约 2% 的采样缺失，模拟离线时段），时间截止到当前整点之前；返回 (起始, 截止) 时间戳"""
+    conn = monitor.get_db_connection()
+    existing = conn.execute('SELECT COUNT(*) FROM history').fetchone()[0]
+    end = int(time.time()) // 3600 * 3600
+    per_host = max(rows // len(ips), 1)
+    start = (end - per_host * interval) // 3600 * 3600
+    if existing >= rows:
+        print(f"♻️ 复用已有历史数据 {existing} 行")
+        first = conn.execute('SELECT MIN(record_time) FROM history').fetchone()[0]
+        conn.close()
+        return first // 3600 * 3600, end, 0.0
+
+    print(f"🌱 灌入历史数据 {per_host * len(ips)} 行（{len(ips)} 台 × {per_host} 个采样）...")
+    conn.execute('PRAGMA synchronous=OFF')
+    started = time.perf_counter()
+
+    def generate(chunk_start, chunk_end):
+        for ts in range(chunk_start, chunk_end, interval):
+            for ip in ips:
+                if rng.random() >= 0.02:
+                    yield (ip, ts, 'root', round(rng.uniform(0, 100), 1), round(rng.uniform(10, 90), 1),
+                           round(rng.uniform(20, 80), 1), 'online')
+
+    chunk = interval * max(100000 // len(ips), 1)
+    for chunk_start in range(start, end, chunk):
+        with conn:
+            conn.executemany(monitor.HistoryWriter.INSERT_SQL, generate(chunk_start, min(chunk_start + chunk, end)))
+    seed_seconds = time.perf_counter() - started
+    print(f"🧮 补算预聚合表...")
+    monitor.backfill_rollups(conn, end, start)
+    conn.close()
+    return start, end, seed_seconds
+
+
+def measure_cycles(cycles):
+    """连续执行采集周期，首轮含SSH握手（冷启动），其余为复用连接（热）"""
+    durations = []
+    for _ in range(cycles):
+        started = time.perf_counter()
+        monitor.collect_server_data()
+        durations.append((time.perf_counter() - started) * 1000)
+    hosts = monitor.snapshot_store.get_all(monitor.get_stale_after())
+    return {
+        'cold_ms': round(durations[0], 3),
+        'warm': summarize(durations[1:]),
+        'online_hosts': sum(1 for h in hosts if h['status'] == 'online'),
+        'total_hosts': len(hosts),
+        'ssh_pool': monitor.ssh_pool.stats(),
+        'breaker': monitor.host_breaker.stats(),
+    }
+
+
+def measure_api(client, ips, seed_end, repeat):
+    """用 Flask test_client 测量接口处理延迟（不含网络与 WSGI 服务器开销）"""
+    def fmt(ts):
+        return datetime.fromtimestamp(ts).strftime('%Y-%m-%d %H:%M:%S')
+
+    scenarios = {
+        'hosts': ('/api/hosts', {}),
+        'recent_5m_all': ('/api/recent', {'seconds': 300}),
+        'history_1h_one_host_raw': ('/api/history', {
+            'host_ip': ips[0], 'start_time': fmt(seed_end - 3600), 'end_time': fmt(seed_end)}),
+        'history_1h_all_page_columnar': ('/api/history', {
+            'start_time': fmt(seed_end - 3600), 'end_time': fmt(seed_end), 'limit': 1000, 'format': 'columnar'}),
+        'history_24h_one_host_auto': ('/api/history', {
+            'host_ip': ips[0], 'start_time': fmt(seed_end - 86400), 'end_time': fmt(seed_end), 'resolution': 'auto'}),
+        'history_7d_all_auto': ('/api/history', {
+            'start_time': fmt(seed_end - 7 * 86400), 'end_time': fmt(seed_end), 'resolution': 'auto'}),
+        'history_csv_1h_all_raw': ('/api/history', {
+            'start_time': fmt(seed_end - 3600), 'end_time': fmt(seed_end), 'export': 'csv'}),
+        'history_csv_7d_one_host_raw': ('/api/history', {
+            'host_ip': ips[0], 'start_time': fmt(seed_end - 7 * 86400), 'end_time': fmt(seed_end), 'export': 'csv'}),
+        'analytics_7d_all': ('/api/analytics', {
+            'start_time': fmt(seed_end - 7 * 86400), 'end_time': fmt(seed_end)}),
+    }
+    results = {}
+    for name, (path, params) in scenarios.items():
+        samples = []
+        size = 0
+        for _ in range(repeat):
+            started = time.perf_counter()
+            response = client.get(path, query_string=params)
+            body = response.get_data()   # 流式响应在此处才真正执行
+            samples.append((time.perf_counter() - started) * 1000)
+            if response.status_code != 200:
+                raise RuntimeError(f'{name} 返回 {response.status_code}：{body[:200]!r}')
+            size = len(body)
+        results[name] = dict(summarize(samples), response_bytes=size)
+        print(f"  {name}: p50={results[name]['p50_ms']}ms p95={results[name]['p95_ms']}ms")
+    return results
+
+
+def measure_ingest(total_rows, batch_rows):
+    """以采集批次的形式持续提交到写队列，测量从首批入队到全部提交的吞吐"""
+    writer = monitor.history_writer
+    before = writer.stats()['rows_written']
+    base = int(time.time())
+    ips = [f'ingest-{i}' for i in range(batch_rows)]
+    started = time.perf_counter()
+    for batch in range(total_rows // batch_rows):
+        while writer.stats()['queue_depth'] > writer.queue_max // 2:
+            time.sleep(0.005)
+        writer.submit([(ip, base + batch, 'root', 12.5, 40.0, 55.0, 'online') for ip in ips])
+    submitted = total_rows // batch_rows * batch_rows
+    while writer.stats()['rows_written'] - before < submitted:
+        time.sleep(0.005)
+    elapsed = time.perf_counter() - started
+    stats = writer.stats()
+    return {'rows': submitted, 'seconds': round(elapsed, 3), 'rows_per_second': round(submitted / elapsed),
+            'max_batch_size': stats['max_batch_size'], 'avg_commit_ms': stats['avg_commit_ms'],
+            'rows_dropped': stats['rows_dropped']}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='服务器监控系统性能基准')
+    parser.add_argument('--hosts', type=int, default=50, help='模拟主机数量')
+    parser.add_argument('--port', type=int, default=2222, help='模拟主机SSH端口')
+    parser.add_argument('--latency', type=float, default=0.02, help='命令响应延迟（秒）')
+    parser.add_argument('--jitter', type=float, default=0.01, help='响应延迟抖动（秒，±）')
+    parser.add_argument('--failure-rate', type=float, default=0.0, help='命令失败概率 0~1')
+    parser.add_argument('--archive-hot-days', type=int, default=0,
+                        help='大于 0 时先把早于该天数的数据归档到冷数据层，接口场景跨两层查询')
+    parser.add_argument('--dead', type=int, default=0, help='额外登记的不可达主机数（端口无监听，测熔断）')
+    parser.add_argument('--cycles', type=int, default=5, help='采集周期数（首轮为冷启动）')
+    parser.add_argument('--seed-rows', type=int, default=10_000_000, help='预先灌入的历史数据行数')
+    parser.add_argument('--interval', type=int, default=5, help='灌入数据的采样间隔（秒）')
+    parser.add_argument('--repeat', type=int, default=30, help='每个接口场景的请求次数')
+    parser.add_argument('--ingest-rows', type=int, default=200_000, help='写入吞吐测试的总行数')
+    parser.add_argument('--workers', type=int, default=64, help='采集线程数（COLLECT_MAX_WORKERS）')
+    parser.add_argument('--db', help='数据库路径（默认临时文件；指定已有文件可复用灌好的数据）')
+    parser.add_argument('--output', default='bench_results.json', help='结果 JSON 文件')
+    parser.add_argument('--verbose', action='store_true', help='保留应用的 INFO 日志')
+    parser.add_argument('--seed', type=int, default=42, help='随机种子')
+    args = parser.parse_args()
+
+    # 应用模块在导入时读取环境变量（数据库路径、线程池大小、逐条采样日志）
+    db_path = args.db or os.path.join(tempfile.mkdtemp(prefix='monitor-bench-'), 'monitor.db')
+    os.environ['DB_PATH'] = db_path
+    os.environ['COLLECT_MAX_WORKERS'] = str(args.workers)
+    os.environ.setdefault('LOG_SAMPLES', '0')
+    global monitor
+    import app as monitor
+    import logging
+    if not args.verbose:
+        monitor.logger.setLevel(logging.WARNING)
+        logging.getLogger('paramiko').setLevel(logging.WARNING)
+
+    monitor.COLLECT_SPREAD = 0   # 不错峰，测量的是采集本身的耗时
+    monitor.init_db()
+    monitor.settings_cache.update({'refresh_interval': args.interval, 'data_retention': 3650})
+
+    fleet = FakeFleet(args.hosts, args.port, args.latency, args.jitter, args.failure_rate, args.seed)
+    fleet.start()
+    print(f"🖥️ 已启动 {args.hosts} 台模拟主机（{fleet.hosts[0].ip} ~ {fleet.hosts[-1].ip}:{args.port}）")
+    ips = [host.ip for host in fleet.hosts]
+
+    results = {}
+    seed_start, seed_end, seed_seconds = seed_history(ips, args.seed_rows, args.interval, random.Random(args.seed))
+    results['seed'] = {'rows': monitor.get_db_connection().execute('SELECT COUNT(*) FROM history').fetchone()[0],
+                       'seconds': round(seed_seconds, 3), 'start': seed_start, 'end': seed_end}
+    if args.archive_hot_days > 0:
+        print(f"🧊 归档 {args.archive_hot_days} 天前的数据...")
+        monitor.ARCHIVE_HOT_DAYS = args.archive_hot_days
+        started = time.perf_counter()
+        monitor.retention_worker.run_once()
+        results['archive'] = dict(monitor.history_archive.stats(), seconds=round(time.perf_counter() - started, 3))
+        print(f"  {results['archive']['days']} 天 {results['archive']['rows']} 行，{results['archive']['bytes']} 字节，"
+              f"耗时 {results['archive']['seconds']} 秒")
+
+    with monitor.get_db_connection() as conn:
+        conn.execute('DELETE FROM hosts')
+        dead_ips = [f'127.0.250.{1 + i}' for i in range(args.dead)]
+        conn.executemany('INSERT INTO hosts (ip, username, password, port) VALUES (?, ?, ?, ?)',
+                         [(ip, 'root', 'bench', args.port) for ip in ips + dead_ips])
+    monitor.load_snapshot_hosts()
+    monitor.history_writer.start()
+
+    try:
+        print(f"⏱️ 采集周期 × {args.cycles}...")
+        results['collect_cycle'] = measure_cycles(args.cycles)
+        print(f"  冷启动 {results['collect_cycle']['cold_ms']}ms，热 p50={results['collect_cycle']['warm'].get('p50_ms')}ms")
+
+        print(f"📡 接口延迟（每个场景 {args.repeat} 次）...")
+        results['api'] = measure_api(monitor.app.test_client(), ips, seed_end, args.repeat)
+
+        print(f"📥 写入吞吐（{args.ingest_rows} 行）...")
+        results['ingest'] = measure_ingest(args.ingest_rows, args.hosts)
+        print(f"  {results['ingest']['rows_per_second']} 行/秒")
+
+        results['db_size'] = db_size(db_path)
+        results['fake_fleet'] = fleet.stats()
+        results['metrics'] = monitor.metrics.snapshot()['histograms']
+    finally:
+        for ip in ips + dead_ips:
+            monitor.ssh_pool.close_host(ip)
+        fleet.stop()
+        monitor.history_writer.stop()
+
+    report = {
+        'meta': {
+            'timestamp': datetime.now().isoformat(timespec='seconds'),
+            'git': git_revision(),
+            'python': sys.version.split()[0],
+            'sqlite': sqlite3.sqlite_version,
+            'paramiko': paramiko.__version__,
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'db_path': db_path,
+            'args': vars(args),
+        },
+        'results': results,
+    }
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"✅ 基准测试完成，结果已写入 {args.output}")
+    monitor.collect_executor.shutdown(wait=False, cancel_futures=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -172,6 +172,19 @@ class ChartManager {
         chart.update();
     }
 
+    // 把 /api/recent 返回的 {ip: {record_time, cpu, mem}}（已按时间升序）转换为 updateCharts 所需格式
+    recentToMetrics(hosts) {
+        const metrics = {};
+        for (const [ip, series] of Object.entries(hosts)) {
+            metrics[ip] = {
+                cpu: series.cpu,
+                memory: series.mem,
+                labels: series.record_time.map(t => new Date(t * 1000).toLocaleTimeString())
+            };
+        }
+        return metrics;
+    }
+
     // 销毁所有图表
     destroy() {
         for (const chart of this.charts.values()) {
@@ -5,18 +5,20 @@ from datetime import datetime
 conn = sqlite3.connect('server_monitor.db')
 cursor = conn.cursor()
 
-# 1. 创建历史数据表
+# 1. 创建历史数据表（数值型指标 + epoch 秒时间戳，按 (ip, record_time) 聚簇）
 cursor.execute('''
 CREATE TABLE IF NOT EXISTS history (
-    id INTEGER PRIMARY KEY AUTOINCREMENT,
     ip TEXT NOT NULL,
+    record_time INTEGER NOT NULL,
     username TEXT NOT NULL,
-    cpu TEXT NOT NULL,
-    mem TEXT NOT NULL,
-    disk TEXT DEFAULT '0.0%',
-    record_time DATETIME NOT NULL
-)
+    cpu REAL,
+    mem REAL,
+    disk REAL,
+    status TEXT NOT NULL DEFAULT 'online',
+    PRIMARY KEY (ip, record_time)
+) WITHOUT ROWID
 ''')
+cursor.execute('CREATE INDEX IF NOT EXISTS idx_history_time ON history (record_time)')
 
 # 2. 创建系统设置表
 cursor.execute('''
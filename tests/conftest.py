@@ -0,0 +1,27 @@
+"""测试公共夹具：每个用例使用临时目录中的独立数据库"""
+import os
+import sys
+import tempfile
+
+# 应用模块在导入时读取 DB_PATH：先指向临时目录，避免导入时访问容器路径
+os.environ.setdefault('DB_PATH', os.path.join(tempfile.mkdtemp(prefix='monitor-test-'), 'monitor.db'))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+
+import app as monitor
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    """初始化临时数据库并重置依赖数据库的进程内状态，返回一个数据库连接"""
+    monkeypatch.setattr(monitor, 'DB_PATH', str(tmp_path / 'monitor.db'))
+    monitor.init_db()
+    monitor.settings_cache.reload()
+    monkeypatch.setattr(monitor, 'alert_engine', monitor.AlertEngine())
+    monkeypatch.setattr(monitor, 'host_status', monitor.HostStatusTracker())
+    monkeypatch.setattr(monitor, 'history_writer', monitor.HistoryWriter())
+    conn = monitor.get_db_connection()
+    yield conn
+    conn.close()
+
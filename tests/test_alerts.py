@@ -0,0 +1,53 @@
+"""告警状态机：持续时间、回差与乱序采样"""
+import app as monitor
+
+IP = '10.0.0.1'
+SETTINGS = {'cpu_threshold': 80, 'mem_threshold': 80}
+
+
+def sample(ts, cpu, mem=10.0):
+    return (IP, ts, 'root', cpu, mem, 10.0, 'online')
+
+
+def states(transitions):
+    return [(metric, state, started_at, record_time) for _, metric, state, _, _, started_at, record_time in transitions]
+
+
+def test_fires_after_sustain_and_resolves_below_hysteresis():
+    engine = monitor.AlertEngine(sustain=30, hysteresis=5)
+    assert engine.evaluate([sample(0, 81), sample(20, 85)], SETTINGS) == []
+    # 持续时间未达到即回落：不告警，重新计时
+    assert engine.evaluate([sample(25, 79)], SETTINGS) == []
+    assert engine.evaluate([sample(30, 85), sample(50, 90)], SETTINGS) == []
+    assert states(engine.evaluate([sample(60, 90)], SETTINGS)) == [('cpu', 'firing', 30, 60)]
+    # 阈值附近的波动（高于 阈值 - 回差）不恢复，也不重复触发
+    assert engine.evaluate([sample(70, 77), sample(80, 81), sample(90, 75)], SETTINGS) == []
+    assert states(engine.evaluate([sample(100, 74.9)], SETTINGS)) == [('cpu', 'resolved', 30, 100)]
+    assert engine.evaluate([sample(110, 10)], SETTINGS) == []
+
+
+def test_offline_and_out_of_order_samples_do_not_change_state():
+    engine = monitor.AlertEngine(sustain=0, hysteresis=5)
+    assert states(engine.evaluate([sample(100, 95)], SETTINGS)) == [('cpu', 'firing', 100, 100)]
+    offline = (IP, 110, 'root', None, None, None, 'offline')
+    assert engine.evaluate([offline, sample(90, 10)], SETTINGS) == []
+    assert states(engine.evaluate([sample(120, 10)], SETTINGS)) == [('cpu', 'resolved', 100, 120)]
+
+
+def test_metrics_are_evaluated_independently():
+    engine = monitor.AlertEngine(sustain=0, hysteresis=5)
+    result = engine.evaluate([sample(0, 90, mem=95)], SETTINGS)
+    assert sorted(states(result)) == [('cpu', 'firing', 0, 0), ('mem', 'firing', 0, 0)]
+    assert states(engine.evaluate([sample(10, 50, mem=95)], SETTINGS)) == [('cpu', 'resolved', 0, 10)]
+
+
+def test_firing_alert_survives_restore(db):
+    engine = monitor.AlertEngine(sustain=0, hysteresis=5)
+    with db:
+        monitor.AlertEngine.write(db, engine.evaluate([sample(100, 95)], SETTINGS))
+
+    # 接手主机的进程从 alerts 表恢复 firing 状态：回差内不重复触发，回落后写入恢复
+    restored = monitor.AlertEngine(sustain=0, hysteresis=5)
+    assert restored.restore(db, [IP]) == 1
+    assert restored.evaluate([sample(110, 90)], SETTINGS) == []
+    assert states(restored.evaluate([sample(120, 70)], SETTINGS)) == [('cpu', 'resolved', 100, 120)]
@@ -0,0 +1,89 @@
+"""采集分片：一致性哈希分配与租约交接"""
+import app as monitor
+
+HOSTS = [{'ip': f'10.0.0.{i}', 'username': 'root', 'password': '', 'port': 22} for i in range(60)]
+ALL_IPS = {host['ip'] for host in HOSTS}
+
+
+def join(worker_id):
+    """登记一个采集进程（只写心跳，不启动心跳线程）"""
+    member = monitor.CollectorMembership()
+    member.worker_id = worker_id
+    member._heartbeat()
+    return member
+
+
+def claimed(member):
+    return {host['ip'] for host in member.claim(HOSTS)}
+
+
+def settle(*members):
+    """运行两轮分配：第一轮新成员等待原持有者释放，第二轮各自持有归属自己的主机"""
+    for _ in range(2):
+        owned = [claimed(member) for member in members]
+    return owned
+
+
+def expire(conn, worker_id, ttl):
+    """模拟进程崩溃：心跳与租约都停留在 ttl 之前，且不删除"""
+    with conn:
+        conn.execute('UPDATE collector_workers SET heartbeat_at = heartbeat_at - ? WHERE worker_id = ?',
+                     [2 * ttl, worker_id])
+        conn.execute('UPDATE host_leases SET expires_at = expires_at - ? WHERE worker_id = ?', [2 * ttl, worker_id])
+
+
+def test_hash_ring_moves_only_the_new_nodes_share():
+    before = monitor.HashRing(['A', 'B'])
+    after = monitor.HashRing(['A', 'B', 'C'])
+    moved = [ip for ip in ALL_IPS if before.owner(ip) != after.owner(ip)]
+    assert moved
+    assert all(after.owner(ip) == 'C' for ip in moved)
+    assert monitor.HashRing([]).owner('10.0.0.1') is None
+
+
+def test_new_worker_waits_for_leases_then_takes_its_share(db):
+    a = join('A')
+    assert claimed(a) == ALL_IPS
+
+    b = join('B')
+    ring = monitor.HashRing(['A', 'B'])
+    share_b = {ip for ip in ALL_IPS if ring.owner(ip) == 'B'}
+    # A 的租约仍有效：B 本周期不采集，避免同一主机被两个进程同时采集
+    assert claimed(b) == set()
+    assert b.stats()['waiting'] == len(share_b)
+
+    # A 的下个周期释放不再归属自己的主机，B 随后接手
+    owned_a = claimed(a)
+    assert owned_a == ALL_IPS - share_b
+    owned_b = claimed(b)
+    assert owned_b == share_b
+    assert owned_a & owned_b == set()
+    assert a.stats()['released'] == len(share_b)
+    assert b.stats()['adopted'] == len(share_b)
+
+
+def test_crashed_worker_hosts_move_after_lease_expiry(db):
+    a, b = join('A'), join('B')
+    owned_a, owned_b = settle(a, b)
+    assert owned_a | owned_b == ALL_IPS and owned_b
+
+    expire(db, 'B', a.ttl())
+    queued = monitor.history_writer._queue
+    while not queued.empty():
+        queued.get_nowait()
+    assert claimed(a) == ALL_IPS
+    # 接手的主机交给写线程从库中恢复状态
+    adopted, released = queued.get_nowait()
+    assert set(adopted) == owned_b and released == []
+    leases = dict(db.execute('SELECT ip, worker_id FROM host_leases').fetchall())
+    assert set(leases) == ALL_IPS and set(leases.values()) == {'A'}
+
+
+def test_lease_of_live_worker_is_not_taken(db):
+    a, b = join('A'), join('B')
+    _, owned_b = settle(a, b)
+    # A 看不到 B 的心跳（如时钟或网络抖动）时，B 的租约未过期，A 也不能接手
+    with db:
+        db.execute('UPDATE collector_workers SET heartbeat_at = heartbeat_at - ? WHERE worker_id = ?',
+                   [2 * a.ttl(), 'B'])
+    assert claimed(a) & owned_b == set()
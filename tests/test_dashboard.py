@@ -0,0 +1,33 @@
+"""监控大屏概览：无数据的主机不计入平均值和告警"""
+import app as monitor
+
+SETTINGS = {'cpu_threshold': 80, 'mem_threshold': 80}
+
+
+def test_hosts_without_metrics_are_skipped_in_fleet_averages():
+    store = monitor.HostSnapshotStore()
+    for ip in ('10.0.0.1', '10.0.0.2', '10.0.0.3', '10.0.0.4'):
+        store.register(ip, 'root', 22)
+    store.publish('10.0.0.1', 40.0, 60.0, 30.0, 'online', record_time=100)
+    store.publish('10.0.0.2', 90.0, 20.0, 30.0, 'online', record_time=100)
+    store.publish('10.0.0.3', None, None, None, 'offline', record_time=100, reason='ssh')
+
+    hosts = {host['ip']: host for host in store.get_all(60)}
+    assert hosts['10.0.0.1']['cpu'] == '40.0%'
+    # 离线和尚未采集的主机指标为 None，由页面显示为 -
+    assert hosts['10.0.0.3']['cpu'] is None and hosts['10.0.0.4']['mem'] is None
+
+    data = monitor.DashboardView.build(list(hosts.values()), SETTINGS)
+    overview = data['overview']
+    assert (overview['avg_cpu'], overview['avg_mem']) == (65.0, 40.0)
+    assert (overview['cpu_alerts'], overview['mem_alerts']) == (1, 0)
+    assert (overview['online'], overview['offline'], overview['pending']) == (2, 1, 1)
+    assert {host['ip']: host['alerts']['cpu'] for host in data['hosts']} == \
+        {'10.0.0.1': False, '10.0.0.2': True, '10.0.0.3': False, '10.0.0.4': False}
+
+
+def test_fleet_averages_without_any_metrics():
+    store = monitor.HostSnapshotStore()
+    store.register('10.0.0.1', 'root', 22)
+    overview = monitor.DashboardView.build(store.get_all(60), SETTINGS)['overview']
+    assert (overview['avg_cpu'], overview['avg_mem']) == (0.0, 0.0)
@@ -0,0 +1,96 @@
+"""/api/history 键集分页：跨冷热数据边界、并入离线起点"""
+from datetime import datetime, timedelta
+
+import pytest
+
+import app as monitor
+
+IPS = ['10.0.0.1', '10.0.0.2', '10.0.0.3']
+INTERVAL = 1800
+
+
+def fmt(ts):
+    return datetime.fromtimestamp(ts).strftime('%Y-%m-%d %H:%M:%S')
+
+
+@pytest.fixture
+def archived_history(db, monkeypatch):
+    """灌入 4 天的采样和离线记录，归档热数据窗口（1 天）之前的部分，返回 (查询参数, 归档前的完整结果)"""
+    monkeypatch.setattr(monitor, 'ARCHIVE_HOT_DAYS', 1)
+    today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+    start = int((today - timedelta(days=3)).timestamp())
+    end = int(datetime.now().timestamp())
+    rows, markers = [], []
+    for n, ts in enumerate(range(start, end, INTERVAL)):
+        for i, ip in enumerate(IPS):
+            if (n + i) % 17 == 0:
+                # 离线时段不写 history，由 host_status 的离线起点表示
+                markers.append((ip, 'offline', 'timeout' if i else 'offline', ts))
+            else:
+                rows.append((ip, ts, 'root', round(n % 100 + i / 10, 1), 40.5, 60.0, 'online'))
+    with db:
+        db.executemany('INSERT INTO hosts (ip, username, password, port) VALUES (?, ?, ?, 22)',
+                       [(ip, 'root', '') for ip in IPS])
+        db.executemany(monitor.HistoryWriter.INSERT_SQL, rows)
+        monitor.HostStatusTracker.write(db, markers)
+
+    query = {'start_time': fmt(start + INTERVAL), 'end_time': fmt(end)}
+    client = monitor.app.test_client()
+    expected = client.get('/api/history', query_string=query).get_json()
+    monitor.retention_worker.run_once()
+    boundary = monitor.history_archive.boundary()
+    assert boundary is not None and start < boundary < end
+    assert db.execute('SELECT COUNT(*) FROM history WHERE record_time < ?', [boundary]).fetchone()[0] == 0
+    return client, query, expected, boundary
+
+
+def read_pages(client, query, limit):
+    pages, cursor = [], None
+    while True:
+        params = dict(query, limit=limit)
+        if cursor:
+            params['cursor'] = cursor
+        body = client.get('/api/history', query_string=params).get_json()
+        assert body['count'] <= limit
+        pages.append(body['data'])
+        cursor = body['next_cursor']
+        if not cursor:
+            return pages
+
+
+@pytest.mark.parametrize('limit', [1, 7, 50, 1000])
+def test_pages_match_unpaginated_result_across_archive_boundary(archived_history, limit):
+    client, query, expected, _ = archived_history
+    pages = read_pages(client, query, limit)
+    assert [row for page in pages for row in page] == expected
+    assert {row['status'] for row in expected} == {'online', 'offline', 'timeout'}
+
+
+def test_unpaginated_result_unchanged_by_archiving(archived_history):
+    client, query, expected, _ = archived_history
+    assert client.get('/api/history', query_string=query).get_json() == expected
+
+
+def test_single_host_pages_include_archived_offline_markers(archived_history):
+    client, query, expected, boundary = archived_history
+    query = dict(query, host_ip='10.0.0.2')
+    rows = [row for page in read_pages(client, query, 9) for row in page]
+    assert rows == [row for row in expected if row['ip'] == '10.0.0.2']
+    archived = [row for row in rows if row['record_time'] < fmt(boundary)]
+    assert archived and any(row['status'] == 'timeout' for row in archived)
+
+
+def test_columnar_pages_are_ordered_by_time_then_ip(archived_history):
+    client, query, expected, _ = archived_history
+    keys, cursor = [], None
+    while True:
+        params = dict(query, limit=40, format='columnar')
+        if cursor:
+            params['cursor'] = cursor
+        body = client.get('/api/history', query_string=params).get_json()
+        keys += list(zip(body['data']['record_time'], body['data']['ip']))
+        cursor = body['next_cursor']
+        if not cursor:
+            break
+    assert keys == sorted(keys, reverse=True)
+    assert len(keys) == len(set(keys)) == len(expected)
@@ -0,0 +1,63 @@
+"""预聚合：桶结束输出、迟到数据从原始数据重算、离线采样计数"""
+import time
+
+import app as monitor
+
+IP = '10.0.0.1'
+
+
+def online(ts, cpu):
+    return (IP, ts, 'root', cpu, 50.0, 60.0, 'online')
+
+
+def offline(ts, status='offline'):
+    return (IP, ts, 'root', None, None, None, status)
+
+
+def minute_row(conn, start):
+    return conn.execute('SELECT cpu, cpu_min, cpu_max, online_count, offline_count FROM history_1m '
+                        'WHERE ip = ? AND record_time = ?', [IP, start]).fetchone()
+
+
+def test_closed_bucket_counts_online_and_offline_samples(db):
+    writer = monitor.HistoryWriter()
+    now = int(time.time())
+    current = now - now % 60
+    previous = current - 60
+    writer._write(db, [online(previous + 10, 10.0), online(previous + 20, 20.0), offline(previous + 30)])
+    # 下一分钟的采样到达后上一分钟的桶结束并写入
+    writer._write(db, [online(current + 5, 50.0)])
+
+    assert tuple(minute_row(db, previous)) == (15.0, 10.0, 20.0, 2, 1)
+    # 离线采样不写 history
+    assert db.execute('SELECT COUNT(*) FROM history WHERE ip = ? AND record_time < ?',
+                      [IP, current]).fetchone()[0] == 2
+
+
+def test_late_rows_recompute_bucket_from_history(db):
+    writer = monitor.HistoryWriter()
+    now = int(time.time())
+    current = now - now % 60
+    previous = current - 60
+    writer._write(db, [online(previous + 10, 10.0), online(previous + 20, 20.0), offline(previous + 30)])
+    writer._write(db, [online(current + 5, 50.0)])
+
+    # 迟到的在线 / 超时采样：在线值从 history 重算，离线数在已写入的值上累加
+    writer._write(db, [online(previous + 40, 90.0), offline(previous + 50, 'timeout')])
+    assert tuple(minute_row(db, previous)) == (40.0, 10.0, 90.0, 3, 2)
+
+    # 再次有迟到数据：重算包含全部原始数据，已计入的离线数不重复累加
+    writer._write(db, [online(previous + 45, 40.0)])
+    assert tuple(minute_row(db, previous)) == (40.0, 10.0, 90.0, 4, 2)
+
+
+def test_recompute_rollup_without_existing_row(db):
+    now = int(time.time())
+    start = now - now % 3600 - 3600
+    with db:
+        db.executemany(monitor.HistoryWriter.INSERT_SQL,
+                       [online(start + 60, 30.0), online(start + 120, 70.0), online(start + 3600, 99.0)])
+        monitor.recompute_rollup(db, '1h', IP, start, late_offline=2)
+    row = db.execute('SELECT cpu, cpu_max, online_count, offline_count FROM history_1h WHERE ip = ? AND record_time = ?',
+                     [IP, start]).fetchone()
+    assert tuple(row) == (50.0, 70.0, 2, 2)
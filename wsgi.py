@@ -0,0 +1,11 @@
+"""生产环境 WSGI 入口（Web 进程不运行采集）
+
+    gunicorn -w 4 -k gthread --threads 16 -b 0.0.0.0:5000 wsgi:app   # Web（可加 --preload）
+    COLLECTOR_MODE=off 下另行运行：python app.py collector [进程数]      # 采集
+
+每个 SSE 连接（/api/stream）占用一个工作线程：每个 worker 最多接受 SSE_MAX_CLIENTS（默认 8）个，
+需小于 --threads，超出的客户端收到 503 后改为轮询 /api/dashboard。
+"""
+from app import create_app
+
+app = create_app()